@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Compares cold and warm "da --help" times with binary and yaml assistant cache.
+
+Usage: python benchmarks/cache_formats.py [NODES [RUNS]]
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+import time
+
+import synthetic
+
+
+def run_da(env, args):
+    start = time.time()
+    subprocess.call([sys.executable, '-m', 'devassistant.cli.cli_runner'] + args, env=env,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return time.time() - start
+
+
+def bench(env, fmt, runs):
+    env = dict(env, DEVASSISTANT_CACHE_FORMAT=fmt)
+    cold = []
+    warm = []
+    for i in range(runs):
+        synthetic.remove_caches(env)
+        cold.append(run_da(env, ['--help']))
+        warm.append(run_da(env, ['--help']))
+    return min(cold), min(warm)
+
+
+def main():
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    tmpdir, env, paths = synthetic.make_env(nodes)
+    try:
+        print('{0} assistants, best of {1} runs'.format(len(paths), runs))
+        print('{0:<8} {1:>10} {2:>10}'.format('format', 'cold [s]', 'warm [s]'))
+        for fmt in ['yaml', 'binary']:
+            cold, warm = bench(env, fmt, runs)
+            print('{0:<8} {1:>10.3f} {2:>10.3f}'.format(fmt, cold, warm))
+    finally:
+        synthetic.remove_env(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""Compares substitution of variables in literals of expressions (see lang._substitute_literal)
+with the previous approach, that replaced every known variable in every literal.
+
+Usage: python benchmarks/literals.py [VARIABLES [ROUNDS]]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+import six
+
+from devassistant import lang
+
+LITERALS = ['"plain literal without variables"',
+            '"$name-$version.tar.gz"',
+            '"$var_1/$var_250/$var_499/$unknown"']
+
+
+def replace_all(literal, names):
+    """Previous substitution - sort all names and replace each of them, longest first."""
+    value = literal
+    for v in reversed(sorted(names.keys())):
+        value = value.replace('$' + v, six.text_type(names[v]))
+    return value
+
+
+def make_names(variables):
+    names = dict(('var_{0}'.format(i), 'value {0}'.format(i)) for i in range(variables))
+    names.update({'name': 'foo', 'version': '1.0', '__env__': {}, '__files__': [{}]})
+    return names
+
+
+def main():
+    variables = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    names = make_names(variables)
+    print('{0} variables, {1} rounds'.format(len(names), rounds))
+    print('{0:<42} {1:>12} {2:>12}'.format('literal', 'replace [s]', 'indexed [s]'))
+    for literal in LITERALS:
+        assert replace_all(literal, names) == lang._substitute_literal(literal, names)
+        old = timeit.timeit(lambda: replace_all(literal, names), number=rounds)
+        new = timeit.timeit(lambda: lang.evaluate_expression(literal, names), number=rounds)
+        print('{0:<42} {1:>12.4f} {2:>12.4f}'.format(literal, old, new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Helpers for generating synthetic assistant/snippet trees for benchmarks."""
+import os
+import shutil
+import tempfile
+
+ASSISTANT_TEMPLATE = '''fullname: Assistant {name}
+description: Synthetic assistant {name} generated for benchmarking.
+
+dependencies:
+- rpm: [{name}]
+
+args:
+  name:
+    use: common_args
+  {name}_opt:
+    flags: [--{name}-opt]
+    help: Option of {name}.
+
+files:
+  tpl:
+    source: {name}.tpl
+
+run:
+- log_i: Running {name}
+- if $name:
+  - $result~: $(echo $name)
+- use: common_args.run
+'''
+
+SNIPPET_TEMPLATE = '''args:
+  name:
+    flags: [-n, --name]
+    help: Name of project to create.
+
+run:
+- log_d: snippet {name}
+'''
+
+
+def generate_tree(root, nodes, fanout=10, snippets=1, roles=('crt',)):
+    """Generates a DevAssistant load path with given number of assistant nodes.
+
+    Assistants are spread among given roles, each assistant has at most "fanout"
+    subassistants. All assistants use the "common_args" snippet, "snippets" - 1 more
+    snippets are generated to make the snippet directory realistically sized.
+
+    Args:
+        root: directory to create the load path in (created if it doesn't exist)
+        nodes: number of assistants to generate
+        fanout: maximum number of subassistants of one assistant
+        snippets: number of snippets to generate
+        roles: roles to distribute the assistants among
+    Returns:
+        list of assistant paths, e.g. [['crt', 'a0'], ['crt', 'a0', 'a0_0'], ...]
+    """
+    snip_dir = os.path.join(root, 'snippets')
+    _makedirs(snip_dir)
+    for i in range(snippets):
+        name = 'common_args' if i == 0 else 'snippet{0}'.format(i)
+        with open(os.path.join(snip_dir, name + '.yaml'), 'w') as f:
+            f.write(SNIPPET_TEMPLATE.format(name=name))
+
+    # breadth first generation, so that the tree has reasonable depth
+    queue = [[role] for role in roles]
+    paths = []
+    i = 0
+    while len(paths) < nodes:
+        parent = queue.pop(0)
+        for j in range(fanout if len(parent) > 1 else max(fanout, nodes // len(roles) // 10)):
+            if len(paths) >= nodes:
+                break
+            name = 'a{0}'.format(i) if len(parent) == 1 else '{0}_{1}'.format(parent[-1], j)
+            i += 1
+            path = parent + [name]
+            directory = os.path.join(root, 'assistants', *parent)
+            _makedirs(directory)
+            with open(os.path.join(directory, name + '.yaml'), 'w') as f:
+                f.write(ASSISTANT_TEMPLATE.format(name=name))
+            paths.append(path)
+            queue.append(path)
+    return paths
+
+
+def make_env(nodes, **kwargs):
+    """Creates a temporary DevAssistant home and load path with a synthetic tree.
+
+    Returns:
+        tuple (tmpdir, env, paths) - tmpdir should be removed by remove_env when no
+        longer needed, env is a copy of os.environ pointing DevAssistant to tmpdir,
+        paths is the list of generated assistant paths (see generate_tree)
+    """
+    tmpdir = tempfile.mkdtemp(prefix='da-bench-')
+    home = os.path.join(tmpdir, 'home')
+    data = os.path.join(tmpdir, 'data')
+    paths = generate_tree(data, nodes, **kwargs)
+    _makedirs(home)
+    env = dict(os.environ)
+    env['DEVASSISTANT_HOME'] = home
+    env['DEVASSISTANT_PATH'] = data
+    env['HOME'] = home
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        [p for p in [os.environ.get('PYTHONPATH')] if p])
+    return tmpdir, env, paths
+
+
+def remove_caches(env):
+    """Removes all caches (and bundle) from DevAssistant home of given environment."""
+    home = env['DEVASSISTANT_HOME']
+    for name in os.listdir(home):
+        if name.startswith('.cache') or name == '.bundle':
+            path = os.path.join(home, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+
+
+def remove_env(tmpdir):
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _makedirs(d):
+    if not os.path.exists(d):
+        os.makedirs(d)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""Counts filesystem syscalls done by DevAssistant startup on synthetic assistant trees
+and compares them with a stored baseline (syscalls_baseline.json next to this file).
+
+Each scenario is run twice in a fresh interpreter - first with no cache (cold), then with
+the cache written by the first run (warm). Syscalls are counted either by wrapping
+filesystem functions of "os" and "open" in the interpreter that runs DevAssistant
+(default, independent of the machine) or by "strace -f -c", if --strace is given and
+strace is available (includes syscalls done by Python itself, e.g. when importing).
+
+Usage: python benchmarks/syscalls.py [--nodes N [N ...]] [--strace] [--callers]
+                                     [--update] [--tolerance T]
+
+Exits with 1 if any count exceeds its baseline by more than the tolerance.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+try:
+    import synthetic
+except ImportError:
+    from benchmarks import synthetic
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'syscalls_baseline.json')
+
+# functions of "os" module that end up as filesystem syscalls; os.path functions
+#  (exists, isdir, getctime, ...) and os.makedirs are implemented by these
+OS_FUNCTIONS = ['access', 'chmod', 'listdir', 'lstat', 'mkdir', 'open', 'readlink',
+                'rename', 'replace', 'rmdir', 'scandir', 'stat', 'unlink', 'utime']
+
+# scenarios to count, functions of (paths of generated assistants) returning da arguments
+SCENARIOS = collections.OrderedDict([
+    ('help', lambda paths: ['--help']),
+    ('assistant-help', lambda paths: paths[0] + ['-h']),
+    ('noop-run', lambda paths: ['crt', 'noop']),
+])
+
+NOOP_ASSISTANT = '''fullname: No-op
+description: Synthetic assistant that does nothing.
+
+run:
+- log_d: Nothing to do
+'''
+
+
+def _child_code():
+    """Returns code of the child interpreter that counts calls of OS_FUNCTIONS and open
+    while running DevAssistant; its argv is [output file, callers (0/1), da args ...]."""
+    return '''
+import atexit, collections, io, json, os, sys
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+_real_open = builtins.open
+out, callers, args = sys.argv[1], sys.argv[2] == '1', sys.argv[3:]
+counts = collections.Counter()
+sites = collections.Counter()
+marker = os.sep + 'devassistant' + os.sep
+
+def caller():
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if marker in filename:
+            return '{0}:{1} {2}'.format(filename.rsplit(marker, 1)[1], frame.f_lineno,
+                                        frame.f_code.co_name)
+        frame = frame.f_back
+    return '<outside devassistant>'
+
+def wrap(module, name):
+    orig = getattr(module, name)
+    def wrapper(*a, **kw):
+        counts[name] += 1
+        if callers:
+            sites[caller()] += 1
+        return orig(*a, **kw)
+    setattr(module, name, wrapper)
+
+for name in %r:
+    if hasattr(os, name):
+        wrap(os, name)
+wrap(builtins, 'open')
+io.open = builtins.open
+
+def dump():
+    with _real_open(out, 'w') as f:
+        json.dump({'counts': counts, 'sites': sites}, f)
+# registered first, so it runs after DevAssistant's exit handlers (cache flushing, ...)
+atexit.register(dump)
+
+sys.argv = ['da'] + args
+from devassistant.cli.cli_runner import CliRunner
+try:
+    CliRunner.run()
+except BaseException as e:
+    if not isinstance(e, SystemExit):
+        sys.stderr.write('{0}: {1}\\n'.format(type(e).__name__, e))
+''' % (OS_FUNCTIONS, )
+
+
+def count_wrapped(env, args, callers=False):
+    """Runs "da args" in a fresh interpreter with wrapped filesystem functions.
+
+    Returns:
+        tuple (Counter of calls per function, Counter of calls per DevAssistant call site)
+    """
+    fd, out = tempfile.mkstemp(prefix='da-syscalls-', suffix='.json')
+    os.close(fd)
+    try:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call([sys.executable, '-c', _child_code(), out,
+                             '1' if callers else '0'] + args,
+                            env=env, stdout=devnull, stderr=devnull)
+        with open(out) as f:
+            result = json.load(f)
+    finally:
+        os.unlink(out)
+    return collections.Counter(result['counts']), collections.Counter(result['sites'])
+
+
+def count_strace(env, args, callers=False):
+    """Runs "da args" under "strace -f -c" and returns Counter of calls per filesystem
+    syscall (and an empty Counter, strace can't tell DevAssistant call sites)."""
+    fd, out = tempfile.mkstemp(prefix='da-strace-')
+    os.close(fd)
+    try:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(['strace', '-f', '-c', '-e', 'trace=%file', '-o', out,
+                             sys.executable, '-m', 'devassistant.cli.cli_runner'] + args,
+                            env=env, stdout=devnull, stderr=devnull)
+        counts = collections.Counter()
+        with open(out) as f:
+            for line in f:
+                fields = line.split()
+                # rows are "% time, seconds, usecs/call, calls, [errors], syscall"
+                if len(fields) >= 5 and fields[3].isdigit() and fields[-1] != 'total':
+                    counts[fields[-1]] += int(fields[3])
+    finally:
+        os.unlink(out)
+    return counts, collections.Counter()
+
+
+def has_strace():
+    with open(os.devnull, 'w') as devnull:
+        try:
+            return subprocess.call(['strace', '-V'], stdout=devnull, stderr=devnull) == 0
+        except OSError:
+            return False
+
+
+def measure(nodes, method='wrap', callers=False):
+    """Generates a synthetic tree of given size and counts syscalls of all scenarios.
+
+    Returns:
+        tuple (dict {'<scenario>/<cold|warm>': total count}, dict of the same keys
+        mapping to Counters of calls per function, dict of the same keys mapping to
+        Counters of calls per call site)
+    """
+    counter = count_strace if method == 'strace' else count_wrapped
+    tmpdir, env, paths = synthetic.make_env(nodes)
+    with open(os.path.join(tmpdir, 'data', 'assistants', 'crt', 'noop.yaml'), 'w') as f:
+        f.write(NOOP_ASSISTANT)
+    totals, per_function, per_site = {}, {}, {}
+    try:
+        for scenario, get_args in SCENARIOS.items():
+            synthetic.remove_caches(env)
+            for temperature in ['cold', 'warm']:
+                key = '{0}/{1}'.format(scenario, temperature)
+                per_function[key], per_site[key] = counter(env, get_args(paths), callers)
+                totals[key] = sum(per_function[key].values())
+    finally:
+        synthetic.remove_env(tmpdir)
+    return totals, per_function, per_site
+
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(baseline, path=BASELINE_FILE):
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(totals, baseline, tolerance):
+    """Returns list of (key, count, baseline count) of counts that exceed their baseline
+    by more than tolerance (a fraction, e.g. 0.1 is 10 %)."""
+    return [(k, totals[k], baseline[k]) for k in sorted(totals)
+            if k in baseline and totals[k] > baseline[k] * (1 + tolerance)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='sizes of synthetic trees (number of assistants)')
+    parser.add_argument('--strace', action='store_true',
+                        help='count syscalls by strace instead of wrapping os functions')
+    parser.add_argument('--callers', action='store_true',
+                        help='show DevAssistant call sites doing most syscalls')
+    parser.add_argument('--update', action='store_true',
+                        help='store measured counts as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative regression (default: 0.1)')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file')
+    args = parser.parse_args(argv)
+
+    method = 'wrap'
+    if args.strace:
+        if has_strace():
+            method = 'strace'
+        else:
+            print('strace is not available, wrapping os functions instead', file=sys.stderr)
+    baseline = load_baseline(args.baseline)
+    stored = baseline.setdefault(method, {})
+    regressions = []
+    print('{0:<6} {1:<22} {2:>8} {3:>9}'.format('nodes', 'scenario', 'calls', 'baseline'))
+    for nodes in args.nodes:
+        totals, per_function, per_site = measure(nodes, method=method, callers=args.callers)
+        node_baseline = stored.get(str(nodes), {})
+        for key in sorted(totals):
+            print('{0:<6} {1:<22} {2:>8} {3:>9}'.format(nodes, key, totals[key],
+                                                       node_baseline.get(key, '-')))
+            if args.callers:
+                for site, count in per_site[key].most_common(10):
+                    print('{0:>14} {1}'.format(count, site))
+        regressions.extend((nodes, ) + r
+                           for r in compare(totals, node_baseline, args.tolerance))
+        if args.update:
+            stored[str(nodes)] = totals
+
+    if args.update:
+        save_baseline(baseline, args.baseline)
+        print('Baseline stored in {0}'.format(args.baseline))
+        return 0
+    for nodes, key, count, base in regressions:
+        print('REGRESSION: {0} nodes, {1}: {2} calls, baseline is {3}'.format(
+            nodes, key, count, base), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,4 @@
 #!/usr/bin/env python
-from devassistant.cli.cli_runner import CliRunner
+from devassistant.daemon_client import run
 
-CliRunner.run()
+run()
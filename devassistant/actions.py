@@ -9,11 +9,15 @@ except ImportError:
     from yaml import Loader
 
 from devassistant import argument
+from devassistant import bin
+from devassistant import bundle
+from devassistant import cache
 from devassistant import exceptions
 from devassistant import lang
 from devassistant import settings
 from devassistant import utils
 from devassistant.logger import logger
+from devassistant.yaml_assistant_loader import YamlAssistantLoader
 from devassistant import dapi
 from devassistant.dapi import dapicli
 import logging
@@ -162,6 +166,172 @@ class EvalAction(Action):
         return to_run
 
 
+class CacheBuildAction(Action):
+    """Builds cache of all assistants"""
+    name = 'build'
+    description = 'Builds cache of all assistants, so that DevAssistant starts faster.'
+    args = [
+        argument.Argument('system', '--system', action='store_true', default=False,
+                          help='Build read-only cache in system-wide assistant directories '
+                               '(those outside of {0}), e.g. when installing assistants '
+                               'system-wide'.format(settings.DEVASSISTANT_HOME)),
+    ]
+
+    @classmethod
+    def run(cls, **kwargs):
+        try:
+            dirs = YamlAssistantLoader.build_cache(system=kwargs['system'])
+        except (IOError, OSError) as e:
+            msg = 'Failed to build cache: {0}'.format(e)
+            logger.error(msg)
+            raise exceptions.ExecutionException(msg)
+        for d in dirs:
+            logger.info('Built cache of assistants in {0}'.format(d))
+
+
+class CacheRebuildAction(Action):
+    """Rebuilds cache of all assistants from scratch"""
+    name = 'rebuild'
+    description = 'Removes your cache of assistants and builds it again from scratch.'
+
+    @classmethod
+    def run(cls, **kwargs):
+        try:
+            dirs = YamlAssistantLoader.rebuild_cache()
+        except (IOError, OSError) as e:
+            msg = 'Failed to rebuild cache: {0}'.format(e)
+            logger.error(msg)
+            raise exceptions.ExecutionException(msg)
+        for d in dirs:
+            logger.info('Rebuilt cache of assistants in {0}'.format(d))
+
+
+class CacheStatsAction(Action):
+    """Loads all assistants and reports cache statistics"""
+    name = 'stats'
+    description = 'Loads all assistants like DevAssistant does and shows how the cache ' + \
+        'was used (cache hits, misses, refreshes, ...).'
+
+    @classmethod
+    def run(cls, **kwargs):
+        # load all assistants, not just those named on command line
+        cache.stats.reset()
+        settings.LAZY_LOAD_NAMES = None
+        YamlAssistantLoader._assistants = {}
+        YamlAssistantLoader.get_assistants(bin.TopAssistant().get_subassistants())
+        bndl = YamlAssistantLoader.get_bundle()
+        if bndl is not None:
+            logger.info('Assistants were loaded from bundle {0}'.format(bndl.path))
+        stats = cache.stats.as_dict()
+        for counter in cache.stats.counters:
+            logger.info('{0}: {1}'.format(counter, stats[counter]))
+        for reason in stats['fallback_reasons']:
+            logger.warning('Cache was not used for {0}'.format(reason))
+
+
+class CacheDumpAction(Action):
+    """Dumps cache of all assistants as yaml"""
+    name = 'dump'
+    description = 'Prints cache of all assistants (merged from all directories) as yaml.'
+
+    @classmethod
+    def run(cls, **kwargs):
+        try:
+            YamlAssistantLoader.dump_cache(sys.stdout)
+        except (IOError, OSError) as e:
+            msg = 'Failed to dump cache: {0}'.format(e)
+            logger.error(msg)
+            raise exceptions.ExecutionException(msg)
+
+
+class CacheVerifyAction(Action):
+    """Reports cached assistants that need to be rebuilt"""
+    name = 'verify'
+    description = 'Reports cached assistants that need to be rebuilt, e.g. because they ' + \
+        'have changed or were cached by incompatible version of DevAssistant.'
+
+    @classmethod
+    def run(cls, **kwargs):
+        try:
+            problems = YamlAssistantLoader.verify_cache()
+        except (IOError, OSError) as e:
+            msg = 'Failed to verify cache: {0}'.format(e)
+            logger.error(msg)
+            raise exceptions.ExecutionException(msg)
+        for layer_file, path, reason in problems:
+            logger.info('{0}: {1} ({2})'.format(path, reason, layer_file))
+        if problems:
+            logger.info('{0} cache entries need to be rebuilt, run "da cache build" to '
+                        'rebuild them.'.format(len(problems)))
+        else:
+            logger.info('Cache of all assistants is up to date.')
+
+
+@register_action
+class CacheAction(Action):
+    """Manage cache of assistants"""
+    name = 'cache'
+    description = 'Lets you manage cache of assistants.'
+
+    @classmethod
+    def get_subactions(cls):
+        return [
+            CacheBuildAction,
+            CacheDumpAction,
+            CacheRebuildAction,
+            CacheStatsAction,
+            CacheVerifyAction,
+        ]
+
+
+@register_action
+class CompileAction(Action):
+    """Compiles all assistants and snippets into a bundle, see devassistant.bundle"""
+    name = 'compile'
+    description = 'Compiles all assistants and snippets into a single bundle file, that ' + \
+        'DevAssistant uses instead of scanning and parsing them (until they change, ' + \
+        'the bundle must then be compiled again).'
+    args = [
+        argument.Argument('output', '-o', '--output', default=settings.BUNDLE_FILE,
+                          help='File to write the bundle to (default: {0}); DevAssistant only '
+                               'uses bundle from DEVASSISTANT_BUNDLE environment '
+                               'variable or the default location'.format(settings.BUNDLE_FILE)),
+    ]
+
+    @classmethod
+    def run(cls, **kwargs):
+        try:
+            bundle.compile_bundle(kwargs['output'])
+        except (IOError, OSError) as e:
+            msg = 'Failed to compile bundle: {0}'.format(e)
+            logger.error(msg)
+            raise exceptions.ExecutionException(msg)
+        logger.info('Compiled bundle of all assistants and snippets to {0}'.format(
+            kwargs['output']))
+
+
+@register_action
+class DaemonAction(Action):
+    """Runs DevAssistant daemon, see devassistant.daemon"""
+    name = 'daemon'
+    description = 'Run DevAssistant daemon that makes subsequent "da" invocations faster.'
+    args = [argument.Argument('socket', '-s', '--socket', default=settings.DAEMON_SOCKET,
+                              help='Socket to listen on (default: {0})'.format(
+                                  settings.DAEMON_SOCKET))]
+
+    @classmethod
+    def run(cls, **kwargs):
+        # daemon imports cli, which imports this module
+        from devassistant import daemon
+        try:
+            daemon.Daemon.serve(kwargs['socket'])
+        except exceptions.ExecutionException as e:
+            logger.error(str(e))
+            raise
+        except KeyboardInterrupt:
+            logger.info('DevAssistant daemon exiting ...')
+
+
 @register_action
 class HelpAction(Action):
     """Can gather info about all actions and assistant types and print it nicely."""
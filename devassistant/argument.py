@@ -37,16 +37,38 @@ class Argument(object):
         Args:
             parser: parser to add this argument to
         """
-        from devassistant.cli.devassistant_argparse import DefaultIffUsedActionFactory
-        if isinstance(self.kwargs.get('action', ''), list):
-            # see documentation of DefaultIffUsedActionFactory to see why this is necessary
-            if self.kwargs['action'][0] == 'default_iff_used':
-                self.kwargs['action'] = DefaultIffUsedActionFactory.generate_action(
-                    self.kwargs['action'][1])
+        self.add_parser_spec_to(parser, self.get_parser_spec())
+
+    def get_parser_spec(self):
+        """Returns specification of this argument for argparse parser. Unlike the argument
+        itself, it can be stored in cache (see devassistant.cache.ParserSpecCache).
+
+        Returns:
+            tuple (flags, kwargs) that can be passed to add_parser_spec_to
+        """
+        kwargs = dict(self.kwargs)
         # In cli 'preserved' is not supported.
         # It needs to be removed because it is unknown for argparse.
-        self.kwargs.pop('preserved', None)
-        parser.add_argument(*self.flags, **self.kwargs)
+        kwargs.pop('preserved', None)
+        return list(self.flags), kwargs
+
+    @classmethod
+    def add_parser_spec_to(cls, parser, spec):
+        """Adds argument specified by given spec (see get_parser_spec) to argparse parser.
+
+        Args:
+            parser: parser to add the argument to
+            spec: tuple (flags, kwargs) as returned by get_parser_spec
+        """
+        from devassistant.cli.devassistant_argparse import DefaultIffUsedActionFactory
+        flags, kwargs = spec
+        if isinstance(kwargs.get('action', ''), list):
+            # see documentation of DefaultIffUsedActionFactory to see why this is necessary
+            if kwargs['action'][0] == 'default_iff_used':
+                kwargs = dict(kwargs,
+                              action=DefaultIffUsedActionFactory.generate_action(
+                                  kwargs['action'][1]))
+        parser.add_argument(*flags, **kwargs)
 
     def get_dest(self):
         """Get "dest", which represents the name of this argument translated
@@ -103,7 +125,9 @@ class Argument(object):
     @classmethod
     def construct_arg(cls, name, params):
         """Construct an argument from name, and params (dict loaded from assistant/snippet).
+        Given params are not modified, so they can be shared (e.g. with cache).
         """
+        params = dict(params)
         use_snippet = params.pop('use', None)
         if use_snippet:
             # if snippet is used, take this parameter from snippet and update
@@ -7,6 +7,8 @@ from devassistant import settings
 class AssistantBase(object):
     """WARNING: if assigning subassistants in __init__, make sure to override it
     in subclass, so that it doesn't get inherited!"""
+    # subclasses may use __slots__ (see yaml_assistant.AssistantDescriptor)
+    __slots__ = ()
     # Some informations about assistant
     # These should all be present:
     name = 'base'
@@ -60,7 +62,7 @@ class AssistantBase(object):
             a tree-like structure (see above) representing assistant hierarchy going down
             from this assistant to leaf assistants
         """
-        if '_tree' not in dir(self):
+        if getattr(self, '_tree', None) is None:
             subassistant_tree = []
             subassistants = self.get_subassistants()
             for subassistant in subassistants:
@@ -68,9 +70,15 @@ class AssistantBase(object):
             self._tree = (self, subassistant_tree)
         return self._tree
 
+    def get_full_assistant(self):
+        """Returns assistant that can be run in place of this one (self, unless this is just
+        a lightweight descriptor, see yaml_assistant.AssistantDescriptor)."""
+        return self
+
     def get_selected_subassistant_path(self, **kwargs):
         """Recursively searches self._tree - has format of (Assistant: [list_of_subassistants]) -
-        for specific path from first to last selected subassistants.
+        for specific path from first to last selected subassistants. Selected subassistants
+        are upgraded by get_full_assistant.
 
         Args:
             kwargs: arguments containing names of the given assistants in form of
@@ -88,7 +96,7 @@ class AssistantBase(object):
             for sa, subas_list in currently_searching:
                 if sa.name == kwargs[settings.SUBASSISTANT_N_STRING.format(len(path) - 1)]:
                     currently_searching = subas_list
-                    path.append(sa)
+                    path.append(sa.get_full_assistant())
                     break  # sorry if you shed a tear ;)
 
             if subas_list == previous_subas_list:
@@ -0,0 +1,194 @@
+"""Bundle is a single file with everything that DevAssistant loads from its load paths:
+checked assistants (both cached attributes and full bodies), snippets and argument parser
+specifications. It is created by "da compile" (see compile_bundle), e.g. when building
+an immutable container image, so that DevAssistant doesn't need to scan and parse anything
+at runtime.
+
+The file consists of an index written by cache.dump_binary, followed by pickled assistant
+bodies and snippets. The rest of the file is mmap-ed, so only the requested assistants and
+snippets are ever read and unpickled:
+
+{'data_dirs': ['/foo', '/usr/share/devassistant'],
+ # cached hierarchies of assistant roles merged from all directories, see cache.Cache
+ 'roles': {'crt': {...}, 'twk': {...}, ...},
+ 'fingerprints': {'crt': '<fingerprint>', ...},
+ # specifications of argument parsers of roles, see cache.ParserSpecCache
+ 'specs': {'crt': ('<fingerprint>', [...]), ...},
+ # offsets and lengths of pickled bodies (relative to the end of the index)
+ 'bodies': {'/foo/assistants/crt/c.yaml': (ctime, offset, length), ...},
+ # offsets and lengths of pickled snippet files, see cache.SnippetIndex
+ 'snippets': {'common_args': (offset, length), ...}}
+"""
+import mmap
+import os
+
+from six.moves import cPickle as pickle
+
+from devassistant import cache
+from devassistant import lang
+from devassistant.logger import logger
+from devassistant import settings
+from devassistant import yaml_loader
+
+
+class Bundle(object):
+    """Representation of a compiled bundle file, see module docstring. Once loaded, it can
+    be used in place of cache.LayeredCache by YamlAssistantLoader."""
+    # bundles loaded by get_default, {path: Bundle instance or None}
+    _loaded = {}
+
+    def __init__(self, path):
+        """Loads index of given bundle file and mmaps the rest of it.
+
+        Args:
+            path: path to the bundle file
+        Raises:
+            IOError or OSError if the file can't be read or wasn't compiled by this version
+            of DevAssistant
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self.index = cache.load_binary(f)
+            if self.index is None:
+                raise IOError('{0} is not a bundle of this DevAssistant version'.format(path))
+            self._start = f.tell()
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data_dirs = self.index['data_dirs']
+        self.cache = self.index['roles']
+
+    @classmethod
+    def get_default(cls):
+        """Returns Bundle loaded from settings.BUNDLE_FILE, if it can be used, i.e. it exists,
+        was compiled by this version of DevAssistant from the current
+        settings.DATA_DIRECTORIES and settings.USE_CACHE is True; returns None otherwise.
+        The bundle is only loaded once per process.
+        """
+        if not settings.USE_CACHE:
+            return None
+        path = settings.BUNDLE_FILE
+        if path not in cls._loaded:
+            bundle = None
+            if os.path.exists(path):
+                try:
+                    bundle = cls(path)
+                except BaseException as e:
+                    logger.debug('Failed to use DevAssistant bundle {0}: {1}'.format(path, e))
+            cls._loaded[path] = bundle
+        bundle = cls._loaded[path]
+        if bundle is not None and bundle.data_dirs != settings.DATA_DIRECTORIES:
+            return None
+        return bundle
+
+    def _read(self, offset, length):
+        start = self._start + offset
+        return pickle.loads(self._mmap[start:start + length])
+
+    def fingerprint(self, role):
+        """Returns fingerprint of cached hierarchy of given role, see cache.Cache.fingerprint."""
+        return self.index['fingerprints'].get(role)
+
+    def get_body(self, role, source, ctime):
+        """Returns full parsed body of given assistant, see cache.Cache.get_body."""
+        body_ctime, offset, length = self.index['bodies'].get(source, (None, 0, 0))
+        if body_ctime != ctime:
+            return None
+        try:
+            return self._read(offset, length)
+        except Exception as e:
+            logger.debug('Failed to unpickle body of {0} from bundle: {1}'.format(source, e))
+            return None
+
+    def get_spec_cache(self):
+        """Returns cache.ParserSpecCache with argument parser specifications from the bundle
+        (it is only kept in memory)."""
+        spec_cache = cache.ParserSpecCache(None)
+        spec_cache.specs = dict(self.index['specs'])
+        return spec_cache
+
+    def get_snippet_index(self, dirs):
+        """Returns snippet index of given snippet directories that reads snippets from the
+        bundle (see BundleSnippetIndex)."""
+        return BundleSnippetIndex(self, dirs)
+
+
+class BundleSnippetIndex(object):
+    """Snippet index with the same interface as cache.SnippetIndex, that reads snippets
+    from a bundle."""
+
+    def __init__(self, bundle, dirs):
+        self.bundle = bundle
+        self.dirs = list(dirs)
+        self.index_file = None
+        self._files = {}
+
+    def names(self):
+        return list(self.bundle.index['snippets'].keys())
+
+    def get(self, name):
+        if name not in self._files:
+            offset, length = self.bundle.index['snippets'].get(name, (None, None))
+            self._files[name] = None if offset is None else self.bundle._read(offset, length)
+        return self._files[name]
+
+    def write(self):
+        pass
+
+
+def compile_bundle(path=settings.BUNDLE_FILE):
+    """Compiles all assistants and snippets from settings.DATA_DIRECTORIES into a bundle
+    file. Assistants are refreshed in user's cache on the way, so their bodies don't need
+    to be parsed again, if they're already cached.
+
+    Args:
+        path: path to write the bundle to
+    """
+    # these import (indirectly) this module
+    from devassistant.cli.argparse_generator import ArgparseGenerator
+    from devassistant.yaml_assistant_loader import YamlAssistantLoader
+    from devassistant.yaml_snippet_loader import YamlSnippetLoader
+
+    # the bundle that is being replaced must not be used while compiling
+    Bundle._loaded[settings.BUNDLE_FILE] = None
+    YamlSnippetLoader._snippets = {}
+    YamlSnippetLoader._index = None
+    cch = cache.LayeredCache()
+    index = {'data_dirs': list(settings.DATA_DIRECTORIES),
+             'roles': {}, 'fingerprints': {}, 'specs': {}, 'bodies': {}, 'snippets': {}}
+    blobs = []
+    offset = [0]
+
+    def add_blob(data):
+        pickled = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        blobs.append(pickled)
+        offset[0] += len(pickled)
+        return offset[0] - len(pickled), len(pickled)
+
+    for role in settings.ASSISTANT_ROLES:
+        cch.refresh_role(role, YamlAssistantLoader.get_layers(role))
+        hierarchy = cch.cache[role]
+        index['roles'][role] = hierarchy
+        index['fingerprints'][role] = cch.fingerprint(role)
+        index['specs'][role] = (cch.fingerprint(role),
+                                ArgparseGenerator.get_cached_hierarchy_specs(hierarchy))
+        for source, ctime in cache.hierarchy_sources(hierarchy):
+            body = cch.get_body(role, source, ctime)
+            if body is None:
+                body = yaml_loader.YamlLoader.load_yaml_by_path(source)
+                lang.lower_sections(body)
+            index['bodies'][source] = (ctime, ) + add_blob(body)
+    cch.flush()
+
+    snippet_index = cache.SnippetIndex(YamlSnippetLoader.snippets_dirs, index_file=None)
+    for name in snippet_index.names():
+        snippet_file = snippet_index.get(name)
+        if snippet_file is not None:
+            index['snippets'][name] = add_blob(snippet_file)
+
+    def write_func(f):
+        cache.dump_binary(index, f)
+        for blob in blobs:
+            f.write(blob)
+    if not os.path.exists(os.path.dirname(os.path.abspath(path))):
+        os.makedirs(os.path.dirname(os.path.abspath(path)))
+    cache.write_atomically(os.path.abspath(path), write_func)
+    Bundle._loaded.pop(settings.BUNDLE_FILE, None)
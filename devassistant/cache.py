@@ -1,5 +1,15 @@
+import atexit
+import binascii
+import contextlib
+import errno
+import hashlib
 import os
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
 
+from six.moves import cPickle as pickle
 import yaml
 try:
     from yaml import CDumper as Dumper
@@ -8,16 +18,300 @@ except ImportError:
 
 import devassistant
 
+from devassistant.logger import logger
 from devassistant import settings
+from devassistant import utils
 from devassistant import yaml_checker
 from devassistant import yaml_loader
 from devassistant import yaml_snippet_loader
 
 
+# binary cache files start with this, so that we can tell them from yaml cache files
+CACHE_MAGIC = b'DACACHE\n'
+# bump this whenever the layout of cache files changes; structure of cached assistants
+#  is versioned separately by ASSISTANT_SCHEMA
+CACHE_SCHEMA = 4
+# version of structure of cached assistants (see Cache), stored in each of them; bump this
+#  whenever the structure or the way of computing cached attributes changes and add
+#  migration from the previous version to ASSISTANT_MIGRATIONS, if possible
+ASSISTANT_SCHEMA = 1
+
+
+class CacheStats(object):
+    """Counters of events of cache in current process:
+
+    - hits: cached assistants used without refreshing them
+    - misses: assistants that weren't cached and had to be loaded
+    - refreshes: cached assistants that had to be refreshed (see Cache._get_refresh_reason)
+    - removals: cached assistants, whose files were removed
+    - snippet_ctime_lookups: snippet ctimes looked up to check cached assistants
+    - body_hits: assistants fully loaded from cached bodies (see Cache.get_body)
+    - body_misses: assistants fully loaded by parsing their yaml files
+    - fallbacks: roles loaded without cache, because using it failed (reasons of the
+      failures are in self.fallback_reasons)
+    """
+    counters = ['hits', 'misses', 'refreshes', 'removals', 'snippet_ctime_lookups',
+                'body_hits', 'body_misses', 'fallbacks']
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.values = dict((c, 0) for c in self.counters)
+        self.fallback_reasons = []
+
+    def incr(self, counter, n=1):
+        self.values[counter] += n
+
+    def fallback(self, reason):
+        """Records that cache couldn't be used because of given reason."""
+        self.incr('fallbacks')
+        self.fallback_reasons.append(reason)
+
+    def as_dict(self):
+        """Returns all counters and fallback reasons as a dict."""
+        return dict(self.values, fallback_reasons=list(self.fallback_reasons))
+
+    def log_record(self):
+        """Logs all counters as a debug record with event_type "cache_stats"; the counters
+        are also in "cache_stats" attribute of the record. Nothing is logged if there
+        were no events."""
+        if not any(self.values.values()):
+            return
+        msg = 'Cache stats: ' + ', '.join('{0}={1}'.format(c, self.values[c])
+                                          for c in self.counters)
+        logger.debug(msg, extra={'event_type': 'cache_stats', 'cache_stats': self.as_dict()})
+
+
+# counters of cache events in this process, logged when DevAssistant exits
+stats = CacheStats()
+
+
+def _header():
+    # lowered sections (see lang.Section) are pickled in bodies of assistants and snippets,
+    #  so data written with a different IR_VERSION can't be used
+    from devassistant import lang
+    return {'schema': CACHE_SCHEMA, 'version': devassistant.__version__,
+            'ir_version': lang.IR_VERSION}
+
+
+def load_binary(f, any_version=False, any_ir_version=True):
+    """Loads data written by dump_binary from given file object.
+
+    Args:
+        f: file object to load from
+        any_version: if True, data written by any DevAssistant version are loaded (as long
+                     as they have the same cache schema)
+        any_ir_version: if False and any_version is True, the data must have been written
+                        with the current lang.IR_VERSION (if any_version is False, this is
+                        always checked)
+    Returns:
+        loaded data or None if the file is not a binary cache file or was created
+        with different DevAssistant version, cache schema or IR version (or is unreadable)
+    """
+    if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+        return None
+    try:
+        header = pickle.load(f)
+        expected = _header()
+        if header.get('schema') != CACHE_SCHEMA or \
+                (not any_version and header != expected) or \
+                (not any_ir_version and header.get('ir_version') != expected['ir_version']):
+            return None
+        return pickle.load(f)
+    except Exception:
+        return None
+
+
+def dump_binary(data, f):
+    """Writes CACHE_MAGIC, header and pickled data to given file object."""
+    f.write(CACHE_MAGIC)
+    pickle.dump(_header(), f, pickle.HIGHEST_PROTOCOL)
+    pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+
+
+def _create_temp_file(path):
+    """Creates a new temporary file next to given path. Unlike tempfile.mkstemp, which only
+    makes the file readable by current user, the file gets permissions according to umask,
+    like open() does (umask can't be read without changing it, which would be racy).
+
+    Returns:
+        tuple (file descriptor opened for writing, path of the file)
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        tmp_path = '{0}.tmp{1}'.format(path, binascii.hexlify(os.urandom(6)).decode('ascii'))
+        try:
+            return os.open(tmp_path, flags, 0o666), tmp_path
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def write_atomically(path, write_func, mode='wb'):
+    """Calls write_func with a temporary file object and then renames the temporary
+    file to path, so that readers of path never see a partially written file.
+
+    Args:
+        path: path of the file to write
+        write_func: function that accepts file object and writes the content to it
+        mode: mode to open the temporary file with
+    """
+    fd, tmp_path = _create_temp_file(path)
+    try:
+        with os.fdopen(fd, mode) as f:
+            write_func(f)
+        os.rename(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def locked(path, exclusive):
+    """Context manager that holds advisory lock of lock file for given path (shared one
+    for readers, exclusive one for writers). Does nothing if fcntl is not available."""
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def merge_hierarchies(hierarchies):
+    """Merges given cache (or file) hierarchies of the same role from more directories into
+    one, using the same rules as YamlAssistantLoader.get_assistants_file_hierarchy: if there
+    are assistants with the same name in more hierarchies, the one from the first hierarchy
+    wins and subassistants of all of them are merged (recursively). Assistants without
+    source (directories with subassistants, see get_assistants_file_hierarchy) are only
+    used for their subassistants. Given hierarchies are not modified.
+
+    Args:
+        hierarchies: list of hierarchies ordered by precedence
+    Returns:
+        the merged hierarchy
+    """
+    result = {}
+    for hierarchy in hierarchies:
+        for name in hierarchy:
+            if name in result:
+                continue
+            nodes = [h[name] for h in hierarchies if name in h]
+            winner = next((n for n in nodes if n['source'] is not None), None)
+            if winner is None:
+                continue
+            result[name] = dict(winner)
+            if winner['subhierarchy'] is not None:
+                result[name]['subhierarchy'] = merge_hierarchies(
+                    [n['subhierarchy'] for n in nodes if n['subhierarchy'] is not None])
+    return result
+
+
+def _seconds_to_ns(ctime):
+    # float seconds can't hold ns precisely (the error is below a microsecond for current
+    #  times), so round up, otherwise ctime of unchanged file may look newer than cached one
+    return int(ctime * 10 ** 9) + 1000
+
+
+def _migrate_0(cached_ass):
+    # assistants cached before they were versioned have the same structure, except that
+    #  their ctimes and ctimes of their snippets are float seconds (os.path.getctime)
+    if isinstance(cached_ass.get('ctime'), float):
+        cached_ass['ctime'] = _seconds_to_ns(cached_ass['ctime'])
+    cached_ass['snippets'] = dict((name, _seconds_to_ns(ctime) if isinstance(ctime, float)
+                                   else ctime)
+                                  for name, ctime in cached_ass.get('snippets', {}).items())
+    return cached_ass
+
+
+# functions that migrate cached assistant from version (key) to the next one
+ASSISTANT_MIGRATIONS = {0: _migrate_0}
+
+
+def migrate_hierarchy(cached_hierarchy):
+    """Migrates assistants in given cache hierarchy (in place) to ASSISTANT_SCHEMA by
+    ASSISTANT_MIGRATIONS. Assistants that can't be migrated are left as they are (they get
+    refreshed, see Cache._get_refresh_reason).
+
+    Returns:
+        True if any assistant has been migrated, False otherwise
+    """
+    migrated = False
+    for name, cached_ass in cached_hierarchy.items():
+        schema = cached_ass.get('schema', 0)
+        if schema < ASSISTANT_SCHEMA and \
+                all(s in ASSISTANT_MIGRATIONS for s in range(schema, ASSISTANT_SCHEMA)):
+            for s in range(schema, ASSISTANT_SCHEMA):
+                cached_ass = ASSISTANT_MIGRATIONS[s](cached_ass)
+            cached_ass['schema'] = ASSISTANT_SCHEMA
+            cached_hierarchy[name] = cached_ass
+            migrated = True
+        migrated |= migrate_hierarchy(cached_ass['subhierarchy'])
+    return migrated
+
+
+def hierarchy_sources(cached_hierarchy):
+    """Yields tuples (source, ctime) of all assistants in given cache hierarchy (except
+    those without source)."""
+    for ass in cached_hierarchy.values():
+        if ass['source'] is not None:
+            yield ass['source'], ass.get('ctime')
+        for s in hierarchy_sources(ass['subhierarchy']):
+            yield s
+
+
+def fingerprint_hierarchy(cached_hierarchy):
+    """Returns hex digest computed from sources, ctimes and snippet ctimes of assistants in
+    given cache hierarchy, see Cache.fingerprint."""
+    data = repr(_fingerprint_data(cached_hierarchy))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _fingerprint_data(cached_hierarchy):
+    return tuple((name,
+                  ass['source'],
+                  ass.get('ctime'),
+                  tuple(sorted(ass['snippets'].items())),
+                  _fingerprint_data(ass['subhierarchy']))
+                 for name, ass in sorted(cached_hierarchy.items()))
+
+
 class Cache(object):
     """Representation of DevAssistant cache file.
-    Cache is stored in yaml file between devassistant invocations. Once it is loaded,
-    it has following structure:
+    Cache is stored in files between devassistant invocations. By default, the files
+    are binary (see settings.CACHE_FORMAT) - each of them consists of CACHE_MAGIC, pickled
+    header ({'schema': CACHE_SCHEMA, 'version': devassistant.__version__,
+    'ir_version': lang.IR_VERSION}) and pickled
+    data. The header is checked before the data itself is unpickled. The cache file only
+    contains {'version': devassistant.__version__}, each role is stored in a separate
+    file "<cache file>.<role>", so that a change in one role doesn't rewrite other roles.
+    For debugging, the cache can also be stored as a single yaml file (or exported to it,
+    see dump_yaml).
+
+    Cache files written by other DevAssistant versions are used as long as they have
+    the same CACHE_SCHEMA. Each cached assistant carries version of its structure
+    (ASSISTANT_SCHEMA); assistants cached with older versions are migrated when loaded
+    (see migrate_hierarchy) and those that can't be migrated are refreshed.
+
+    If settings.CACHE_BODIES is True and the format is binary, full parsed and checked
+    bodies of assistants are stored in "<role file>.bodies", so that fully loading
+    an assistant doesn't need to parse its yaml file (see get_body). The file consists of
+    an index {source: (ctime, offset, length)} written by dump_binary, followed by pickled
+    bodies; only the requested bodies are ever unpickled. A body is only used if its
+    ctime is the same as ctime of the cached assistant, so it is invalidated together
+    with cached attributes. Bodies contain lowered sections (see lang.Section), so a bodies
+    file written with different lang.IR_VERSION is not used and all assistants of its role
+    are refreshed (bodies that can't be unpickled are just parsed from yaml again).
+
+    Changed roles are only written by flush, which should be called once all roles
+    are refreshed. Files are written atomically (to a temporary file, which is then
+    renamed) and writers and readers hold advisory lock of "<cache file>.lock".
+
+    Once it is loaded, it has following structure:
 
     # type of assistants
     {'crt':
@@ -31,11 +325,14 @@ class Cache(object):
                              'help': 'Help for foo parameter.'}},
                  'description': 'C Language Tool description...',
                  'fullname': 'C Language Tool'},
-            # snippets that this assistant depends on with their last seen ctimes
+            # snippets that this assistant depends on with their last seen ctimes (in ns)
             'snippets': {'somesnip': 11111111111},
-            # last seen ctime of this assistant
+            # last seen ctime of this assistant (in ns)
             'ctime': 111111111111,
-            # source file of this assistant
+            # version of structure of this cached assistant, see ASSISTANT_SCHEMA
+            'schema': 1,
+            # source file of this assistant (None if it's just a directory with
+            #  subassistants, see YamlAssistantLoader.get_assistants_file_hierarchy)
             'source': '/foo/bar/assistants/crt/c.yaml',
             # hierarchy of subassistants of this assistant
             'subhierarchy': {'d': {...}},
@@ -46,50 +343,344 @@ class Cache(object):
      'version': devassistant.__version__}
     """
 
-    def __init__(self, cache_file=settings.CACHE_FILE):
+    def __init__(self, cache_file=settings.CACHE_FILE, cache_format=settings.CACHE_FORMAT,
+                 read_only=False):
         """Inits a cache objects with given cache_file. Creates the cache file if
         it doesn't exist. If cache_file exists, but was created with different
-        DevAssistant version, it gets deleted.
+        cache schema, it gets deleted (together with role files).
 
         Args:
             cache_file: cache file to use
+            cache_format: format to write cache_file in, "binary" or "yaml"; existing
+                          cache_file is read regardless of its format
+            read_only: if True, cache_file is only read (without locking it) and nothing
+                       is ever written; unusable cache_file is considered empty
         """
         self.cache_file = cache_file
+        self.cache_format = cache_format
+        self.read_only = read_only
+        self.cache_bodies = settings.CACHE_BODIES and cache_format != 'yaml'
         # snippets are shared across many assistants, so we remember their ctimes
         # here, because doing it again for each assistant would be very costly
         self.snip_ctimes = {}
-        reset_cache = False
-        if os.path.exists(self.cache_file):
-            self.cache = yaml_loader.YamlLoader.load_yaml_by_path(cache_file) or {}
-            if self.cache.get('version', '0.0.0') != devassistant.__version__:
-                reset_cache = True
-        else:
-            if not os.path.exists(os.path.dirname(cache_file)):
-                os.makedirs(os.path.dirname(cache_file))
-            reset_cache = True
+        # assistants loaded in parallel by refresh_role, see yaml_loader.YamlLoader.preload_yamls
+        self._preloaded = {}
+        # roles changed since the last flush
+        self._dirty_roles = set()
+        # bodies of assistants (re)loaded since the last flush, pickled:
+        #  {role: {source: (ctime, pickled body)}}
+        self._bodies = {}
+        # opened bodies files: {role: (file object, index, offset of the first body)}
+        self._body_stores = {}
+        # role being refreshed by refresh_role
+        self._current_role = None
+        # True if all assistants of the role being refreshed or verified need refresh,
+        #  see _has_stale_bodies
+        self._refresh_all = False
+        self.cache = None
+        if read_only:
+            if os.path.exists(self.cache_file):
+                self.cache = self._load()
+            if self.cache is None:
+                self.cache = {'version': devassistant.__version__}
+            return
+        if not os.path.exists(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+
+        with locked(self.cache_file, exclusive=False):
+            if os.path.exists(self.cache_file):
+                self.cache = self._load()
 
         # if writing the file raises, YamlAssistantLoader catches the exception
         #  and doesn't use cache at all
-        if reset_cache:
-            f = open(cache_file, 'w')
+        if self.cache is None:
             self.cache = {'version': devassistant.__version__}
-            f.close()
+            with locked(self.cache_file, exclusive=True):
+                for role in settings.ASSISTANT_ROLES:
+                    for path in [self._role_file(role), self._body_file(role)]:
+                        if os.path.exists(path):
+                            os.unlink(path)
+                self._write()
+
+    def _role_file(self, role):
+        return '{0}.{1}'.format(self.cache_file, role)
+
+    def _body_file(self, role):
+        return self._role_file(role) + '.bodies'
+
+    def _load(self):
+        """Loads cache structure from self.cache_file (and role files).
+
+        Returns:
+            loaded cache structure (with migrated assistants) or None if the cache file
+            was created with different cache schema (or is unreadable)
+        """
+        with open(self.cache_file, 'rb') as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                # not a binary cache => try yaml
+                loaded = yaml_loader.YamlLoader.load_yaml_by_path(self.cache_file) or {}
+                if 'version' not in loaded:
+                    return None
+                # if we write binary cache, all roles need to be written to role files
+                #  and cache file needs to be rewritten as binary
+                if self.cache_format != 'yaml':
+                    self._dirty_roles.update(r for r in loaded if r != 'version')
+                    self._dirty_roles.add(None)
+            else:
+                f.seek(0)
+                loaded = load_binary(f, any_version=True)
+                if loaded is None:
+                    return None
+                if self.cache_format == 'yaml':
+                    # if we write yaml cache, everything goes to cache file
+                    self._dirty_roles.add(None)
+                for role in settings.ASSISTANT_ROLES:
+                    if os.path.exists(self._role_file(role)):
+                        with open(self._role_file(role), 'rb') as rf:
+                            role_cache = load_binary(rf, any_version=True)
+                        # role files that can't be used are just refreshed from scratch
+                        if role_cache is not None:
+                            loaded[role] = role_cache
+        if loaded['version'] != devassistant.__version__:
+            loaded['version'] = devassistant.__version__
+            self._dirty_roles.add(None)
+        for role in settings.ASSISTANT_ROLES:
+            # migrated assistants are written, so that they're only migrated once
+            if role in loaded and migrate_hierarchy(loaded[role]):
+                self._dirty_roles.add(role)
+        return loaded
+
+    def _write(self, roles=None):
+        """Writes self.cache to self.cache_file in self.cache_format. If the format is
+        binary, only writes files of given roles (and version to self.cache_file, if roles
+        is None). Caller must hold exclusive lock.
+        """
+        if self.cache_format == 'yaml':
+            write_atomically(self.cache_file, self.dump_yaml, mode='w')
+        elif roles is None:
+            write_atomically(self.cache_file,
+                             lambda f: dump_binary({'version': self.cache['version']}, f))
+        else:
+            for role in roles:
+                write_atomically(self._role_file(role),
+                                 lambda f: dump_binary(self.cache.get(role, {}), f))
+                if self.cache_bodies:
+                    self._write_bodies(role)
+
+    def _write_bodies(self, role):
+        """Writes bodies file of given role with bodies of all assistants cached in that role,
+        taking them from bodies loaded since the last flush or from the current bodies file.
+        Caller must hold exclusive lock."""
+        index = {}
+        bodies = []
+        offset = 0
+        for source, ctime in hierarchy_sources(self.cache.get(role, {})):
+            data = self._get_body_data(role, source, ctime)
+            if data is not None:
+                index[source] = (ctime, offset, len(data))
+                bodies.append(data)
+                offset += len(data)
+
+        def write_func(f):
+            dump_binary(index, f)
+            for data in bodies:
+                f.write(data)
+        write_atomically(self._body_file(role), write_func)
+        self._bodies.pop(role, None)
+        self._close_body_store(role)
+
+    def flush(self, roles=()):
+        """Writes all roles changed by refresh_role since the last flush.
+
+        Args:
+            roles: roles to write even if they haven't changed
+        """
+        self._dirty_roles.update(roles)
+        if not self._dirty_roles or self.read_only:
+            return
+        with locked(self.cache_file, exclusive=True):
+            if self.cache_format == 'yaml':
+                self._write()
+            else:
+                # None is there if self.cache_file itself needs to be rewritten
+                if None in self._dirty_roles:
+                    self._write()
+                self._write(roles=sorted(r for r in self._dirty_roles if r is not None))
+        self._dirty_roles = set()
+
+    def get_body(self, role, source, ctime):
+        """Returns full parsed body of cached assistant with given role and source, as
+        loaded by YamlLoader.load_yaml_by_path.
+
+        Args:
+            role: role of the assistant
+            source: source file of the assistant
+            ctime: ctime of the cached assistant (in ns); a body stored with different
+                   ctime is outdated
+        Returns:
+            the body or None if it's not cached (or can't be unpickled)
+        """
+        data = self._get_body_data(role, source, ctime)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception as e:
+            # e.g. classes of lowered sections have changed
+            logger.debug('Failed to unpickle cached body of {0}: {1}'.format(source, e))
+            return None
+
+    def _get_body_data(self, role, source, ctime):
+        """Returns pickled body for get_body (or None)."""
+        if not self.cache_bodies:
+            return None
+        body_ctime, data = self._bodies.get(role, {}).get(source, (None, None))
+        if body_ctime == ctime:
+            return data
+        store = self._get_body_store(role)
+        if store is None:
+            return None
+        f, index, start = store
+        body_ctime, offset, length = index.get(source, (None, 0, 0))
+        if body_ctime != ctime:
+            return None
+        f.seek(start + offset)
+        return f.read(length)
+
+    def _get_body_store(self, role):
+        """Opens bodies file of given role (once) and loads its index. The file object is
+        kept open until the file is rewritten, so that offsets from the index stay valid
+        even if another process replaces the file.
+
+        Returns:
+            tuple (file object, index, offset of the first body) or None if there's no
+            usable bodies file
+        """
+        if role not in self._body_stores:
+            store = None
+            try:
+                f = open(self._body_file(role), 'rb')
+            except (IOError, OSError):
+                f = None
+            if f is not None:
+                index = load_binary(f, any_version=True, any_ir_version=False)
+                if index is None:
+                    f.close()
+                else:
+                    store = (f, index, f.tell())
+            self._body_stores[role] = store
+        return self._body_stores[role]
+
+    def _close_body_store(self, role):
+        store = self._body_stores.pop(role, None)
+        if store is not None:
+            store[0].close()
+
+    def dump_yaml(self, stream):
+        """Exports the cache structure as yaml to given stream (useful for debugging)."""
+        yaml.dump(self.cache, stream, Dumper=Dumper)
 
     def refresh_role(self, role, file_hierarchy):
-        """Checks and refreshes (if needed) all assistants with given role.
+        """Checks and refreshes (if needed) all assistants with given role. Changes are
+        only written to cache files by flush.
 
         Args:
             role: role of assistants to refresh
             file_hierarchy: hierarchy as returned by devassistant.yaml_assistant_loader.\
                             YamlAssistantLoader.get_assistants_file_hierarchy
+        Returns:
+            True if any assistant has been added, removed or refreshed, False otherwise
         """
         if role not in self.cache:
             self.cache[role] = {}
-        was_change = self._refresh_hierarchy_recursive(self.cache[role], file_hierarchy)
+        self._current_role = role
+        # read only cache would never write the refreshed bodies
+        self._refresh_all = not self.read_only and self._has_stale_bodies(role)
+        try:
+            if settings.LOAD_WORKERS > 1:
+                self._preloaded = yaml_loader.YamlLoader.preload_yamls(
+                    self._get_stale_sources(self.cache[role], file_hierarchy),
+                    check=True,
+                    log_debug=True)
+            was_change = self._refresh_hierarchy_recursive(self.cache[role], file_hierarchy)
+        finally:
+            self._preloaded = {}
+            self._refresh_all = False
         if was_change:
-            cf = open(self.cache_file, 'w')
-            yaml.dump(self.cache, cf, Dumper=Dumper)
-            cf.close()
+            self._dirty_roles.add(role)
+        return was_change
+
+    def copy_role(self, role, other):
+        """Replaces cached hierarchy of given role (together with cached bodies) by the one
+        from other Cache (it gets written by next flush)."""
+        self.cache[role] = other.cache[role]
+        if self.cache_bodies:
+            bodies = self._bodies.setdefault(role, {})
+            for source, ctime in hierarchy_sources(self.cache[role]):
+                data = other._get_body_data(role, source, ctime)
+                if data is not None:
+                    bodies[source] = (ctime, data)
+        self._dirty_roles.add(role)
+
+    def fingerprint(self, role):
+        """Returns a string that changes whenever cached assistants with given role change,
+        i.e. whenever any of them is added, removed or refreshed by refresh_role. This
+        is used to key data derived from cached assistants (see ParserSpecCache).
+
+        Args:
+            role: role of assistants to compute fingerprint for
+        Returns:
+            hex digest computed from sources, ctimes and snippet ctimes of cached assistants
+        """
+        return fingerprint_hierarchy(self.cache.get(role, {}))
+
+    def verify_role(self, role, file_hierarchy):
+        """Finds cached assistants with given role that need to be rebuilt (i.e. would be
+        added, removed or refreshed by refresh_role). Nothing is changed.
+
+        Args:
+            role: role of assistants to verify
+            file_hierarchy: hierarchy as returned by devassistant.yaml_assistant_loader.\
+                            YamlAssistantLoader.get_assistants_file_hierarchy
+        Returns:
+            list of tuples (path of assistant in the hierarchy, e.g. "crt/c/d", reason),
+            sorted by path
+        """
+        self._refresh_all = self._has_stale_bodies(role)
+        try:
+            return self._verify_hierarchy(self.cache.get(role, {}), file_hierarchy, role)
+        finally:
+            self._refresh_all = False
+
+    def _has_stale_bodies(self, role):
+        """Returns True if bodies file of given role exists, but can't be used, e.g. because
+        it was written with different lang.IR_VERSION. Such bodies can't be migrated, so
+        all assistants of the role are refreshed to get their bodies written again (otherwise
+        their yaml files would be parsed on every run until they change)."""
+        return self.cache_bodies and os.path.exists(self._body_file(role)) and \
+            self._get_body_store(role) is None
+
+    def _verify_hierarchy(self, cached_hierarchy, file_hierarchy, prefix):
+        problems = []
+        for name in sorted(set(cached_hierarchy) | set(file_hierarchy)):
+            path = prefix + '/' + name
+            if name not in file_hierarchy:
+                problems.append((path, 'removed'))
+                continue
+            if name not in cached_hierarchy:
+                problems.append((path, 'not cached'))
+                continue
+            try:
+                reason = self._get_refresh_reason(cached_hierarchy[name], file_hierarchy[name])
+            except Exception as e:
+                reason = 'can\'t be checked: {0}'.format(e)
+            if reason is not None:
+                problems.append((path, reason))
+            if file_hierarchy[name]['subhierarchy'] is not None:
+                problems.extend(self._verify_hierarchy(cached_hierarchy[name]['subhierarchy'],
+                                                       file_hierarchy[name]['subhierarchy'],
+                                                       path))
+        return problems
 
     def _refresh_hierarchy_recursive(self, cached_hierarchy, file_hierarchy):
         """Recursively goes through given corresponding hierarchies from cache and filesystem
@@ -115,6 +706,7 @@ class Cache(object):
 
         if to_add or to_remove:
             was_change = True
+        stats.incr('removals', len(to_remove))
 
         for ass in to_add:
             cached_hierarchy[ass] = self._new_ass_hierarchy(file_hierarchy[ass])
@@ -131,20 +723,61 @@ class Cache(object):
 
             if needs_refresh:
                 self._ass_refresh_attrs(cached_hierarchy[ass], file_hierarchy[ass])
+                stats.incr('refreshes')
                 was_change = True
-            was_change |= self._refresh_hierarchy_recursive(
-                cached_hierarchy[ass]['subhierarchy'],
-                file_hierarchy[ass]['subhierarchy'])
+            else:
+                stats.incr('hits')
+            # subhierarchy is None if it wasn't scanned, see settings.LAZY_LOAD_NAMES
+            if file_hierarchy[ass]['subhierarchy'] is not None:
+                was_change |= self._refresh_hierarchy_recursive(
+                    cached_hierarchy[ass]['subhierarchy'],
+                    file_hierarchy[ass]['subhierarchy'])
 
         return was_change
 
+    def _get_stale_sources(self, cached_hierarchy, file_hierarchy):
+        """Returns list of source files of assistants from file_hierarchy, that will be
+        (re)loaded by _refresh_hierarchy_recursive, i.e. that are new or need refresh.
+        """
+        sources = []
+        for name, file_ass in file_hierarchy.items():
+            cached_ass = cached_hierarchy.get(name)
+            if cached_ass is None:
+                if file_ass['source'] is not None:
+                    sources.append(file_ass['source'])
+                sources.extend(self._get_stale_sources({}, file_ass['subhierarchy'] or {}))
+                continue
+            try:
+                needs_refresh = self._ass_needs_refresh(cached_ass, file_ass)
+            except:
+                needs_refresh = True
+            if needs_refresh and file_ass['source'] is not None:
+                sources.append(file_ass['source'])
+            if file_ass['subhierarchy'] is not None:
+                sources.extend(self._get_stale_sources(cached_ass['subhierarchy'],
+                                                       file_ass['subhierarchy']))
+        return sources
+
     def _ass_needs_refresh(self, cached_ass, file_ass):
-        """Checks if assistant needs refresh.
+        """Checks if assistant needs refresh, see _get_refresh_reason.
+
+        Args:
+            cached_ass: an assistant from cache hierarchy
+                        (for format see Cache class docstring)
+            file_ass: the respective assistant from filesystem hierarchy
+                      (for format see what refresh_role accepts)
+        """
+        return self._get_refresh_reason(cached_ass, file_ass) is not None
+
+    def _get_refresh_reason(self, cached_ass, file_ass):
+        """Returns reason why assistant needs refresh or None if it doesn't need it.
 
         Assistant needs refresh iff any of following conditions is True:
+        - it was cached with different ASSISTANT_SCHEMA (and couldn't be migrated)
         - stored source file is different than given source file
         - stored assistant ctime is lower than current source file ctime
         - stored list of subassistants is different than given list of subassistants
+          (if given list of subassistants was scanned)
         - stored ctime of any of the snippets that this assistant uses to compose
           args is lower than current ctime of that snippet
 
@@ -154,17 +787,22 @@ class Cache(object):
             file_ass: the respective assistant from filesystem hierarchy
                       (for format see what refresh_role accepts)
         """
+        if cached_ass.get('schema', 0) != ASSISTANT_SCHEMA:
+            return 'cached with incompatible schema {0}'.format(cached_ass.get('schema', 0))
+        if self._refresh_all:
+            return 'cached bodies are outdated'
         if cached_ass['source'] != file_ass['source']:
-            return True
-        if os.path.getctime(file_ass['source']) > cached_ass.get('ctime', 0.0):
-            return True
-        if set(cached_ass['subhierarchy'].keys()) != set(set(file_ass['subhierarchy'].keys())):
-            return True
+            return 'source file changed to {0}'.format(file_ass['source'])
+        if self._get_ctime(file_ass) > cached_ass.get('ctime', 0):
+            return 'source file modified'
+        if file_ass['subhierarchy'] is not None and \
+                set(cached_ass['subhierarchy'].keys()) != set(file_ass['subhierarchy'].keys()):
+            return 'subassistants changed'
         for snip_name, snip_ctime in cached_ass['snippets'].items():
             if self._get_snippet_ctime(snip_name) > snip_ctime:
-                return True
+                return 'snippet {0} modified'.format(snip_name)
 
-        return False
+        return None
 
     def _ass_refresh_attrs(self, cached_ass, file_ass):
         """Completely refreshes cached assistant from file.
@@ -175,12 +813,29 @@ class Cache(object):
             file_ass: the respective assistant from filesystem hierarchy
                       (for format see what refresh_role accepts)
         """
+        if file_ass['source'] is None:
+            # just a directory with subassistants of assistant from another directory
+            cached_ass.update(source=None, ctime=0, attrs={}, snippets={},
+                              schema=ASSISTANT_SCHEMA)
+            return
         # we need to process assistant in custom way to see unexpanded args, etc.
-        loaded_ass = yaml_loader.YamlLoader.load_yaml_by_path(file_ass['source'], log_debug=True)
-        attrs = loaded_ass
-        yaml_checker.check(file_ass['source'], attrs)
+        if file_ass['source'] in self._preloaded:
+            attrs, check_error = self._preloaded.pop(file_ass['source'])
+            if check_error is not None:
+                raise check_error
+        else:
+            attrs = yaml_loader.YamlLoader.load_yaml_by_path(file_ass['source'], log_debug=True)
+            yaml_checker.check(file_ass['source'], attrs)
         cached_ass['source'] = file_ass['source']
-        cached_ass['ctime'] = os.path.getctime(file_ass['source'])
+        cached_ass['ctime'] = self._get_ctime(file_ass)
+        cached_ass['schema'] = ASSISTANT_SCHEMA
+        if self.cache_bodies:
+            # store sections lowered, so that they don't have to be lowered when loaded
+            from devassistant import lang
+            lang.lower_sections(attrs)
+            # args of attrs get modified below
+            self._bodies.setdefault(self._current_role, {})[cached_ass['source']] = \
+                (cached_ass['ctime'], pickle.dumps(attrs, pickle.HIGHEST_PROTOCOL))
         cached_ass['attrs'] = {}
         cached_ass['snippets'] = {}
         # only cache these attributes if they're actually found in assistant
@@ -217,12 +872,21 @@ class Cache(object):
                       'snippets': {}}
         ret_struct['source'] = file_ass['source']
         self._ass_refresh_attrs(ret_struct, file_ass)
+        stats.incr('misses')
 
-        for name, subhierarchy in file_ass['subhierarchy'].items():
+        for name, subhierarchy in (file_ass['subhierarchy'] or {}).items():
             ret_struct['subhierarchy'][name] = self._new_ass_hierarchy(subhierarchy)
 
         return ret_struct
 
+    def _get_ctime(self, file_ass):
+        """Returns ctime (in ns) of given assistant from filesystem hierarchy. Uses the stat
+        information gathered when creating the hierarchy, if present.
+        """
+        if 'ctime_ns' not in file_ass:
+            file_ass.update(utils.stat_info(os.stat(file_ass['source'])))
+        return file_ass['ctime_ns']
+
     def _get_snippet_ctime(self, snip_name):
         """Returns and remembers (during this DevAssistant invocation) last ctime of given
         snippet.
@@ -233,9 +897,307 @@ class Cache(object):
         Args:
             snip_name: name of snippet to get ctime for
         Returns:
-            ctime of the snippet
+            ctime of the snippet (in ns)
         """
         if snip_name not in self.snip_ctimes:
-            snippet = yaml_snippet_loader.YamlSnippetLoader.get_snippet_by_name(snip_name)
-            self.snip_ctimes[snip_name] = os.path.getctime(snippet.path)
+            stats.incr('snippet_ctime_lookups')
+            self.snip_ctimes[snip_name] = \
+                yaml_snippet_loader.YamlSnippetLoader.get_snippet_ctime(snip_name)
         return self.snip_ctimes[snip_name]
+
+
+class LayeredCache(object):
+    """Cache of assistants from more assistant directories (one in each of
+    settings.DATA_DIRECTORIES), composed of one layer (Cache) per directory. Layers
+    are merged by merge_hierarchies, so that the result is the same as if a single
+    cache was created from file hierarchy of all the directories.
+
+    Each directory may contain a prebuilt read-only layer settings.SYSTEM_CACHE_NAME
+    (created by "da cache build --system", e.g. when DevAssistant or assistants are
+    installed system-wide). Prebuilt layers are used as long as they are up to date.
+    Directories without prebuilt layer (or with an outdated one) get a layer in
+    settings.CACHE_LAYERS_DIR, named by hash of the directory path, so only these
+    user's layers are ever refreshed and written (by flush).
+
+    Once roles are refreshed, self.cache has the same structure as Cache.cache.
+    """
+
+    def __init__(self, layers_dir=settings.CACHE_LAYERS_DIR,
+                 cache_format=settings.CACHE_FORMAT):
+        """Inits layered cache with given directory of user's layers.
+
+        Args:
+            layers_dir: directory to store user's layers in
+            cache_format: format to write user's layers in, see Cache
+        """
+        self.layers_dir = layers_dir
+        self.cache_format = cache_format
+        # mappings of assistant directories to their layers (None if there's no layer)
+        self._system_layers = {}
+        self._user_layers = {}
+        self.cache = {'version': devassistant.__version__}
+
+    @classmethod
+    def system_layer_file(cls, directory):
+        """Returns path of prebuilt layer of given assistant directory."""
+        return os.path.join(directory, settings.SYSTEM_CACHE_NAME)
+
+    def user_layer_file(self, directory):
+        """Returns path of user's layer of given assistant directory."""
+        key = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+        return os.path.join(self.layers_dir, key)
+
+    def refresh_role(self, role, layers):
+        """Checks and refreshes (if needed) assistants with given role in all layers and
+        merges them into self.cache[role]. Changes are only written by flush.
+
+        Args:
+            role: role of assistants to refresh
+            layers: list of tuples (assistant directory, file hierarchy of given role in
+                    that directory) ordered by precedence; the file hierarchies must be
+                    created with orphans=True (see YamlAssistantLoader.\
+                    get_assistants_file_hierarchy), so that subassistants of assistants
+                    from other directories are not lost
+        """
+        self.cache[role] = merge_hierarchies([self._refresh_layer(role, d, fh)
+                                              for d, fh in layers])
+
+    def _refresh_layer(self, role, directory, file_hierarchy):
+        """Refreshes given role in layer of given assistant directory.
+
+        Returns:
+            cached hierarchy of given role in the layer
+        """
+        user_layer = self._get_user_layer(directory)
+        if user_layer is None or role not in user_layer.cache:
+            system_layer = self._get_system_layer(directory)
+            if system_layer is not None and role in system_layer.cache:
+                if not system_layer.refresh_role(role, file_hierarchy):
+                    return system_layer.cache[role]
+                # prebuilt layer is outdated, refreshed role goes to user's layer
+                user_layer = self._get_user_layer(directory, create=True)
+                user_layer.copy_role(role, system_layer)
+                return user_layer.cache[role]
+            if user_layer is None and not file_hierarchy:
+                # don't create layers for directories without assistants
+                return {}
+            user_layer = self._get_user_layer(directory, create=True)
+        user_layer.refresh_role(role, file_hierarchy)
+        return user_layer.cache[role]
+
+    def _get_system_layer(self, directory):
+        if directory not in self._system_layers:
+            layer = None
+            if os.path.exists(self.system_layer_file(directory)):
+                layer = Cache(self.system_layer_file(directory), read_only=True)
+            self._system_layers[directory] = layer
+        return self._system_layers[directory]
+
+    def _get_user_layer(self, directory, create=False):
+        if self._user_layers.get(directory) is None:
+            path = self.user_layer_file(directory)
+            if create or os.path.exists(path):
+                self._user_layers[directory] = Cache(path, cache_format=self.cache_format)
+        return self._user_layers.get(directory)
+
+    def fingerprint(self, role):
+        """Returns a string that changes whenever merged cached assistants with given role
+        change, see Cache.fingerprint."""
+        return fingerprint_hierarchy(self.cache.get(role, {}))
+
+    def dump_yaml(self, stream):
+        """Exports the merged cache structure as yaml to given stream."""
+        yaml.dump(self.cache, stream, Dumper=Dumper)
+
+    def get_body(self, role, source, ctime):
+        """Returns full parsed body of cached assistant from the layer of its directory,
+        see Cache.get_body."""
+        for directory in set(self._user_layers) | set(self._system_layers):
+            if not source.startswith(os.path.join(directory, '')):
+                continue
+            for layer in [self._user_layers.get(directory), self._system_layers.get(directory)]:
+                if layer is not None and role in layer.cache:
+                    body = layer.get_body(role, source, ctime)
+                    if body is not None:
+                        return body
+        return None
+
+    def verify_role(self, role, layers):
+        """Finds cached assistants with given role that need to be rebuilt in layers used
+        for given directories, see Cache.verify_role. Nothing is changed.
+
+        Args:
+            role: role of assistants to verify
+            layers: see refresh_role
+        Returns:
+            list of tuples (layer file, path of assistant in the hierarchy, reason)
+        """
+        problems = []
+        for directory, file_hierarchy in layers:
+            layer = self._get_user_layer(directory)
+            if layer is None or role not in layer.cache:
+                layer = self._get_system_layer(directory)
+            if layer is None or role not in layer.cache:
+                # there's no layer => everything needs to be cached
+                layer = Cache(self.user_layer_file(directory), read_only=True)
+            problems.extend((layer.cache_file, path, reason)
+                            for path, reason in layer.verify_role(role, file_hierarchy))
+        return problems
+
+    def flush(self):
+        """Writes all roles changed in user's layers since the last flush."""
+        for layer in self._user_layers.values():
+            if layer is not None:
+                layer.flush()
+
+
+class SnippetIndex(object):
+    """Index of snippets from given snippet directories, that maps their dotted names to
+    their files and parsed content. It is stored in a binary file between DevAssistant
+    invocations, so that each snippet file is only parsed again when it changes. The files
+    are listed once per process (snippets are not looked for in each directory separately)
+    and their stat information are compared with the stored ones:
+
+    {'dirs': ['/foo/snippets', '/bar/snippets'],
+     'snippets':
+        # files of snippet "common_args" from all directories, in order of precedence
+        {'common_args': [{'path': '/foo/snippets/common_args.yaml',
+                          'ctime_ns': 1400000000000000000,
+                          'mtime_ns': 1400000000000000000,
+                          'size': 1024,
+                          # parsed content, only present if the file has been parsed
+                          'parsed': {...}},
+                         {'path': '/bar/snippets/common_args.yaml', ...}],
+         'foo.bar': [...],
+         ...}}
+    """
+
+    def __init__(self, dirs, index_file=settings.SNIPPET_INDEX_FILE):
+        """Inits snippet index of given snippet directories.
+
+        Args:
+            dirs: snippet directories ordered by precedence
+            index_file: file to store the index in, None to only keep it in memory; stored
+                        index is ignored if it was created for different directories or
+                        with different DevAssistant version or cache schema
+        """
+        self.dirs = list(dirs)
+        self.index_file = index_file
+        self.changed = False
+        stored = None
+        if index_file is not None and os.path.exists(index_file):
+            with open(index_file, 'rb') as f:
+                stored = load_binary(f)
+        if stored is None or stored['dirs'] != self.dirs:
+            stored = {'snippets': {}}
+        self.snippets = self._scan_dirs(stored['snippets'])
+
+    def _scan_dirs(self, stored_snippets):
+        """Lists snippet files in self.dirs and takes parsed content of those that haven't
+        changed from stored_snippets."""
+        snippets = {}
+        for d in self.dirs:
+            to_scan = [(d, '')]
+            while to_scan:
+                directory, prefix = to_scan.pop()
+                files, subdirs = utils.scan_dir(directory, suffix='.yaml')
+                for f, fullpath, stat_info in files:
+                    snippets.setdefault(prefix + f[:-len('.yaml')], []).\
+                        append(dict(stat_info, path=fullpath))
+                to_scan.extend((os.path.join(directory, s), prefix + s + '.') for s in subdirs)
+
+        for name, files in snippets.items():
+            stored_files = dict((f['path'], f) for f in stored_snippets.get(name, []))
+            for f in files:
+                stored = stored_files.get(f['path'])
+                if stored is not None and 'parsed' in stored and \
+                        all(stored[k] == f[k] for k in ['ctime_ns', 'mtime_ns', 'size']):
+                    f['parsed'] = stored['parsed']
+        return snippets
+
+    def names(self):
+        """Returns dotted names of all snippets in the index."""
+        return list(self.snippets.keys())
+
+    def get(self, name):
+        """Returns file of snippet with given dotted name (from the first directory, where
+        the file can be parsed) as a dict with path, stat information and parsed content
+        (see class docstring); None if there's no such snippet. Each file is only parsed
+        if it hasn't been parsed before (in this or a previous invocation)."""
+        for f in self.snippets.get(name, []):
+            if 'parsed' not in f:
+                f['parsed'] = yaml_loader.YamlLoader.load_yaml_by_path(f['path'])
+                # store sections lowered, see lang.Section
+                from devassistant import lang
+                lang.lower_sections(f['parsed'])
+                self.changed = True
+            if f['parsed'] is not None:
+                return f
+        return None
+
+    def write(self):
+        """Writes the index to self.index_file, if any snippet has been parsed."""
+        if not self.changed or self.index_file is None:
+            return
+        snippets = {}
+        for name, files in self.snippets.items():
+            # files that can't be parsed are parsed again next time, so that their errors
+            #  are reported
+            snippets[name] = [f if f.get('parsed', {}) is not None else
+                              dict((k, v) for k, v in f.items() if k != 'parsed')
+                              for f in files]
+        with locked(self.index_file, exclusive=True):
+            write_atomically(self.index_file,
+                             lambda f: dump_binary({'dirs': self.dirs, 'snippets': snippets}, f))
+        self.changed = False
+
+
+class ParserSpecCache(object):
+    """Cache of argument parser specifications of assistant roles (see
+    devassistant.cli.argparse_generator.ArgparseGenerator.get_role_spec), stored in a binary
+    file next to assistant cache. Specification of each role is stored together with
+    fingerprint of the cached role it was created from (see Cache.fingerprint), so it is
+    only used while the cached assistants of that role don't change:
+
+    {'crt': ('<fingerprint>', [<specs of top level crt assistants>]),
+     'twk': (...),
+     ...}
+    """
+
+    def __init__(self, cache_file=settings.PARSER_CACHE_FILE):
+        """Inits parser spec cache with given cache_file. If cache_file doesn't exist or was
+        created with different DevAssistant version or cache schema, it is considered empty.
+
+        Args:
+            cache_file: parser spec cache file to use, None to only keep specs in memory
+        """
+        self.cache_file = cache_file
+        self.specs = None
+        self.changed = False
+        if self.cache_file is not None and os.path.exists(self.cache_file):
+            with open(self.cache_file, 'rb') as f:
+                self.specs = load_binary(f)
+        if self.specs is None:
+            self.specs = {}
+
+    def get(self, role, fingerprint):
+        """Returns spec stored for given role, if it was stored with given fingerprint,
+        None otherwise."""
+        stored_fingerprint, spec = self.specs.get(role, (None, None))
+        if stored_fingerprint != fingerprint:
+            return None
+        return spec
+
+    def set(self, role, fingerprint, spec):
+        """Stores spec for given role with given fingerprint (call write to save it)."""
+        self.specs[role] = (fingerprint, spec)
+        self.changed = True
+
+    def write(self):
+        """Writes specs to self.cache_file, if any of them has changed."""
+        if self.changed and self.cache_file is not None:
+            write_atomically(self.cache_file, lambda f: dump_binary(self.specs, f))
+            self.changed = False
+
+
+atexit.register(stats.log_record)
@@ -1,8 +1,15 @@
 import argparse
 
+import six
+
+from devassistant.argument import Argument
+from devassistant import cache
 from devassistant.cli import devassistant_argparse
+from devassistant import exceptions
+from devassistant.logger import logger
 from devassistant import settings
 from devassistant import utils
+from devassistant.yaml_assistant_loader import YamlAssistantLoader
 
 
 class ArgparseGenerator(object):
@@ -17,6 +24,12 @@ class ArgparseGenerator(object):
     def generate_argument_parser(cls, tree, actions={}):
         """Generates argument parser for given assistant tree and actions.
 
+        Parsers of assistants are generated from their specifications (see get_spec).
+        Specifications of assistants loaded from cache are stored in
+        settings.PARSER_CACHE_FILE, so they don't have to be generated again until
+        the cached assistants change. Parsers of subassistants are only populated
+        when they are actually used (see devassistant_argparse.ArgumentParser).
+
         Args:
             tree: assistant tree as returned by
                   devassistant.assistant_base.AssistantBase.get_subassistant_tree
@@ -40,9 +53,12 @@ class ArgparseGenerator(object):
             # then add the subassistants as arguments
             subparsers = cls._add_subparsers_required(parser,
                 dest=settings.SUBASSISTANT_N_STRING.format('0'))
+            spec_cache = cls._get_spec_cache()
             for subas in sorted(cur_subas, key=lambda x: x[0].name):
+                spec = cls.get_role_spec(subas, spec_cache)
                 for alias in [subas[0].name] + getattr(subas[0], 'aliases', []):
-                    cls.add_subassistants_to(subparsers, subas, level=1, alias=alias)
+                    cls.add_spec_to(subparsers, spec, level=1, alias=alias)
+            cls._write_spec_cache(spec_cache)
 
             for action, subactions in sorted(actions.items(), key=lambda x: x[0].name):
                 cls.add_action_to(subparsers, action, subactions, level=1)
@@ -57,6 +73,13 @@ class ArgparseGenerator(object):
                             action='store_true',
                             dest='da_debug',
                             default=False)
+        parser.add_argument('--profile',
+                            help='Show how long the run took by commands, sections, "use" and ' +
+                                 'subprocesses and write it as collapsed stacks (for ' +
+                                 'flamegraph tools) to {0}.'.format(settings.PROFILE_FILE),
+                            action='store_true',
+                            dest='da_profile',
+                            default=False)
         utils.add_no_cache_argument(parser)
 
     @classmethod
@@ -69,25 +92,141 @@ class ArgparseGenerator(object):
             assistant_tuple: part of assistant tree (see generate_argument_parser doc)
             level: level of subassistants that given assistant is at
         """
-        name = alias or assistant_tuple[0].name
-        p = parser.add_parser(name,
-                              description=assistant_tuple[0].description,
-                              argument_default=argparse.SUPPRESS)
-        for arg in assistant_tuple[0].args:
-            arg.add_argument_to(p)
+        cls.add_spec_to(parser, cls.get_spec(assistant_tuple), level, alias=alias)
 
-        if len(assistant_tuple[1]) > 0:
-            subparsers = cls._add_subparsers_required(p,
-                dest=settings.SUBASSISTANT_N_STRING.format(level),
-                title=cls.subparsers_str,
-                description=cls.subparsers_desc)
-            for subas_tuple in sorted(assistant_tuple[1], key=lambda x: x[0].name):
-                cls.add_subassistants_to(subparsers, subas_tuple, level + 1)
-        elif level == 1:
-            subparsers = cls._add_subparsers_required(p,
-                dest=settings.SUBASSISTANT_N_STRING.format(level),
-                title=cls.subparsers_str,
-                description=cls.subparsers_no_avail)
+    @classmethod
+    def add_spec_to(cls, parser, spec, level, alias=None):
+        """Adds assistant specified by given spec and all its subassistants to a given
+        argument parser. Arguments and subassistants are added to the assistant parser
+        only when it's first used.
+
+        Args:
+            parser: instance of devassistant_argparse.ArgumentParser
+            spec: assistant specification (see get_spec)
+            level: level of subassistants that given assistant is at
+        """
+        def populate(p):
+            for arg_spec in spec['args']:
+                Argument.add_parser_spec_to(p, arg_spec)
+
+            if len(spec['subassistants']) > 0:
+                subparsers = cls._add_subparsers_required(p,
+                    dest=settings.SUBASSISTANT_N_STRING.format(level),
+                    title=cls.subparsers_str,
+                    description=cls.subparsers_desc)
+                for subas_spec in spec['subassistants']:
+                    cls.add_spec_to(subparsers, subas_spec, level + 1)
+            elif level == 1:
+                subparsers = cls._add_subparsers_required(p,
+                    dest=settings.SUBASSISTANT_N_STRING.format(level),
+                    title=cls.subparsers_str,
+                    description=cls.subparsers_no_avail)
+
+        parser.add_parser(alias or spec['name'],
+                          description=spec['description'],
+                          argument_default=argparse.SUPPRESS,
+                          populate=populate)
+
+    @classmethod
+    def get_spec(cls, assistant_tuple):
+        """Returns specification of argument parser of assistant from given part of
+        assistant tree. The specification only consists of builtin types, so it can be
+        stored in cache:
+
+        {'name': 'python',
+         'description': 'Python assistant description',
+         # specs of arguments, see devassistant.argument.Argument.get_parser_spec
+         'args': [(['-n', '--name'], {'dest': 'name', 'help': 'Name of project.'})],
+         # specs of subassistants, sorted by name
+         'subassistants': [{'name': 'django', ...}, ...]}
+
+        Args:
+            assistant_tuple: part of assistant tree (see generate_argument_parser doc)
+        Returns:
+            specification of argument parser of given assistant and its subassistants
+        """
+        ass, subas = assistant_tuple
+        return {'name': ass.name,
+                'description': ass.description,
+                'args': [arg.get_parser_spec() for arg in ass.args],
+                'subassistants': [cls.get_spec(s) for s in sorted(subas,
+                                                                  key=lambda x: x[0].name)]}
+
+    @classmethod
+    def get_role_spec(cls, role_tuple, spec_cache=None):
+        """Returns specification of argument parser of given role (see get_spec). If
+        assistants of the role were loaded from cache, specifications of its subassistants
+        are created from the cached hierarchy (or taken from spec_cache, if they were
+        created from the same cached hierarchy before), not from the assistant tree.
+
+        Args:
+            role_tuple: part of assistant tree with role assistant
+            spec_cache: cache.ParserSpecCache instance or None
+        Returns:
+            specification of argument parser of given role and its subassistants
+        """
+        role, subas = role_tuple
+        hierarchy, fingerprint = YamlAssistantLoader.get_cached_role(role.name)
+        if hierarchy is None:
+            return cls.get_spec(role_tuple)
+
+        subas_specs = spec_cache.get(role.name, fingerprint) if spec_cache is not None else None
+        if subas_specs is None:
+            subas_specs = cls.get_cached_hierarchy_specs(hierarchy)
+            if spec_cache is not None:
+                spec_cache.set(role.name, fingerprint, subas_specs)
+        return {'name': role.name,
+                'description': role.description,
+                'args': [arg.get_parser_spec() for arg in role.args],
+                'subassistants': subas_specs}
+
+    @classmethod
+    def get_cached_hierarchy_specs(cls, cached_hierarchy):
+        """Returns list of specifications (see get_spec) of assistants from given
+        cached hierarchy (see devassistant.cache.Cache), sorted by name.
+        """
+        specs = []
+        for name, cached_ass in sorted(cached_hierarchy.items()):
+            attrs = cached_ass['attrs']
+            args = []
+            for arg_name, arg_params in (attrs.get('args') or {}).items():
+                try:
+                    args.append(Argument.construct_arg(arg_name, arg_params).
+                                get_parser_spec())
+                except exceptions.ExecutionException as e:
+                    msg = 'Problem when constructing argument {arg} in assistant {a}: {e}'.\
+                        format(arg=arg_name, a=name, e=six.text_type(e))
+                    logger.warning(msg)
+            specs.append({'name': name,
+                          'description': attrs.get('description') or '',
+                          'args': args,
+                          'subassistants': cls.get_cached_hierarchy_specs(
+                              cached_ass['subhierarchy'])})
+        return specs
+
+    @classmethod
+    def _get_spec_cache(cls):
+        if not settings.USE_CACHE:
+            return None
+        bndl = YamlAssistantLoader.get_bundle()
+        if bndl is not None:
+            return bndl.get_spec_cache()
+        try:
+            return cache.ParserSpecCache(settings.PARSER_CACHE_FILE)
+        except BaseException as e:
+            logger.debug('Failed to use DevAssistant parser cachefile {0}: {1}'.format(
+                settings.PARSER_CACHE_FILE, e))
+            return None
+
+    @classmethod
+    def _write_spec_cache(cls, spec_cache):
+        if spec_cache is None:
+            return
+        try:
+            spec_cache.write()
+        except BaseException as e:
+            logger.debug('Failed to write DevAssistant parser cachefile {0}: {1}'.format(
+                settings.PARSER_CACHE_FILE, e))
 
     @classmethod
     def add_action_to(cls, parser, action, subactions, level):
@@ -9,12 +9,16 @@ from devassistant.cli import argparse_generator
 from devassistant import exceptions
 from devassistant import logger
 from devassistant import path_runner
+from devassistant.profiler import profiler
 from devassistant import settings
 from devassistant import sigint_handler
 
 
 class CliRunner(object):
     cur_handler = None
+    # if not None, this parser is used instead of generating a new one (devassistant.daemon
+    #  generates the parser just once and then uses it for all runs)
+    argparser = None
 
     @classmethod
     def register_console_logging_handler(cls, lgr, level=logging.INFO):
@@ -45,15 +49,18 @@ class CliRunner(object):
         # set settings.USE_CACHE before constructing parser, since constructing
         # parser requires loaded assistants
         settings.USE_CACHE = False if '--no-cache' in sys.argv else True
+        settings.LAZY_LOAD_NAMES = cls.get_lazy_load_names(sys.argv[1:])
+        # enable profiler before constructing parser, so that loading assistants is measured
+        if '--profile' in sys.argv:
+            profiler.enable()
         cls.register_console_logging_handler(logger.logger)
         is_log_file = logger.add_log_file_handler(settings.LOG_FILE)
         if not is_log_file:
             logger.logger.warning("Could not create log file '{0}'.".format(settings.LOG_FILE))
         cls.inform_of_short_bin_name(sys.argv[0])
         top_assistant = bin.TopAssistant()
-        tree = top_assistant.get_subassistant_tree()
-        argparser = argparse_generator.ArgparseGenerator.\
-            generate_argument_parser(tree, actions=actions.actions)
+        with profiler.frame('load assistants'):
+            argparser = cls.argparser or cls.generate_argument_parser(top_assistant)
         parsed_args = vars(argparser.parse_args())
         if parsed_args.get('da_debug'):
             cls.change_logging_level(logging.DEBUG)
@@ -68,10 +75,45 @@ class CliRunner(object):
             parsed_args_decoded[k] = v.decode('utf-8') if not six.PY3 and isinstance(v, str) else v
         parsed_args_decoded['__ui__'] = 'cli'
         try:
-            to_run.run(**parsed_args_decoded)
+            with profiler.frame('execute'):
+                to_run.run(**parsed_args_decoded)
         except exceptions.ExecutionException:
             # error is already logged, just catch it and silently exit here
             sys.exit(1)
+        finally:
+            if profiler.enabled:
+                profiler.write_report()
+                profiler.disable()
+
+    @classmethod
+    def generate_argument_parser(cls, top_assistant):
+        """Generates argument parser from subassistant tree of given top_assistant
+        and from all actions."""
+        tree = top_assistant.get_subassistant_tree()
+        return argparse_generator.ArgparseGenerator.\
+            generate_argument_parser(tree, actions=actions.actions)
+
+    @classmethod
+    def get_lazy_load_names(cls, argv):
+        """Returns names of assistants that can possibly be selected by given argv (see
+        settings.LAZY_LOAD_NAMES). Argparse only selects a (sub)assistant if its name is
+        present in argv, so it's enough to load subassistants of assistants with such names.
+
+        The result is a deliberate over-approximation: it also contains values of options
+        (e.g. "foo" in "-n foo"). Which options take a value is only known from assistants
+        that haven't been loaded yet and skipping the argument after a flag that takes no
+        value could leave out a subassistant name (e.g. "django" in "python --flag django").
+        An extra name can only make loading slower (subassistants of an assistant called
+        the same as a value are loaded), never wrong.
+
+        Args:
+            argv: command line arguments (without program name)
+        Returns:
+            None if the whole assistant tree should be loaded (no positional argument
+            is given, e.g. "da" or "da -h"), set of possibly selected names otherwise
+        """
+        names = set(a for a in argv if not a.startswith('-'))
+        return names or None
 
     @classmethod
     def inform_of_short_bin_name(cls, binary):
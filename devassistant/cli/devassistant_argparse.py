@@ -8,8 +8,33 @@ from devassistant.actions import HelpAction
 
 class ArgumentParser(argparse.ArgumentParser):
     def __init__(self, *args, **kwargs):
+        # populate is a callable that adds arguments (and subparsers) to this parser; it is
+        # called just before this parser is used for the first time, so that parsers of
+        # subassistants that are not selected never get populated
+        self._populate = kwargs.pop('populate', None)
         super(ArgumentParser, self).__init__(*args, **kwargs)
 
+    def _ensure_populated(self):
+        if self._populate is not None:
+            populate, self._populate = self._populate, None
+            populate(self)
+
+    def parse_known_args(self, *args, **kwargs):
+        self._ensure_populated()
+        return super(ArgumentParser, self).parse_known_args(*args, **kwargs)
+
+    def _parse_known_args(self, *args, **kwargs):
+        self._ensure_populated()
+        return super(ArgumentParser, self)._parse_known_args(*args, **kwargs)
+
+    def format_usage(self):
+        self._ensure_populated()
+        return super(ArgumentParser, self).format_usage()
+
+    def format_help(self):
+        self._ensure_populated()
+        return super(ArgumentParser, self).format_help()
+
     def error(self, message):
         import sys as _sys
         # dirty hack - only top level binary has suppressed usage
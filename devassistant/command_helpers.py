@@ -8,6 +8,7 @@ import os
 import signal
 import subprocess
 import sys
+import threading
 
 import six
 
@@ -20,6 +21,17 @@ class ClHelper(object):
     command_processors = {}
     # register all invoked subprocesses
     subprocesses = {}
+    # branch of "parallel" block run by the current thread (see lang.run_parallel),
+    #  its name is passed to logger as "branch"
+    _branch = threading.local()
+
+    @classmethod
+    def set_branch(cls, branch):
+        cls._branch.name = branch
+
+    @classmethod
+    def get_branch(cls):
+        return getattr(cls._branch, 'name', None)
 
     @classmethod
     def run_command(cls,
@@ -68,7 +80,8 @@ class ClHelper(object):
         stdout_pipe = subprocess.PIPE
         stderr_pipe = subprocess.STDOUT
         preexec_fn = cls.ignore_sigint if ignore_sigint else None
-        env = os.environ if env is None else env
+        # env may be any mapping, e.g. context.EnvOverlay
+        env = os.environ if env is None else dict(env)
         proc = subprocess.Popen(cmd_str,
                                 stdin=stdin_pipe,
                                 stdout=stdout_pipe,
@@ -149,13 +162,16 @@ class ClHelper(object):
 
     @classmethod
     def kill_subprocesses(cls):
-        for pid, proc in cls.subprocesses.items():
+        for pid, proc in list(cls.subprocesses.items()):
             logger.info('Killing still running process {pid} ...'.format(pid=pid))
             proc.kill()
 
     @classmethod
     def log(cls, level, msg, event_type, secret):
         extra = {'event_type': event_type}
+        branch = cls.get_branch()
+        if branch is not None:
+            extra['branch'] = branch
         if secret:
             if event_type == 'cmd_call':
                 logger.log(level, 'LOGGING PREVENTED FOR SECURITY REASONS', extra=extra)
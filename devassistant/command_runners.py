@@ -1,7 +1,5 @@
-import copy
 import getpass
 import grp
-import json
 import logging
 import os
 import re
@@ -9,15 +7,12 @@ import time
 import string
 import subprocess
 import threading
-import unicodedata
 
-import dapp
-import jinja2
 import six
-import yaml
 
 import devassistant
 
+from devassistant import context
 from devassistant import exceptions
 from devassistant.remote_auth import GitHubAuth
 from devassistant.command_helpers import ClHelper, DialogHelper
@@ -26,7 +21,6 @@ from devassistant.logger import logger
 from devassistant.package_managers import DependencyInstaller
 from devassistant import settings
 from devassistant import utils
-from devassistant import yaml_snippet_loader
 
 """Mapping of prefixes to command runner lists, e.g.:
 
@@ -38,6 +32,15 @@ runners can outrun (and hence "override") the default ones.
 """
 command_runners = {}
 
+"""Generation of command_runners, bumped whenever a command runner is registered,
+so that memoized dispatch (see get_command_runners) is invalidated."""
+generation = 0
+
+# memoized results of get_command_runners, valid for (generation, command_runners) in
+#  _dispatch_for
+_dispatch = {}
+_dispatch_for = (None, None)
+
 
 def register_command_runner(arg):
     """Decorator that registers a command runner. Accepts either:
@@ -45,15 +48,19 @@ def register_command_runner(arg):
     - CommandRunner directly or
     - String prefix to register a command runner under (returning a decorator)
     """
+    global generation
     if isinstance(arg, str):
         def inner(command_runner):
+            global generation
             command_runners.setdefault(arg, [])
             command_runners[arg].append(command_runner)
+            generation += 1
             return command_runner
         return inner
     elif issubclass(arg, CommandRunner):
         command_runners.setdefault('', [])
         command_runners[''].append(arg)
+        generation += 1
         return arg
     else:
         msg = 'register_command_runner expects str or CommandRunner as argument, got: {0}'.\
@@ -61,7 +68,43 @@ def register_command_runner(arg):
         raise ValueError(msg)
 
 
+def get_command_runners(c):
+    """Returns command runners that may be able to run given command, in the order in
+    which they must be tried (see command_runners). Runners that declare
+    matches_comm_type_only are only asked once per prefix and command type, so for builtin
+    runners, the result usually is just the single runner that runs the command.
+
+    Args:
+        c - command to run, instance of devassistant.lang.Command
+
+    Returns:
+        list of command runners, whose "matches" method should be called in this order
+    """
+    global _dispatch, _dispatch_for
+    if _dispatch_for[0] != generation or _dispatch_for[1] is not command_runners:
+        _dispatch, _dispatch_for = {}, (generation, command_runners)
+    key = (c.prefix, c.comm_type)
+    runners = _dispatch.get(key)
+    if runners is None:
+        runners = []
+        # traverse in reversed order, so that dynamically loaded user command runners
+        #  can outrun (=> override) the builtin ones
+        for cr in reversed(command_runners.get(c.prefix, [])):
+            if not vars(cr).get('matches_comm_type_only', False):
+                runners.append(cr)
+            elif cr.matches(c):
+                runners.append(cr)
+                break
+        _dispatch[key] = runners
+    return runners
+
+
 class CommandRunner(object):
+    # True if "matches" only depends on prefix and type of the command (not on its input),
+    #  so that its result can be memoized, see get_command_runners; it's only respected
+    #  if it's declared by the class itself, as subclasses may override "matches"
+    matches_comm_type_only = False
+
     @classmethod
     def matches(cls, c):
         """Returns True if this command runner can run given command,
@@ -95,19 +138,23 @@ class CommandRunner(object):
 
 @register_command_runner
 class AtExitCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type == 'atexit'
 
     @classmethod
     def run(cls, c):
-        utils.atexit(lang.run_section, copy.deepcopy(c.comm), copy.deepcopy(c.kwargs),
-                     copy.deepcopy(c.kwargs['__assistant__']))
+        utils.atexit(lang.run_section, c.comm, context.snapshot(c.kwargs),
+                     c.kwargs['__assistant__'])
         return (True, c.comm)
 
 
 @register_command_runner
 class AskCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type.startswith('ask_')
@@ -130,6 +177,8 @@ class AskCommandRunner(CommandRunner):
 
 @register_command_runner
 class UseCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type == 'use'
@@ -170,7 +219,7 @@ class UseCommandRunner(CommandRunner):
 
     @classmethod
     def _construct_ctxt(cls, inp, original_ctxt):
-        """If inp is string, this just duplicates the whole context
+        """If inp is string, this just forks the whole context
         (e.g. "use: snippet.run_section"), else else we pass just special
         values (__*__) plus the specified values, e.g.:
         - use:
@@ -178,14 +227,17 @@ class UseCommandRunner(CommandRunner):
             args:
               foo: $somevar
               spam: $spamspam
+        Nothing is copied upfront, the new context is a context.Scope, so changes done
+        through it never affect the original context.
         """
         if isinstance(inp, dict):
-            new_ctxt = copy.deepcopy(inp['args'])
-            for k, v in original_ctxt.items():
+            visible = dict(inp['args'])
+            for k, v in context.shared_items(original_ctxt):
                 if k.startswith('__') and k.endswith('__'):
-                    new_ctxt[k] = copy.deepcopy(v)
+                    visible[k] = v
+            new_ctxt = context.Scope(visible)
         else:
-            new_ctxt = copy.deepcopy(original_ctxt)
+            new_ctxt = context.fork(original_ctxt)
 
         return new_ctxt
 
@@ -221,6 +273,8 @@ class UseCommandRunner(CommandRunner):
 
     @classmethod
     def get_snippet(cls, yaml_name):
+        # snippet loader (and yaml loading with it) is only needed by "use" of snippets
+        from devassistant import yaml_snippet_loader
         try:
             return yaml_snippet_loader.YamlSnippetLoader.get_snippet_by_name(yaml_name)
         except exceptions.SnippetNotFoundException as e:
@@ -269,6 +323,8 @@ class UseCommandRunner(CommandRunner):
 
 @register_command_runner
 class ClCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type.startswith('cl')
@@ -303,6 +359,8 @@ class ClCommandRunner(CommandRunner):
 
 @register_command_runner
 class DependenciesCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type.startswith('dependencies')
@@ -320,6 +378,8 @@ class DependenciesCommandRunner(CommandRunner):
 
 @register_command_runner
 class DotDevassistantCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type.startswith('dda_')
@@ -357,6 +417,7 @@ class DotDevassistantCommandRunner(CommandRunner):
     @classmethod
     def __dot_devassistant_write_struct(cls, directory, struct):
         """Helper for other methods that write to .devassistant file."""
+        import yaml
         dda_path = os.path.join(os.path.abspath(os.path.expanduser(directory)), '.devassistant')
         f = open(dda_path, 'w')
         yaml.dump(struct, stream=f, default_flow_style=False)
@@ -365,6 +426,7 @@ class DotDevassistantCommandRunner(CommandRunner):
     @classmethod
     def __dot_devassistant_read_exact(cls, directory):
         """Helper for other methods that read .devassistant file."""
+        import yaml
         dda_path = os.path.join(os.path.abspath(os.path.expanduser(directory)), '.devassistant')
         try:
             with open(dda_path, 'r') as stream:
@@ -387,7 +449,7 @@ class DotDevassistantCommandRunner(CommandRunner):
                     'original_kwargs': original_kwargs,
                     'project_type': kwargs['__assistant__'].project_type,
                     'dependencies': kwargs['__assistant__'].
-                    dependencies(kwargs=copy.deepcopy(original_kwargs), expand_only=True)}
+                    dependencies(kwargs=dict(original_kwargs), expand_only=True)}
         cls.__dot_devassistant_write_struct(directory, to_write)
 
     @classmethod
@@ -411,8 +473,9 @@ class DotDevassistantCommandRunner(CommandRunner):
         struct = []
         dda_content = cls.__dot_devassistant_read_exact(comm)
         original_kwargs = dda_content.get('original_kwargs', {})
-        mixed_kwargs = copy.deepcopy(original_kwargs)
-        mixed_kwargs.update(kwargs)
+        mixed_kwargs = dict(original_kwargs)
+        mixed_kwargs.update(context.shared_items(kwargs))
+        mixed_kwargs = context.Scope(mixed_kwargs)
         struct = lang.dependencies_section(dda_content.get('dependencies', []),
                                            mixed_kwargs,
                                            runner=kwargs.get('__assistant__'))
@@ -440,11 +503,9 @@ class DotDevassistantCommandRunner(CommandRunner):
 
 @register_command_runner
 class GitHubCommandRunner(CommandRunner):
+    matches_comm_type_only = True
     _user = None
-    try:
-        _gh_module = utils.import_module('github')
-    except:
-        _gh_module = None
+    _gh_module = utils.LazyImport('github')
     _required_yaml_args = {'default': ['login', 'reponame'],
                            'create_repo': ['login', 'reponame', 'private'],
                            'create_and_push': ['login', 'reponame', 'private'],
@@ -710,6 +771,8 @@ class GitHubCommandRunner(CommandRunner):
 
 @register_command_runner
 class LogCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type.startswith('log_')
@@ -730,6 +793,8 @@ class LogCommandRunner(CommandRunner):
 
 @register_command_runner
 class SCLCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type.startswith('scl ')
@@ -776,6 +841,8 @@ class SCLCommandRunner(CommandRunner):
 
 @register_command_runner
 class Jinja2Runner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type in ['jinja_render', 'jinja_render_dir']
@@ -851,6 +918,7 @@ class Jinja2Runner(CommandRunner):
         args = c.input_res
         logger.debug('Jinja2Runner args={0}'.format(repr(args)))
 
+        import jinja2
         # Create a jinja environment
         logger.debug('Using templates dir: {0}'.format(c.files_dir))
         env = jinja2.Environment(loader=jinja2.FileSystemLoader(c.files_dir))
@@ -872,6 +940,7 @@ class Jinja2Runner(CommandRunner):
 
     @classmethod
     def _render_one_template(cls, env, template, result_filename, data, overwrite):
+        import jinja2
         # Get a template instance
         tpl = None
         try:
@@ -927,6 +996,8 @@ class Jinja2Runner(CommandRunner):
 
 @register_command_runner
 class AsUserCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type.startswith('as ')
@@ -959,12 +1030,10 @@ class AsUserCommandRunner(CommandRunner):
 
 @register_command_runner
 class DockerCommandRunner(CommandRunner):
+    matches_comm_type_only = True
     _has_docker_group = None
     _client = None
-    try:
-        _docker_module = utils.import_module('docker')
-    except:
-        _docker_module = None
+    _docker_module = utils.LazyImport('docker')
 
     @classmethod
     def matches(cls, c):
@@ -1117,6 +1186,7 @@ class DockerCommandRunner(CommandRunner):
 
     @classmethod
     def _docker_build(cls, args):
+        import json
         if isinstance(args, six.string_types):
             raise exceptions.CommandException('docker_build now needs a mapping to pass' +
                 'to a docker-py client, please consult command reference for details.')
@@ -1311,6 +1381,8 @@ class DockerCommandRunner(CommandRunner):
 
 @register_command_runner
 class VagrantDockerCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type == 'vagrant_docker'
@@ -1361,6 +1433,8 @@ class VagrantDockerCommandRunner(CommandRunner):
 
 @register_command_runner
 class NormalizeCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type == 'normalize'
@@ -1384,6 +1458,7 @@ class NormalizeCommandRunner(CommandRunner):
         - removes digit from start
         - replaces dashes and whitespaces with underscores
         """
+        import unicodedata
         to_norm, ok_chars = cls._get_args(c.input_res)
 
         if six.PY2 and isinstance(to_norm, str):
@@ -1407,6 +1482,8 @@ class NormalizeCommandRunner(CommandRunner):
 
 @register_command_runner
 class SetupProjectDirCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type == 'setup_project_dir'
@@ -1488,6 +1565,8 @@ class SetupProjectDirCommandRunner(CommandRunner):
 
 @register_command_runner
 class PingPongCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type == 'pingpong'
@@ -1517,11 +1596,13 @@ class PingPongCommandRunner(CommandRunner):
                     logger.debug('Killed.')
                 else:
                     logger.debug('Process terminated OK.')
+        import dapp
         server = dapp.DAPPServer(proc, logger=logger)
         return cls._play_pingpong(server, c.kwargs)
 
     @classmethod
     def _play_pingpong(cls, server, ctxt):
+        import dapp
         # TODO: if we encounter an error on client side, we should terminate it
         # note: ctxt must always be updated with dapp.update_ctxt, so that all changes
         #  are done on the same object and therefore available for subsequent Yaml commands
@@ -1573,6 +1654,8 @@ class PingPongCommandRunner(CommandRunner):
 
 @register_command_runner
 class LoadCmdCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type == 'load_cmd'
@@ -1644,6 +1727,8 @@ class LoadCmdCommandRunner(CommandRunner):
 
 @register_command_runner
 class EnvCommandRunner(CommandRunner):
+    matches_comm_type_only = True
+
     @classmethod
     def matches(cls, c):
         return c.comm_type in ['env_set', 'env_unset']
@@ -0,0 +1,183 @@
+"""Variable contexts of Yaml DSL that don't need to be copied when they're passed on.
+
+Scope is a layered context - it reads variables of its parent context and stores all
+changes in its own layer, so e.g. a snippet called by "use" can't change variables of
+its caller. Mutable values (lists, dicts, sets and environments) are copied into the scope
+when they're first read through it (see copy_value), so they can be modified in place, too.
+
+EnvOverlay is used as "__env__" - environment of the DevAssistant process with changes
+done by "env_set" and "env_unset" on top of it.
+"""
+import copy
+import os
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
+
+import yaml
+
+
+class EnvOverlay(MutableMapping):
+    """Environment variables (os.environ by default) with local changes on top of them;
+    the environment itself is never modified."""
+
+    def __init__(self, base=None, changes=None, removed=None):
+        self.base = os.environ if base is None else base
+        self.changes = dict(changes or {})
+        self.removed = set(removed or [])
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            return self.changes[key]
+        if key in self.removed:
+            raise KeyError(key)
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        self.changes[key] = value
+        self.removed.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.changes.pop(key, None)
+        self.removed.add(key)
+
+    def __contains__(self, key):
+        return key in self.changes or (key not in self.removed and key in self.base)
+
+    def __iter__(self):
+        for key in self.changes:
+            yield key
+        for key in self.base:
+            if key not in self.changes and key not in self.removed:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return 'EnvOverlay({0!r})'.format(dict(self))
+
+    def copy(self):
+        """Returns a new overlay of the same environment with a copy of changes."""
+        return EnvOverlay(self.base, self.changes, self.removed)
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+
+class Scope(MutableMapping):
+    """Layered variable context, see module docstring."""
+
+    def __init__(self, parent, local=None):
+        """
+        Args:
+            parent: context (dict or Scope) to read variables from
+            local: dict of variables of this scope (these hide variables of parent)
+        """
+        self.parent = parent
+        self.local = {} if local is None else local
+        self.removed = set()
+
+    def _lookup(self, key):
+        """Returns value of given variable without copying it."""
+        if key in self.local:
+            return self.local[key]
+        if key in self.removed:
+            raise KeyError(key)
+        if isinstance(self.parent, Scope):
+            return self.parent._lookup(key)
+        return self.parent[key]
+
+    def __getitem__(self, key):
+        if key in self.local:
+            return self.local[key]
+        value = self._lookup(key)
+        copied = copy_value(value)
+        if copied is not value:
+            self.local[key] = copied
+        return copied
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+        self.removed.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.local.pop(key, None)
+        self.removed.add(key)
+
+    def __contains__(self, key):
+        return key in self.local or (key not in self.removed and key in self.parent)
+
+    def __iter__(self):
+        for key in self.local:
+            yield key
+        for key in self.parent:
+            if key not in self.local and key not in self.removed:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return 'Scope({0!r})'.format(dict(shared_items(self)))
+
+
+def _is_container(value):
+    return isinstance(value, (list, dict, set, EnvOverlay))
+
+
+def copy_value(value):
+    """Returns copy of given value, if it's mutable (list, dict, set or EnvOverlay), the
+    value itself otherwise. Flat lists and dicts (the usual case) are copied shallowly,
+    those that contain other containers are copied deeply, so that even changes of the
+    nested containers don't affect the original value."""
+    if isinstance(value, list):
+        if any(_is_container(v) for v in value):
+            return copy.deepcopy(value)
+        return list(value)
+    if isinstance(value, dict):
+        if any(_is_container(v) for v in value.values()):
+            return copy.deepcopy(value)
+        return value.copy()
+    if isinstance(value, (set, EnvOverlay)):
+        return value.copy()
+    return value
+
+
+def shared_items(ctxt):
+    """Returns list of (name, value) pairs of given context (dict or Scope), without
+    copying any values."""
+    if isinstance(ctxt, Scope):
+        return [(k, ctxt._lookup(k)) for k in ctxt]
+    return list(ctxt.items())
+
+
+def fork(ctxt):
+    """Returns a new Scope on top of given context; changes done through it don't affect
+    the context."""
+    return Scope(ctxt)
+
+
+def snapshot(ctxt):
+    """Returns a dict with variables of given context; mutable values are copied (see
+    copy_value), so that later changes of the context don't affect the snapshot."""
+    return dict((k, copy_value(v)) for k, v in shared_items(ctxt))
+
+
+def _represent_mapping(dumper, data):
+    return dumper.represent_dict(dict(shared_items(data)))
+
+
+# contexts are dumped as plain mappings, e.g. when passed to "da eval" or PingPong scripts
+for _dumper in ['Dumper', 'SafeDumper', 'CDumper', 'CSafeDumper']:
+    if hasattr(yaml, _dumper):
+        for _cls in [EnvOverlay, Scope]:
+            yaml.add_representer(_cls, _represent_mapping, Dumper=getattr(yaml, _dumper))
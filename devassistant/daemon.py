@@ -0,0 +1,266 @@
+"""DevAssistant daemon keeps loaded assistants, snippets, command runners and generated
+argument parser in memory, so that "da" invocations don't have to load them again and
+again. It listens on settings.DAEMON_SOCKET; devassistant.daemon_client sends it argv,
+working directory, environment and standard streams of every "da" invocation. For each
+of them, the daemon forks a child that takes over the streams and runs CliRunner, so the
+runs are isolated from each other and from the daemon itself.
+
+Before each run, the daemon checks assistant and snippet directories on load paths for
+changes and reloads everything if something has changed.
+"""
+import fcntl
+import io
+import os
+import signal
+import socket
+import sys
+import termios
+import time
+import traceback
+
+from devassistant import bin
+from devassistant import bundle
+from devassistant.cli import cli_runner
+from devassistant import command_helpers
+from devassistant import daemon_client
+from devassistant import exceptions
+from devassistant import lang
+from devassistant.logger import logger
+from devassistant import settings
+from devassistant import utils
+from devassistant.yaml_assistant_loader import YamlAssistantLoader
+from devassistant.yaml_snippet_loader import YamlSnippetLoader
+
+
+class Daemon(object):
+    # fingerprint of load paths that currently loaded assistants correspond to
+    #  and time (in seconds) when it was taken
+    fingerprint = None
+    fingerprint_time = 0
+    # pids of running children
+    children = set()
+
+    @classmethod
+    def serve(cls, socket_path=settings.DAEMON_SOCKET):
+        """Loads everything and serves requests of clients on given socket until killed.
+
+        Raises:
+            devassistant.exceptions.ExecutionException if daemon can't be started
+        """
+        if not daemon_client.is_supported():
+            raise exceptions.ExecutionException(
+                'DevAssistant daemon is not supported on this platform.')
+        sock = cls.bind(socket_path)
+        # make sure that socket gets removed when daemon is terminated
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            cls.load()
+            logger.info('DevAssistant daemon is listening on {0}'.format(socket_path))
+            while True:
+                conn, _ = sock.accept()
+                cls.reap_children()
+                try:
+                    cls.handle(conn, sock)
+                except (socket.error, OSError, ValueError) as e:
+                    logger.warning('Failed to handle request: {0}'.format(e))
+                finally:
+                    conn.close()
+        finally:
+            sock.close()
+            os.unlink(socket_path)
+
+    @classmethod
+    def bind(cls, socket_path):
+        """Returns socket bound to given path (only accessible by current user)."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(socket_path):
+            try:
+                sock.connect(socket_path)
+            except socket.error:
+                # stale socket of daemon that didn't exit cleanly
+                os.unlink(socket_path)
+            else:
+                sock.close()
+                raise exceptions.ExecutionException(
+                    'DevAssistant daemon is already running on {0}'.format(socket_path))
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            sock.bind(socket_path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(16)
+        return sock
+
+    @classmethod
+    def load(cls):
+        """(Re)loads assistants, snippets, command runners and argument parser."""
+        YamlAssistantLoader._assistants = {}
+        YamlAssistantLoader._caches = {}
+        YamlAssistantLoader._cache = None
+        bundle.Bundle._loaded = {}
+        YamlSnippetLoader._snippets = {}
+        YamlSnippetLoader._loaded_all = False
+        YamlSnippetLoader._index = None
+        cli_runner.CliRunner.argparser = None
+
+        cls.fingerprint_time = time.time()
+        cls.fingerprint = cls.get_load_paths_fingerprint()
+        settings.USE_CACHE = True
+        settings.LAZY_LOAD_NAMES = None
+        lang.Command.load_command_runners()
+        YamlSnippetLoader.get_all_snippets()
+        cli_runner.CliRunner.argparser = \
+            cli_runner.CliRunner.generate_argument_parser(bin.TopAssistant())
+        # daemon doesn't exit after loading, so write the caches right away
+        YamlAssistantLoader.flush_cache()
+        YamlSnippetLoader.flush_index()
+
+    @classmethod
+    def get_load_paths_fingerprint(cls):
+        """Returns {path: (ctime in ns, size) or None if path doesn't exist} of assistant
+        and snippet directories on load paths, their subdirectories and all files in them.
+
+        Ctime of a directory changes whenever anything is added to it or removed from it,
+        so load_paths_changed only needs to stat these paths again, not to list directories.
+        """
+        fingerprint = {}
+        to_scan = [os.path.join(d, sub) for d in settings.DATA_DIRECTORIES
+                   for sub in ['assistants', 'snippets']]
+        while to_scan:
+            d = to_scan.pop()
+            fingerprint[d] = cls._stat_path(d)
+            files, subdirs = utils.scan_dir(d)
+            fingerprint.update((path, (st['ctime_ns'], st['size'])) for _, path, st in files)
+            to_scan.extend(os.path.join(d, s) for s in subdirs)
+        return fingerprint
+
+    @classmethod
+    def load_paths_changed(cls):
+        """Returns True if any assistant or snippet on load paths has been added, removed
+        or changed since the last load (or if nothing has been loaded yet)."""
+        if cls.fingerprint is None:
+            return True
+        # timestamps have coarse granularity, so a file added to a directory shortly after
+        #  it was changed may not change its ctime; if anything was changed shortly before
+        #  the fingerprint was taken, directories are listed again
+        racy_ns = (cls.fingerprint_time - 1) * 10 ** 9
+        if any(st is not None and st[0] >= racy_ns for st in cls.fingerprint.values()):
+            return cls.get_load_paths_fingerprint() != cls.fingerprint
+        return any(cls._stat_path(path) != st for path, st in cls.fingerprint.items())
+
+    @classmethod
+    def _stat_path(cls, path):
+        try:
+            st = utils.stat_info(os.stat(path))
+        except OSError:
+            return None
+        return st['ctime_ns'], st['size']
+
+    @classmethod
+    def reap_children(cls):
+        for pid in list(cls.children):
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                cls.children.remove(pid)
+
+    @classmethod
+    def handle(cls, conn, sock):
+        """Handles one request from a client connected by conn."""
+        request, fds = daemon_client.recv_message(conn, with_fds=True)
+        try:
+            if request is None or len(fds) != daemon_client.PASSED_FDS:
+                return
+            # settings are computed from environment on import, so we can only serve
+            #  clients that would compute the same settings
+            if cls._settings_env(request['env']) != cls._settings_env(os.environ):
+                daemon_client.send_message(conn, {'refused': 'different environment'})
+                return
+            if cls.load_paths_changed():
+                logger.info('Load paths have changed, reloading ...')
+                cls.load()
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                sock.close()
+                cls.run_child(conn, fds, request)
+            cls.children.add(pid)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    @classmethod
+    def run_child(cls, conn, fds, request):
+        """Runs CliRunner with given request in a forked child, never returns."""
+        exit_code = 1
+        try:
+            # detach from daemon's terminal, if any, so that the child can use client's one
+            os.setsid()
+            for i, fd in enumerate(fds):
+                os.dup2(fd, i)
+            for fd in fds:
+                if fd > 2:
+                    os.close(fd)
+            if not cls.acquire_terminal():
+                # prompts (getpass, sudo, pkexec) wouldn't work without controlling
+                #  terminal, so let the client run DevAssistant itself
+                daemon_client.send_message(conn, {'refused': 'can\'t use client\'s terminal'})
+                exit_code = 0
+                return
+            sys.stdin = io.open(0, 'r', closefd=False)
+            sys.stdout = io.open(1, 'w', buffering=1, closefd=False)
+            sys.stderr = io.open(2, 'w', buffering=1, closefd=False)
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            sys.argv = request['argv']
+            # CliRunner registers its own handlers for client's stdout and log file
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+            daemon_client.send_message(conn, {'pid': os.getpid()})
+            exit_code = cls.run_cli()
+            daemon_client.send_message(conn, {'exit': exit_code})
+        finally:
+            command_helpers.ClHelper.kill_subprocesses()
+            os._exit(exit_code)
+
+    @classmethod
+    def acquire_terminal(cls):
+        """Makes the client's terminal (if any of standard streams is one) controlling
+        terminal of this process, which must be a session leader.
+
+        Returns:
+            False if some of standard streams is a terminal that can't be acquired (e.g.
+            because it's controlling terminal of client's session), True otherwise
+        """
+        for fd in range(daemon_client.PASSED_FDS):
+            if os.isatty(fd):
+                try:
+                    fcntl.ioctl(fd, termios.TIOCSCTTY, 0)
+                    return True
+                except (IOError, OSError):
+                    return False
+        return True
+
+    @classmethod
+    def run_cli(cls):
+        """Runs CliRunner and returns its exit code."""
+        try:
+            cli_runner.CliRunner.run()
+            return 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            sys.stderr.write('{0}\n'.format(e.code))
+            return 1
+        except BaseException:
+            traceback.print_exc()
+            return 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+    @classmethod
+    def _settings_env(cls, env):
+        return dict((k, v) for k, v in env.items() if k.startswith('DEVASSISTANT_') or k == 'HOME')
@@ -0,0 +1,129 @@
+"""Thin client of DevAssistant daemon (see devassistant.daemon).
+
+This module is the entry point of "da" binary. It must stay cheap to import, so it
+only imports modules from standard library. If the daemon is running, it forwards
+argv, working directory, environment and standard streams (as file descriptors)
+to it over a Unix domain socket and just waits for exit code of the run. Otherwise
+(or if the daemon refuses the request), it runs DevAssistant in this process.
+"""
+import array
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+
+# header of every message, contains length of json encoded message that follows
+HEADER = struct.Struct('!I')
+# number of file descriptors that are passed to daemon - stdin, stdout, stderr
+PASSED_FDS = 3
+
+
+def get_socket_path(environ=os.environ):
+    """Returns path of daemon socket, must be the same as settings.DAEMON_SOCKET
+    (settings are not imported here, since that's too costly)."""
+    if 'DEVASSISTANT_DAEMON_SOCKET' in environ:
+        return environ['DEVASSISTANT_DAEMON_SOCKET']
+    home = environ.get('DEVASSISTANT_HOME', '~/.devassistant')
+    return os.path.join(os.path.abspath(os.path.expanduser(home)), 'daemon.sock')
+
+
+def is_supported():
+    """Returns True if this platform supports passing file descriptors over sockets."""
+    return hasattr(socket, 'AF_UNIX') and hasattr(socket.socket, 'sendmsg')
+
+
+def send_message(sock, message, fds=None):
+    """Sends json encoded message (preceded by HEADER) over given socket, optionally
+    with given file descriptors."""
+    data = json.dumps(message).encode('utf-8')
+    data = HEADER.pack(len(data)) + data
+    ancdata = []
+    if fds:
+        ancdata = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))]
+    sent = sock.sendmsg([data], ancdata)
+    sock.sendall(data[sent:])
+
+
+def recv_message(sock, with_fds=False):
+    """Receives a message sent by send_message from given socket.
+
+    Returns:
+        received message (None if the other side closed the socket) or tuple
+        (message, list of received file descriptors) if with_fds is True
+    """
+    fds = array.array('i')
+    data = b''
+    size = None
+    while size is None or len(data) < HEADER.size + size:
+        if with_fds and not fds:
+            chunk, ancdata, _, _ = sock.recvmsg(4096,
+                                                socket.CMSG_LEN(PASSED_FDS * fds.itemsize))
+            for level, tp, cdata in ancdata:
+                if level == socket.SOL_SOCKET and tp == socket.SCM_RIGHTS:
+                    fds.frombytes(cdata[:len(cdata) - (len(cdata) % fds.itemsize)])
+        else:
+            chunk = sock.recv(4096)
+        if not chunk:
+            message = None
+            break
+        data += chunk
+        if size is None and len(data) >= HEADER.size:
+            size = HEADER.unpack(data[:HEADER.size])[0]
+    else:
+        message = json.loads(data[HEADER.size:].decode('utf-8'))
+    if with_fds:
+        return message, list(fds)
+    return message
+
+
+def get_action_name(argv):
+    """Returns name of action or assistant selected by given argv, i.e. its first positional
+    argument (all options of the top level parser are flags), or None if there's none."""
+    for arg in argv[1:]:
+        if not arg.startswith('-'):
+            return arg
+    return None
+
+
+def run_in_daemon(argv):
+    """Runs DevAssistant with given argv in daemon, if it's running.
+
+    Returns:
+        exit code of the run or None if the run wasn't done by daemon
+    """
+    # "da daemon" itself always runs locally
+    if not is_supported() or get_action_name(argv) == 'daemon':
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    pid = None
+    try:
+        sock.connect(get_socket_path())
+        request = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        send_message(sock, request,
+                     fds=[sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+        response = recv_message(sock)
+        if not response or 'pid' not in response:
+            return None
+        # the run has started, from now on, we can't fall back to running it locally
+        pid = response['pid']
+        while True:
+            try:
+                response = recv_message(sock)
+                return response['exit'] if response else 1
+            except KeyboardInterrupt:
+                os.kill(pid, signal.SIGINT)
+    except (socket.error, OSError, ValueError):
+        return None if pid is None else 1
+    finally:
+        sock.close()
+
+
+def run():
+    exit_code = run_in_daemon(sys.argv)
+    if exit_code is None:
+        from devassistant.cli.cli_runner import CliRunner
+        CliRunner.run()
+    else:
+        sys.exit(exit_code)
@@ -1,6 +1,5 @@
 from __future__ import print_function
 
-import requests
 import yaml
 import os
 import glob
@@ -51,13 +50,19 @@ def _process_req(req):
     return yaml.load(_process_req_txt(req))
 
 
+def _get(link):
+    '''Returns response to GET request of given link'''
+    # requests takes long to import and most of DevAssistant invocations don't need it
+    import requests
+    return requests.get(link)
+
+
 def data(link):
     '''Returns a dictionary from requested link'''
     test = os.environ.get('DAPI_FAKE_DATA', None)
     if test is not None:
         return yaml.load(test)
-    req = requests.get(link)
-    return _process_req(req)
+    return _process_req(_get(link))
 
 
 def _unpaginated(what):
@@ -435,4 +440,4 @@ def install_dap(name, version='', update=False, first=True, force=False):
 def get_dependency_metadata():
     '''Returns list of strings with dependency metadata from Dapi'''
     link = os.path.join(_api_url(), 'meta.txt')
-    return _process_req_txt(requests.get(link)).split('\n')
+    return _process_req_txt(_get(link)).split('\n')
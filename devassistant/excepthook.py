@@ -23,12 +23,13 @@ class DAPrettyPrinter(pprint.PrettyPrinter):
 
 def is_local_subsection(command_dict):
     """Returns True if command dict is "local subsection", meaning
-    that it is "if", "else" or "for" (not a real call, but calls
+    that it is "if", "else", "for" or "parallel" (not a real call, but calls
     run_section recursively."""
+    comm_type = list(command_dict.keys())[0]
     for local_com in ['if ', 'for ', 'else ']:
-        if list(command_dict.keys())[0].startswith(local_com):
+        if comm_type.startswith(local_com):
             return True
-    return False
+    return comm_type == 'parallel'
 
 
 def excepthook(type, value, traceback):
@@ -47,7 +48,7 @@ def excepthook(type, value, traceback):
         pp = DAPrettyPrinter()
         for frame in run_section_frames:
             current_command_dict = frame.f_locals['command_dict']
-            # skip 'if', 'else' and 'for' commands
+            # skip 'if', 'else', 'for' and 'parallel' commands
             # they call run_section recursively, but are still in the same 'run*' section
             if not is_local_subsection(current_command_dict):
                 print('File {0}:'.format(frame.f_locals['kwargs']['__sourcefiles__'][-1]))
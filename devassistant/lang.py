@@ -1,14 +1,18 @@
 """This module contains functions that execute assistants' dependencies and run
 sections. These functions usually assume that their input has been previously
 checked by `devassistant.yaml_checker.check`."""
+import collections
 import os
 import re
 import shlex
 import string
 import sys
+import threading
 
 import six
 
+from devassistant.command_helpers import ClHelper
+from devassistant import context
 from devassistant import exceptions
 from devassistant.logger import logger
 from devassistant import package_managers
@@ -51,13 +55,9 @@ class Command(object):
         self.kwargs = kwargs
 
     def run(self):
-        for crs_prefix, crs in type(self).load_command_runners().command_runners.items():
-            if self.prefix == crs_prefix:
-                # traverse in reversed order, so that dynamically loaded user command runners
-                #  can outrun (=> override) the builtin ones
-                for cr in reversed(crs):
-                    if cr.matches(self):
-                        return cr.run(self)
+        for cr in type(self).load_command_runners().get_command_runners(self):
+            if cr.matches(self):
+                return cr.run(self)
 
         prefix_with_colon = self.prefix + '.' if self.prefix else self.prefix
         raise exceptions.CommandException(
@@ -86,38 +86,12 @@ class Command(object):
 
 def dependencies_section(section, kwargs, runner=None):
     # "deps" is the same structure as gets returned by "dependencies" method
-    skip_else = False
     deps = []
 
-    for i, dep in enumerate(section):
-        if getattr(runner, 'stop_flag', False):
+    for op in lower_section(section).dependencies_ops:
+        if is_stopped(runner):
             break
-        for dep_type, dep_list in dep.items():
-            # rpm dependencies (can't handle anything else yet)
-            # we don't allow general commands, only "call"/"use" command here
-            if dep_type in ['call', 'use']:
-                deps.extend(Command(dep_type, dep_list, kwargs).run())
-            # handle known types of deps the same, just by appending to "deps" list
-            elif dep_type in package_managers.managers.keys():
-                fmtd = list(map(lambda dep: format_str(dep, kwargs), dep_list))
-                deps.append({dep_type: fmtd})
-            elif dep_type.startswith('if'):
-                possible_else = None
-                if len(section) > i + 1:  # do we have "else" clause?
-                    possible_else = list(section[i + 1].items())[0]
-                _, skip_else, to_run = get_section_from_condition((dep_type, dep_list),
-                                                                  possible_else, kwargs)
-                if to_run:
-                    deps.extend(dependencies_section(to_run, kwargs, runner=runner))
-            elif dep_type == 'else':
-                # else on its own means error, otherwise execute it
-                if not skip_else:
-                    msg = 'Yaml error: encountered "else" with no associated "if", skipping.'
-                    logger.error(msg)
-                    raise exceptions.YamlSyntaxError(msg)
-                skip_else = False
-            else:
-                logger.warning('Unknown dependency type {0}, skipping.'.format(dep_type))
+        op.collect(kwargs, runner, deps)
 
     return deps
 
@@ -146,55 +120,22 @@ def run_section(section, kwargs=None, runner=None):
 
 
 def eval_exec_section(section, kwargs, runner=None):
-    skip_else = False
     retval = (False, '')
 
     if isinstance(section, six.string_types):
         return evaluate_expression(section, kwargs)
 
-    for i, command_dict in enumerate(section):
-        if getattr(runner, 'stop_flag', False):
+    for op in lower_section(section).run_ops:
+        if is_stopped(runner):
             break
-        for comm_type, comm in command_dict.items():
-            if comm_type.startswith('if'):
-                possible_else = None
-                if len(section) > i + 1:  # do we have "else" clause?
-                    possible_else = list(section[i + 1].items())[0]
-                _, skip_else, to_run = get_section_from_condition((comm_type, comm),
-                                                                  possible_else, kwargs)
-                # run with original kwargs, so that they might be changed for code after this
-                if to_run:
-                    retval = run_section(to_run, kwargs, runner=runner)
-            elif comm_type == 'else':
-                if not skip_else:
-                    msg = 'Yaml error: encountered "else" with no associated "if", skipping.'
-                    raise exceptions.YamlSyntaxError(msg)
-                skip_else = False
-            elif comm_type.startswith('for '):
-                # syntax: "for $i in $x: <section> or "for $i in cl_command: <section>"
-                control_vars, eval_expression = get_for_control_var_and_eval_expr(comm_type,
-                                                                                  kwargs)
-                for i in eval_expression:
-                    if len(control_vars) == 2:
-                        kwargs[control_vars[0]] = i[0]
-                        kwargs[control_vars[1]] = i[1]
-                    else:
-                        kwargs[control_vars[0]] = i
-                    retval = run_section(comm, kwargs, runner=runner)
-            elif comm_type.startswith('$'):
-                # commands that can have exec flag appended follow
-                if comm_type.endswith('~'):  # on exec flag, eval comm as exec section
-                    comm_ret = eval_exec_section(comm, kwargs, runner)
-                else:  # with no exec flag, eval comm as input section
-                    comm_ret = eval_literal_section(comm, kwargs, runner)
-                retval = assign_variable(comm_type, *comm_ret, kwargs=kwargs)
-            else:
-                retval = Command(comm_type, comm, kwargs=kwargs).run()
+        # command dict that is being executed, see excepthook
+        command_dict = op.command_dict
+        retval = op.run(kwargs, runner, retval)
 
-            if not isinstance(retval, (list, tuple)) or len(retval) != 2:
-                raise exceptions.RunException('Bad return value of last command ({ct}: {c}): {r}'.
-                                              format(ct=comm_type, c=comm, r=retval))
-            assign_last_result(kwargs, *retval)
+        if not isinstance(retval, (list, tuple)) or len(retval) != 2:
+            raise exceptions.RunException('Bad return value of last command ({ct}: {c}): {r}'.
+                                          format(ct=op.comm_type, c=op.comm, r=retval))
+        assign_last_result(kwargs, *retval)
 
     return retval
 
@@ -283,6 +224,12 @@ def get_for_control_var_and_eval_expr(comm_type, kwargs):
     """
     # let possible exceptions bubble up
     control_vars, iter_type, expression = parse_for(comm_type)
+    return control_vars, _get_for_iterval(control_vars, iter_type, expression, kwargs)
+
+
+def _get_for_iterval(control_vars, iter_type, expression, kwargs):
+    """Returns iterable that is result of evaluated expression of a for loop with given
+    control variables and iteration type."""
     eval_expression = evaluate_expression(expression, kwargs)[1]
 
     iterval = []
@@ -300,7 +247,7 @@ def get_for_control_var_and_eval_expr(comm_type, kwargs):
     else:
         iterval = eval_expression
 
-    return control_vars, iterval
+    return iterval
 
 
 def get_section_from_condition(if_section, else_section, kwargs):
@@ -322,7 +269,7 @@ def get_section_from_condition(if_section, else_section, kwargs):
     """
     # check if else section is really else
     skip = True if else_section is not None and else_section[0] == 'else' else False
-    if evaluate_expression(if_section[0][2:].strip(), kwargs)[0]:
+    if evaluate_expression(if_section[0][2:].strip(), kwargs, need_result=False)[0]:
         return (0, skip, if_section[1])
     else:
         return (1, skip, else_section[1]) if skip else (1, skip, None)
@@ -348,6 +295,128 @@ def assign_variable(variable, log_res, res, kwargs):
         log_res: logical result of evaluated section
         res: result of evaluated section
 
+    Raises:
+        YamlSyntaxError: if there are more than two variables
+    """
+    var1, var2 = get_assigned_var_names(variable)
+    if var1 is not None:
+        kwargs[var1] = log_res
+    kwargs[var2] = res
+    return log_res, res
+
+
+def parse_parallel(comm):
+    """Parses input of "parallel" block - either a list of branches or a mapping with
+    "branches" and optionally "max_workers"; each branch is a section or a single command
+    dict.
+
+    Returns:
+        tuple (list of branches as sections, max_workers or None)
+    Raises:
+        exceptions.YamlSyntaxError if the input is malformed
+    """
+    max_workers = None
+    branches = comm
+    if isinstance(comm, dict):
+        branches = comm.get('branches')
+        max_workers = comm.get('max_workers')
+        if set(comm.keys()) - set(['branches', 'max_workers']):
+            branches = None
+    if not isinstance(branches, list):
+        raise exceptions.YamlSyntaxError('"parallel" expects a list of branches or a mapping '
+                                         'with "branches" and "max_workers", got: {0}'.
+                                         format(comm))
+    return [[b] if isinstance(b, dict) else b for b in branches], max_workers
+
+
+# cancellation of the "parallel" block, whose branch is run by the current thread
+_parallel = threading.local()
+
+
+class _Cancellation(object):
+    """Cancellation of a "parallel" block; a block nested in a branch of another block is
+    also cancelled when the outer block is."""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    @property
+    def cancelled(self):
+        return self._cancelled or (self.parent is not None and self.parent.cancelled)
+
+
+def is_stopped(runner):
+    """Returns True if no more commands should be run - either because given runner was
+    stopped or because the "parallel" block run by the current thread was cancelled
+    (this is checked in every section, so it also applies to sections run by "use")."""
+    if getattr(runner, 'stop_flag', False):
+        return True
+    cancellation = getattr(_parallel, 'cancellation', None)
+    return cancellation is not None and cancellation.cancelled
+
+
+def run_parallel(branches, kwargs, runner, max_workers):
+    """Runs given sections concurrently in at most max_workers threads. Each of them runs in
+    its own context forked from kwargs (see context.fork), so they don't see each other's
+    variables and don't change kwargs. Output of commands run by ClHelper is tagged by
+    "branch <number>". Once a branch raises an exception, no more commands are started in
+    the other branches (commands that are already running are finished) and the exception
+    is raised again when all branches stop.
+
+    Returns:
+        tuple (True if all branches were successful, list of results of branches)
+    """
+    cancellation = _Cancellation(getattr(_parallel, 'cancellation', None))
+    results = [(False, '')] * len(branches)
+    errors = []
+    lock = threading.Lock()
+    todo = collections.deque(enumerate(branches))
+
+    def worker():
+        _parallel.cancellation = cancellation
+        while not is_stopped(runner):
+            with lock:
+                if not todo:
+                    return
+                i, branch = todo.popleft()
+            ClHelper.set_branch('branch {0}'.format(i + 1))
+            try:
+                results[i] = eval_exec_section(branch, context.fork(kwargs), runner)
+            except BaseException:
+                with lock:
+                    errors.append(sys.exc_info())
+                cancellation.cancel()
+            finally:
+                ClHelper.set_branch(None)
+
+    threads = [threading.Thread(target=worker) for i in range(min(max_workers, len(branches)))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    except BaseException:
+        # e.g. KeyboardInterrupt in the main thread
+        cancellation.cancel()
+        raise
+
+    if errors:
+        for exc_info in errors[1:]:
+            logger.debug('Another branch of "parallel" failed: {0}'.format(exc_info[1]))
+        six.reraise(*errors[0])
+    return all(r[0] for r in results), [r[1] for r in results]
+
+
+def get_assigned_var_names(variable):
+    """Returns names of variables that logical result and result get assigned to by given
+    left side of assignment (see assign_variable); the first one is None if there's just
+    one variable.
+
     Raises:
         YamlSyntaxError: if there are more than two variables
     """
@@ -359,11 +428,8 @@ def assign_variable(variable, log_res, res, kwargs):
 
     if comma_count == 1:
         var1, var2 = map(lambda v: get_var_name(v), variable.split(','))
-        kwargs[var1] = log_res
-    else:
-        var2 = get_var_name(variable)
-    kwargs[var2] = res
-    return log_res, res
+        return var1, var2
+    return None, get_var_name(variable)
 
 
 _var_matcher = re.compile(r'^\s*\$\{?([\w]+)\}?\s*$')
@@ -381,6 +447,315 @@ def get_var_name(dollar_variable):
     return matched.group(1)
 
 
+# Intermediate representation of run and dependencies sections
+# version of ops below, lowered sections of other versions are lowered again (change it
+#  whenever ops change)
+IR_VERSION = 2
+
+
+class Section(list):
+    """Run or dependencies section together with its lowered form - lists of ops (see Op),
+    that the section is executed by. Ops are created just once per section (when it is
+    executed for the first time or by lower_sections) and stored in cached assistant bodies
+    and snippet index, so that command dicts aren't inspected on every execution.
+
+    Section is still the original list of command dicts, so it can be used anywhere
+    a plain section can.
+    """
+    __slots__ = ('ir_version', '_run_ops', '_dependencies_ops')
+
+    def __init__(self, section=()):
+        super(Section, self).__init__(section)
+        self.ir_version = IR_VERSION
+        self._run_ops = None
+        self._dependencies_ops = None
+
+    @property
+    def run_ops(self):
+        """Ops to execute this section as a run section by (see eval_exec_section)."""
+        if self._run_ops is None:
+            self._run_ops = lower_run_section(self)
+        return self._run_ops
+
+    @property
+    def dependencies_ops(self):
+        """Ops to execute this section as a dependencies section by (see
+        dependencies_section)."""
+        if self._dependencies_ops is None:
+            self._dependencies_ops = lower_dependencies_section(self)
+        return self._dependencies_ops
+
+
+def lower_section(section):
+    """Returns given section as Section (the same object, if it already is an up-to-date
+    Section); anything else than a list (e.g. an expression) is returned as it is."""
+    if isinstance(section, Section) and getattr(section, 'ir_version', None) == IR_VERSION:
+        return section
+    if isinstance(section, list):
+        return Section(section)
+    return section
+
+
+def lower_sections(parsed_yaml):
+    """Replaces all run and dependencies sections of given parsed assistant or snippet
+    by their lowered forms (in place), see Section."""
+    if not isinstance(parsed_yaml, dict):
+        return
+    for k, v in parsed_yaml.items():
+        if not isinstance(v, list):
+            continue
+        section = lower_section(v)
+        try:
+            if k.startswith('run') or k in ['pre_run', 'post_run']:
+                section.run_ops
+            elif k.startswith('dependencies'):
+                section.dependencies_ops
+            else:
+                continue
+        except Exception:
+            # malformed section, the error is raised when it is executed
+            continue
+        parsed_yaml[k] = section
+
+
+def _lower_conditions(section, lower_op):
+    """Lowers command dicts of given section by lower_op(command_dict, comm_type, comm),
+    handling "if" and "else" the same way for run and dependencies sections.
+
+    Whether "else" belongs to an "if" (and is skipped) or is an error, doesn't depend on
+    the evaluation, so it is decided here."""
+    ops = []
+    skip_else = False
+    for i, command_dict in enumerate(section):
+        for comm_type, comm in command_dict.items():
+            if comm_type.startswith('if'):
+                possible_else = None
+                if len(section) > i + 1:  # do we have "else" clause?
+                    possible_else = list(section[i + 1].items())[0]
+                skip_else = possible_else is not None and possible_else[0] == 'else'
+                ops.append(IfOp(command_dict, comm_type, comm,
+                                possible_else[1] if skip_else else None))
+            elif comm_type == 'else':
+                ops.append(ElseOp(command_dict, comm_type, comm, skip_else))
+                skip_else = False
+            else:
+                ops.append(lower_op(command_dict, comm_type, comm))
+    return ops
+
+
+def lower_run_section(section):
+    """Returns list of ops that execute given run section (see eval_exec_section)."""
+    def lower_op(command_dict, comm_type, comm):
+        if comm_type.startswith('for '):
+            return ForOp(command_dict, comm_type, comm)
+        elif comm_type == 'parallel':
+            return ParallelOp(command_dict, comm_type, comm)
+        elif comm_type.startswith('$'):
+            return AssignOp(command_dict, comm_type, comm)
+        return CommandOp(command_dict, comm_type, comm)
+    return _lower_conditions(section, lower_op)
+
+
+def lower_dependencies_section(section):
+    """Returns list of ops that execute given dependencies section (see
+    dependencies_section)."""
+    def lower_op(command_dict, comm_type, comm):
+        # we don't allow general commands, only "call"/"use" command here
+        if comm_type in ['call', 'use']:
+            return UseDependenciesOp(command_dict, comm_type, comm)
+        # handle known types of deps the same, just by appending to "deps" list
+        elif comm_type in package_managers.managers.keys():
+            return DependenciesOp(command_dict, comm_type, comm)
+        return UnknownDependenciesOp(command_dict, comm_type, comm)
+    return _lower_conditions(section, lower_op)
+
+
+class Op(object):
+    """Op of lowered section (see Section), created from one item of a command dict.
+    Ops of run sections implement run(kwargs, runner, retval), that returns the result
+    of the op (retval is the result of previous op). Ops of dependencies sections
+    implement collect(kwargs, runner, deps), that appends dependencies to deps list."""
+    __slots__ = ('command_dict', 'comm_type', 'comm')
+
+    def __init__(self, command_dict, comm_type, comm):
+        # the whole command dict is kept for error reporting, see excepthook
+        self.command_dict = command_dict
+        self.comm_type = comm_type
+        self.comm = comm
+
+
+class IfOp(Op):
+    """"if" condition (with "else" clause, if else_body isn't None)."""
+    __slots__ = ('condition', 'body', 'else_body')
+
+    def __init__(self, command_dict, comm_type, comm, else_body):
+        super(IfOp, self).__init__(command_dict, comm_type, comm)
+        self.condition = comm_type[2:].strip()
+        self.body = lower_section(comm)
+        self.else_body = lower_section(else_body)
+
+    def select(self, kwargs):
+        """Returns section to execute ("if" or "else" one) or None if there's none."""
+        if evaluate_expression(self.condition, kwargs, need_result=False)[0]:
+            return self.body
+        return self.else_body
+
+    def run(self, kwargs, runner, retval):
+        to_run = self.select(kwargs)
+        # run with original kwargs, so that they might be changed for code after this
+        if to_run:
+            retval = run_section(to_run, kwargs, runner=runner)
+        return retval
+
+    def collect(self, kwargs, runner, deps):
+        to_run = self.select(kwargs)
+        if to_run:
+            deps.extend(dependencies_section(to_run, kwargs, runner=runner))
+
+
+class ElseOp(Op):
+    """"else" clause, that is skipped, if it belongs to preceding "if" (which executes
+    it), or is an error otherwise."""
+    __slots__ = ('skip', )
+    msg = 'Yaml error: encountered "else" with no associated "if", skipping.'
+
+    def __init__(self, command_dict, comm_type, comm, skip):
+        super(ElseOp, self).__init__(command_dict, comm_type, comm)
+        self.skip = skip
+
+    def run(self, kwargs, runner, retval):
+        if not self.skip:
+            raise exceptions.YamlSyntaxError(self.msg)
+        return retval
+
+    def collect(self, kwargs, runner, deps):
+        if not self.skip:
+            logger.error(self.msg)
+            raise exceptions.YamlSyntaxError(self.msg)
+
+
+class ForOp(Op):
+    """"for" loop with parsed control line (errors of parsing are raised when the loop
+    is executed)."""
+    __slots__ = ('control_vars', 'iter_type', 'expression', 'error', 'body')
+
+    def __init__(self, command_dict, comm_type, comm):
+        super(ForOp, self).__init__(command_dict, comm_type, comm)
+        self.error = None
+        try:
+            self.control_vars, self.iter_type, self.expression = parse_for(comm_type)
+        except exceptions.YamlSyntaxError as e:
+            self.error = e
+        self.body = lower_section(comm)
+
+    def run(self, kwargs, runner, retval):
+        if self.error is not None:
+            raise self.error
+        # syntax: "for $i in $x: <section> or "for $i in cl_command: <section>"
+        control_vars = self.control_vars
+        for i in _get_for_iterval(control_vars, self.iter_type, self.expression, kwargs):
+            if len(control_vars) == 2:
+                kwargs[control_vars[0]] = i[0]
+                kwargs[control_vars[1]] = i[1]
+            else:
+                kwargs[control_vars[0]] = i
+            retval = run_section(self.body, kwargs, runner=runner)
+        return retval
+
+
+class ParallelOp(Op):
+    """"parallel" block, whose branches run concurrently (errors of parsing the block are
+    raised when it is executed), see run_parallel."""
+    __slots__ = ('branches', 'max_workers', 'error')
+
+    def __init__(self, command_dict, comm_type, comm):
+        super(ParallelOp, self).__init__(command_dict, comm_type, comm)
+        self.error = None
+        try:
+            branches, self.max_workers = parse_parallel(comm)
+            self.branches = [lower_section(b) for b in branches]
+        except exceptions.YamlSyntaxError as e:
+            self.error = e
+
+    def run(self, kwargs, runner, retval):
+        if self.error is not None:
+            raise self.error
+        max_workers = self.max_workers
+        if isinstance(max_workers, six.string_types):
+            max_workers = format_str(max_workers, kwargs)
+        if max_workers is None:
+            max_workers = settings.PARALLEL_MAX_WORKERS
+        try:
+            max_workers = int(max_workers)
+        except (TypeError, ValueError):
+            max_workers = 0
+        if max_workers < 1:
+            raise exceptions.YamlSyntaxError('"max_workers" of "parallel" must be a positive '
+                                             'number, got: {0}'.format(self.max_workers))
+        return run_parallel(self.branches, kwargs, runner, max_workers)
+
+
+class AssignOp(Op):
+    """Assignment to a variable (or two variables) with parsed variable names (errors of
+    parsing are raised when the assignment is executed)."""
+    __slots__ = ('exec_flag', 'variables', 'error')
+
+    def __init__(self, command_dict, comm_type, comm):
+        super(AssignOp, self).__init__(command_dict, comm_type, comm)
+        self.exec_flag = comm_type.endswith('~')
+        if self.exec_flag:
+            self.comm = lower_section(comm)
+        self.error = None
+        try:
+            self.variables = get_assigned_var_names(comm_type)
+        except exceptions.YamlSyntaxError as e:
+            self.error = e
+
+    def run(self, kwargs, runner, retval):
+        # commands that can have exec flag appended follow
+        if self.exec_flag:  # on exec flag, eval comm as exec section
+            log_res, res = eval_exec_section(self.comm, kwargs, runner)
+        else:  # with no exec flag, eval comm as input section
+            log_res, res = eval_literal_section(self.comm, kwargs, runner)
+        if self.error is not None:
+            raise self.error
+        if self.variables[0] is not None:
+            kwargs[self.variables[0]] = log_res
+        kwargs[self.variables[1]] = res
+        return log_res, res
+
+
+class CommandOp(Op):
+    """Command run by a command runner."""
+    __slots__ = ()
+
+    def run(self, kwargs, runner, retval):
+        return Command(self.comm_type, self.comm, kwargs=kwargs).run()
+
+
+class UseDependenciesOp(Op):
+    """"use"/"call" command in dependencies section."""
+    __slots__ = ()
+
+    def collect(self, kwargs, runner, deps):
+        deps.extend(Command(self.comm_type, self.comm, kwargs).run())
+
+
+class DependenciesOp(Op):
+    """Dependencies of a known type (e.g. "rpm")."""
+    __slots__ = ()
+
+    def collect(self, kwargs, runner, deps):
+        deps.append({self.comm_type: [format_str(dep, kwargs) for dep in self.comm]})
+
+
+class UnknownDependenciesOp(Op):
+    __slots__ = ()
+
+    def collect(self, kwargs, runner, deps):
+        logger.warning('Unknown dependency type {0}, skipping.'.format(self.comm_type))
+
+
 # Expression evaluation
 class Interpreter(object):
     """
@@ -389,35 +764,39 @@ class Interpreter(object):
     * mauke.hopto.org/stuff/papers/p41-pratt.pdf
     * http://javascript.crockford.com/tdop/tdop.html
     * http://effbot.org/zone/simple-top-down-parsing.htm
-    """
 
-    def __init__(self, names):
-        # A dictionary of variables in the form of {name: value, ...}
-        self.names = names
+    Expressions are not evaluated while parsing. Instead, nud and led methods of symbols
+    return closures that take variables in the form of {name: value, ...}, evaluation
+    state and need_result flag (see evaluate) and return tuple (logical result, result).
+    An expression is therefore parsed just once and the resulting tree of closures can be
+    evaluated against different variables many times, see compile_expression.
+    """
 
-        # A dictionary of symbols in the form of
-        # {name of the symbol: its class}
-        self.symbol_table = {}
+    # A dictionary of symbols in the form of
+    # {name of the symbol: its class}
+    # It is filled once for all interpreters by the language definition below.
+    symbol_table = {}
 
+    def __init__(self):
         # Holds the current token
         self.token = None
 
         # The tokenizer considers all tokens in "$()" to be literals
         self.in_shell = False
-        self.as_root = False
 
     class symbol_base(object):
         id = None
         value = None
         first = second = None
 
-        def nud(self):
+        def nud(self, interpr):
             raise SyntaxError("Syntax error ({0}).".format(self.id))
 
-        def led(self, left):
+        def led(self, interpr, left):
             raise SyntaxError("Unknown operator ({0}).".format(self.id))
 
-    def symbol(self, id, bp=0):
+    @classmethod
+    def symbol(cls, id, bp=0):
         """
         Adds symbol 'id' to symbol_table if it does not exist already,
         if it does it merely updates its binding power and returns it's
@@ -425,13 +804,13 @@ class Interpreter(object):
         """
 
         try:
-            s = self.symbol_table[id]
+            s = cls.symbol_table[id]
         except KeyError:
-            class s(self.symbol_base):
+            class s(cls.symbol_base):
                 pass
             s.id = id
             s.lbp = bp
-            self.symbol_table[id] = s
+            cls.symbol_table[id] = s
         else:
             s.lbp = max(bp, s.lbp)
         return s
@@ -445,12 +824,13 @@ class Interpreter(object):
             raise SyntaxError("Expected {0}".format(id))
         self.token = self.next()
 
-    def method(self, symbol_name):
+    @classmethod
+    def method(cls, symbol_name):
         """
         A decorator - adds the decorated method to symbol 'symbol_name'
         """
 
-        s = self.symbol(symbol_name)
+        s = cls.symbol(symbol_name)
 
         def bind(fn):
             setattr(s, fn.__name__, fn)
@@ -493,19 +873,17 @@ class Interpreter(object):
     def expression(self, rbp=0):
         t = self.token
         self.token = self.next()
-        left = t.nud()
+        left = t.nud(self)
         while rbp < self.token.lbp:
             t = self.token
             self.token = self.next()
-            left = t.led(left)
+            left = t.led(self, left)
         return left
 
     def parse(self, expression):
         """
-        Evaluates 'expression' and returns it's value(s)
+        Parses 'expression' and returns a closure that evaluates it, see evaluate
         """
-        if isinstance(expression, (list, dict)):
-            return (True if expression else False, expression)
         if sys.version_info[0] > 2:
             self.next = self.tokenize(expression).__next__
         else:
@@ -513,165 +891,313 @@ class Interpreter(object):
         self.token = self.next()
         return self.expression()
 
-
-def evaluate_expression(expression, names):
-    interpr = Interpreter(names)
-
-    # Language definition
-    # First, add all the symbols, along with their binding power
-    interpr.symbol("and", 10)
-    interpr.symbol("or", 10)
-    interpr.symbol("not", 10)
-    interpr.symbol("in", 10)
-    interpr.symbol("defined", 10)
-    interpr.symbol("$", 10)
-    interpr.symbol("as_root", 10)
-    interpr.symbol("(name)")
-    interpr.symbol("(literal)")
-    interpr.symbol("(end)")
-    interpr.symbol("(")
-    interpr.symbol(")")
-
-    # Specify the behaviour of each symbol
-    # * nud stands for "null denotation" and is used when a token appears
-    # at the beginning of a language construct (prefix)
-    # * led stand for "left denotation" and is used when it appears inside
-    # the construct (infix)
-    @interpr.method("(name)")
-    def nud(self):
-        if self.value in interpr.names:
-            value = interpr.names[self.value]
+    @staticmethod
+    def evaluate(compiled, names, need_result=True):
+        """
+        Evaluates expression compiled by parse with given variables and returns
+        tuple (logical result, result). If need_result is False, only the logical
+        result is needed, so "and" and "or" can skip their right sides more often.
+        """
+        # evaluation state shared by all closures of the expression
+        state = {'as_root': False}
+        return compiled(names, state, need_result)
+
+
+# Language definition
+# First, add all the symbols, along with their binding power
+Interpreter.symbol("and", 10)
+Interpreter.symbol("or", 10)
+Interpreter.symbol("not", 10)
+Interpreter.symbol("in", 10)
+Interpreter.symbol("defined", 10)
+Interpreter.symbol("$", 10)
+Interpreter.symbol("as_root", 10)
+Interpreter.symbol("(name)")
+Interpreter.symbol("(literal)")
+Interpreter.symbol("(end)")
+Interpreter.symbol("(")
+Interpreter.symbol(")")
+
+
+# Specify the behaviour of each symbol
+# * nud stands for "null denotation" and is used when a token appears
+# at the beginning of a language construct (prefix)
+# * led stand for "left denotation" and is used when it appears inside
+# the construct (infix)
+# Both of them parse the construct and return a closure that evaluates it.
+@Interpreter.method("(name)")
+def nud(self, interpr):
+    name = self.value
+
+    def evaluate(names, state, need_result):
+        if name in names:
+            value = names[name]
             return bool(value), "" if isinstance(value, bool) else value
         else:
             return False, ""
+    return evaluate
+
+
+# "$name" or "${name}" in literals, see _substitute_literal
+_literal_var_matcher = re.compile(r'\$(?:\{(\w+)\}|(\w+))')
 
-    @interpr.method("(literal)")
-    def nud(self):
+
+def _substitute_literal(literal, names):
+    """Substitutes known variables in given literal in a single pass. Each "$name" is
+    substituted by the longest known variable that "name" starts with (e.g. "$foobar" by
+    value of "foobar" if it's known, by value of "foo" followed by "bar" otherwise),
+    "${name}" only by the variable of exactly that name. Unknown variables are kept.
+    """
+    def substitute(match):
+        braced, name = match.groups()
+        if braced is not None:
+            if braced not in names:
+                return match.group()
+            name, rest = braced, ''
+        else:
+            # longest name wins
+            for end in range(len(name), 0, -1):
+                if name[:end] in names:
+                    name, rest = name[:end], name[end:]
+                    break
+            else:
+                return match.group()
+        val = names[name]
+        if not six.PY3 and isinstance(val, str):
+            val = val.decode('utf-8')
+        return six.text_type(val) + rest
+
+    return _literal_var_matcher.sub(substitute, literal)
+
+
+@Interpreter.method("(literal)")
+def nud(self, interpr):
+    literal = self.value
+    has_vars = '$' in literal
+
+    def evaluate(names, state, need_result):
         # If there is a known variable in the literal, substitute it for its
         # value
-        for v in reversed(sorted(interpr.names.keys())):
-            val = interpr.names[v]
-            if not six.PY3 and isinstance(val, str):
-                val = val.decode('utf-8')
-            self.value = self.value.replace("$" + v, six.text_type(val))
-        # if self.value is in double/single quotes, strip them (but only the outer quotes)
-        ret = self.value
+        value = _substitute_literal(literal, names) if has_vars else literal
+        # if value is in double/single quotes, strip them (but only the outer quotes)
+        ret = value
         if ret.startswith('"'):
             ret = ret.strip('"')
         elif ret.startswith("'"):
             ret = ret.strip("'")
 
         return bool(ret), ret
+    return evaluate
+
+
+@Interpreter.method("and")
+def led(self, interpr, left):
+    right = interpr.expression(10)
 
-    @interpr.method("and")
-    def led(self, left):
-        right = interpr.expression(10)
+    def evaluate(names, state, need_result):
+        left_res = left(names, state, need_result)
+        # short-circuit - if left side decides the result, right side (possibly with
+        #  expensive "$()" commands) isn't evaluated at all
+        if not left_res[0] and not (need_result and left_res[1]):
+            return False, left_res[1]
+        right_res = right(names, state, need_result)
 
-        success = bool(left[0] and right[0])
-        output = left[1] and right[1]
+        success = bool(left_res[0] and right_res[0])
+        output = left_res[1] and right_res[1]
 
         return success, output
+    return evaluate
 
-    @interpr.method("or")
-    def led(self, left):
-        right = interpr.expression(10)
 
-        success = bool(left[0] or right[0])
-        output = left[1] or right[1]
+@Interpreter.method("or")
+def led(self, interpr, left):
+    right = interpr.expression(10)
+
+    def evaluate(names, state, need_result):
+        left_res = left(names, state, need_result)
+        # short-circuit - if left side decides the result, right side isn't evaluated at all
+        if left_res[0] and not (need_result and not left_res[1]):
+            return True, left_res[1]
+        right_res = right(names, state, need_result)
+
+        success = bool(left_res[0] or right_res[0])
+        output = left_res[1] or right_res[1]
 
         return success, output
+    return evaluate
+
 
-    @interpr.method("not")
-    def nud(self):
-        right = interpr.expression(10)
+@Interpreter.method("not")
+def nud(self, interpr):
+    right = interpr.expression(10)
 
-        success = bool(not right[0])
-        output = right[1]
+    def evaluate(names, state, need_result):
+        right_res = right(names, state, need_result)
+
+        success = bool(not right_res[0])
+        output = right_res[1]
 
         return success, output
+    return evaluate
+
+
+@Interpreter.method("in")
+def led(self, interpr, left):
+    right = interpr.expression(10)
 
-    @interpr.method("in")
-    def led(self, left):
-        success = left[1] in interpr.expression(10)[1]
-        output = left[1]
+    def evaluate(names, state, need_result):
+        left_res = left(names, state, True)
+        success = left_res[1] in right(names, state, True)[1]
+        output = left_res[1]
 
         return success, output
+    return evaluate
 
-    @interpr.method("defined")
-    def nud(self):
-        if interpr.token.id != "(name)":
-            raise SyntaxError("Expected a name")
-        name = interpr.token.value
-        interpr.advance()
 
-        success = name in interpr.names
-        output = interpr.names[name] if success else ""
+@Interpreter.method("defined")
+def nud(self, interpr):
+    if interpr.token.id != "(name)":
+        raise SyntaxError("Expected a name")
+    name = interpr.token.value
+    interpr.advance()
+
+    def evaluate(names, state, need_result):
+        success = name in names
+        output = names[name] if success else ""
 
         return success, output
+    return evaluate
 
-    @interpr.method("$")
-    def nud(self):
-        interpr.in_shell = True
-        interpr.advance("(")
 
-        # Gather all the tokens in "$()"
-        cmd = []
-        if interpr.token.id != ")":
-            while 1:
-                if interpr.token.id == ")":
-                    break
-                # if there is (name), tokenizer has already stripped
-                # the "$", but we need to keep it for below substitution
-                if interpr.token.id == "(name)":
-                    interpr.token.value = "$" + interpr.token.value
-                cmd.append(interpr.token.value)
-                interpr.advance()
+@Interpreter.method("$")
+def nud(self, interpr):
+    interpr.in_shell = True
+    interpr.advance("(")
+
+    # Gather all the tokens in "$()"
+    cmd = []
+    if interpr.token.id != ")":
+        while 1:
+            if interpr.token.id == ")":
+                break
+            # if there is (name), tokenizer has already stripped
+            # the "$", but we need to keep it for substitution by Command
+            if interpr.token.id == "(name)":
+                interpr.token.value = "$" + interpr.token.value
+            cmd.append(interpr.token.value)
+            interpr.advance()
 
-        cmd = " ".join(cmd)
+    cmd = " ".join(cmd)
 
-        if (cmd.startswith('"') and cmd.endswith('"')) or \
-                (cmd.startswith("'") and cmd.endswith("'")):
-            cmd = cmd[1:-1]
+    if (cmd.startswith('"') and cmd.endswith('"')) or \
+            (cmd.startswith("'") and cmd.endswith("'")):
+        cmd = cmd[1:-1]
 
+    interpr.advance(")")
+    interpr.in_shell = False
+
+    def evaluate(names, state, need_result):
         success = True
-        exec_mode = 'cl_r' if interpr.as_root else 'cl'
+        exec_mode = 'cl_r' if state['as_root'] else 'cl'
         try:
-            output = Command(exec_mode, cmd, interpr.names).run()[1]
+            output = Command(exec_mode, cmd, names).run()[1]
         except exceptions.RunException as ex:
             success = False
             output = ex.output
-
-        interpr.advance(")")
-        interpr.in_shell = False
-        interpr.as_root = False
+        state['as_root'] = False
 
         return success, output
+    return evaluate
 
-    @interpr.method("as_root")
-    def nud(self):
-        interpr.as_root = True
-        right = interpr.expression(10)
-        interpr.as_root = False
 
-        success = bool(right[0])
-        output = right[1]
+@Interpreter.method("as_root")
+def nud(self, interpr):
+    right = interpr.expression(10)
+
+    def evaluate(names, state, need_result):
+        state['as_root'] = True
+        right_res = right(names, state, need_result)
+        state['as_root'] = False
+
+        success = bool(right_res[0])
+        output = right_res[1]
 
         return success, output
+    return evaluate
+
+
+@Interpreter.method("(")
+def nud(self, interpr):
+    first = []
+    if interpr.token.id != ")":
+        while 1:
+            if interpr.token.id == ")":
+                break
+            first.append(interpr.expression())
+    interpr.advance(")")
+
+    def evaluate(names, state, need_result):
+        results = [expr(names, state, need_result if i == 0 else True)
+                   for i, expr in enumerate(first)]
+
+        return bool(results[0][0]), results[0][1]
+    return evaluate
+
+
+del nud, led
+
+
+# lock of least recently used caches of this module, see _get_cached
+_lru_lock = threading.Lock()
 
-    @interpr.method("(")
-    def nud(self):
-        self.first = []
-        if interpr.token.id != ")":
-            while 1:
-                if interpr.token.id == ")":
-                    break
-                self.first.append(interpr.expression())
-        interpr.advance(")")
 
-        return bool(self.first[0][0]), self.first[0][1]
+def _get_cached(cache, key, create, size):
+    """Returns item of given key from given least recently used cache (OrderedDict);
+    if it isn't there, it is created by create(key) and stored in the cache, that is then
+    trimmed to given size."""
+    with _lru_lock:
+        item = cache.pop(key, None)
+    if item is None:
+        item = create(key)
+    with _lru_lock:
+        cache[key] = item
+        while len(cache) > size:
+            cache.popitem(last=False)
+    return item
 
-    # With the language defined, evaluate the expression
-    return interpr.parse(expression)
+
+# compiled expressions (see compile_expression) by their text, least recently used first
+_compiled_expressions = collections.OrderedDict()
+
+
+def compile_expression(expression):
+    """Returns expression parsed by Interpreter.parse. Parsed expressions are kept in a
+    cache of settings.EXPRESSION_CACHE_SIZE least recently used ones, so that expressions
+    evaluated repeatedly (e.g. in loops) are only parsed once.
+
+    Raises:
+        SyntaxError if the expression is malformed
+    """
+    return _get_cached(_compiled_expressions, expression,
+                       lambda e: Interpreter().parse(e), settings.EXPRESSION_CACHE_SIZE)
+
+
+def evaluate_expression(expression, names, need_result=True):
+    """Evaluates given expression with given variables.
+
+    Args:
+        expression: expression to evaluate (list or dict is returned as it is)
+        names: variables in the form of {name: value, ...}
+        need_result: False if only logical result of the expression will be used
+            (e.g. in conditions); the result is then not necessarily correct, but
+            "and" and "or" don't evaluate their right sides, if the left ones decide
+            the logical result
+    Returns:
+        tuple (logical result, result)
+    """
+    if isinstance(expression, (list, dict)):
+        return (True if expression else False, expression)
+    return Interpreter.evaluate(compile_expression(expression), names, need_result)
 
 
 # spliting strings by _command_splitter.findall(str) preserves whitespace
@@ -690,33 +1216,134 @@ def _homedir_expand(matchobj):
         return matchobj.group(0)[:-1] + os.path.expanduser('~')
 
 
-def format_str(s, kwargs):
-    files_dir = kwargs.get('__files_dir__', [''])[-1]
-    files = kwargs.get('__files__', [{}])[-1]
-    # If command is false/true in yaml file, it gets converted to False/True
-    # which is bool object => convert
-    if isinstance(s, bool):
-        comm = str(s).lower()
-    else:
-        comm = s
+class _VarRef(object):
+    """Reference to a variable in a template (see _Template), text is kept if the variable
+    isn't defined."""
+    __slots__ = ('name', 'text')
 
-    new_comm = []
-    parts_list = _command_splitter.findall(comm)
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
 
-    # replace parts that match something from _files
-    for c in parts_list:
+    def render(self, kwargs):
+        try:
+            return '%s' % (kwargs[self.name], )
+        except KeyError:
+            return self.text
+
+
+class _FileRef(object):
+    """Reference to a file from "files" section in a template (see _Template), e.g.
+    "*file" or "*{file}"; parts are parts of the reference itself, used if there's
+    no such file."""
+    __slots__ = ('name', 'parts')
+
+    def __init__(self, name, parts):
+        self.name = name
+        self.parts = parts
+
+    def render(self, kwargs):
+        files = kwargs.get('__files__', [{}])[-1]
+        if self.name not in files:
+            return _render_parts(self.parts, kwargs)
+        files_dir = kwargs.get('__files_dir__', [''])[-1]
+        path = os.path.join(files_dir, files[self.name]['source'])
+        # path gets substituted just like the rest of the string
+        return _render_parts(_parse_template(path), kwargs)
+
+
+class _Template(object):
+    """String compiled by compile_template - list of constant strings, _VarRefs and
+    _FileRefs, that format_str joins and then expands homedir in."""
+    __slots__ = ('parts', )
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def render(self, kwargs):
+        rendered = _render_parts(self.parts, kwargs)
+        if '~' in rendered:
+            rendered = _homedir_matcher.sub(_homedir_expand, rendered)
+        return rendered
+
+
+def _render_parts(parts, kwargs):
+    return ''.join([p if isinstance(p, six.string_types) else p.render(kwargs) for p in parts])
+
+
+def _parse_template(text):
+    """Splits given text to constant strings and _VarRefs exactly like
+    string.Template.safe_substitute would substitute it."""
+    parts = []
+    pos = 0
+    for mo in string.Template.pattern.finditer(text):
+        parts.append(text[pos:mo.start()])
+        named = mo.group('named') or mo.group('braced')
+        if named is not None:
+            parts.append(_VarRef(named, mo.group()))
+        elif mo.group('escaped') is not None:
+            parts.append(string.Template.delimiter)
+        else:
+            parts.append(mo.group())
+        pos = mo.end()
+    parts.append(text[pos:])
+    # join adjacent constant strings
+    merged = []
+    for p in parts:
+        if isinstance(p, six.string_types):
+            if not p:
+                continue
+            if merged and isinstance(merged[-1], six.string_types):
+                merged[-1] += p
+                continue
+        merged.append(p)
+    return merged
+
+
+def _compile_template(s):
+    parts = []
+    text = []
+    for c in _command_splitter.findall(s):
+        # parts that may match something from _files
         if c.startswith('*'):
-            c_file = c[1:].strip('{}')
-            if c_file in files:
-                new_comm.append(os.path.join(files_dir, files[c_file]['source']))
-            else:
-                new_comm.append(c)
+            parts.extend(_parse_template(''.join(text)))
+            text = []
+            parts.append(_FileRef(c[1:].strip('{}'), _parse_template(c)))
         else:
-            new_comm.append(c)
+            text.append(c)
+    parts.extend(_parse_template(''.join(text)))
+    return _Template(parts)
+
 
-    new_comm = ''.join(new_comm)
+# compiled templates (see compile_template) by their text, least recently used first
+_compiled_templates = collections.OrderedDict()
 
-    # substitute cli arguments for their values
-    substituted = string.Template(new_comm).safe_substitute(kwargs)
 
-    return _homedir_matcher.sub(_homedir_expand, substituted)
+def compile_template(s):
+    """Returns given string compiled for format_str - either the string itself, if there's
+    nothing to substitute in it, or _Template. Compiled templates are kept in a cache of
+    settings.TEMPLATE_CACHE_SIZE least recently used ones."""
+    if '$' not in s and '*' not in s and '~' not in s:
+        return s
+    return _get_cached(_compiled_templates, s, _compile_template, settings.TEMPLATE_CACHE_SIZE)
+
+
+def format_str(s, kwargs):
+    """Substitutes files from "files" section ("*file"), variables ("$var") and homedir
+    ("~") in given string.
+
+    Args:
+        s: string (or bool, which is converted to "true" or "false")
+        kwargs: variables in the form of {name: value, ...}, including "__files__" and
+            "__files_dir__"
+    Returns:
+        string with everything substituted
+    """
+    # If command is false/true in yaml file, it gets converted to False/True
+    # which is bool object => convert
+    if isinstance(s, bool):
+        s = str(s).lower()
+    template = compile_template(s)
+    if isinstance(template, _Template):
+        return template.render(kwargs)
+    return template
@@ -4,6 +4,8 @@ from devassistant import settings
 
 
 class LoadedYaml(object):
+    __slots__ = ()
+
     @property
     def load_path(self):
         for d in settings.DATA_DIRECTORIES:
@@ -33,7 +33,11 @@ class DevassistantClFormatter(logging.Formatter):
                 record_vars['msg'] = record_vars['msg'].message
             if isinstance(record_vars['msg'], str):
                 record_vars['msg'] = record_vars['msg'].decode('utf8')
-        return fmt_str.format(**record_vars)
+        formatted = fmt_str.format(**record_vars)
+        # output of commands run in "parallel" block is tagged by its branch
+        if getattr(record, 'branch', None):
+            formatted = u'[{0}] {1}'.format(record.branch, formatted)
+        return formatted
 
 
 class DevassistantClColorFormatter(DevassistantClFormatter):
@@ -1,6 +1,7 @@
 from devassistant import lang
 from devassistant.logger import logger
 from devassistant import exceptions
+from devassistant.profiler import profiler
 from devassistant import utils
 from devassistant import yaml_assistant
 
@@ -48,10 +49,13 @@ class PathRunner(object):
         try:  # serve as a central place for error logging
             self._logging(parsed_args)
             if 'deps_only' not in parsed_args:
-                self._run_path_run('pre', parsed_args)
-            self._run_path_dependencies(parsed_args)
+                with profiler.frame('pre_run'):
+                    self._run_path_run('pre', parsed_args)
+            with profiler.frame('dependencies'):
+                self._run_path_dependencies(parsed_args)
             if 'deps_only' not in parsed_args:
-                self._run_path_run('', parsed_args)
+                with profiler.frame('run'):
+                    self._run_path_run('', parsed_args)
         except exceptions.ExecutionException as e:
             error = self._log_if_not_logged(e)
             if isinstance(e, exceptions.YamlError):  # if there's a yaml error, just shut down
@@ -59,14 +63,16 @@ class PathRunner(object):
 
         # in any case, run post_run
         try:  # serve as a central place for error logging
-            self._run_path_run('post', parsed_args)
+            with profiler.frame('post_run'):
+                self._run_path_run('post', parsed_args)
         except exceptions.ExecutionException as e:
             error = self._log_if_not_logged(e)
 
         # exitfuncs are run all regardless of exceptions; if there is an exception in one
         #  of them, this function will raise it at the end
         try:
-            utils.run_exitfuncs()
+            with profiler.frame('exitfuncs'):
+                utils.run_exitfuncs()
         except exceptions.ExecutionException as e:
             error = self._log_if_not_logged(e)
 
@@ -0,0 +1,209 @@
+"""Profiling of assistant runs ("--profile").
+
+When enabled, wall and CPU time is recorded for every command (lang.Command.run), every
+execution section (lang.eval_exec_section), every "use" (UseCommandRunner.run) and
+every subprocess (ClHelper.run_command), plus for phases marked by frame() (e.g. the
+phases of PathRunner). Timings are aggregated in a tree of frames - calls with the same
+label and the same parent frame are merged. On exit, the tree is logged (see report)
+and written as collapsed stacks, that flamegraph tools (e.g. flamegraph.pl) accept:
+
+frame;frame;frame <microseconds spent in the last frame itself>
+
+The functions are only wrapped by enable(), so profiling has no overhead unless it is
+enabled.
+"""
+import contextlib
+import functools
+import os
+import threading
+import time
+
+import six
+
+from devassistant.logger import logger
+from devassistant import settings
+
+# CPU time of the current thread, if the platform can measure it
+_cpu_time = getattr(time, 'thread_time', None) or getattr(time, 'process_time', None) or \
+    time.clock
+_wall_time = getattr(time, 'perf_counter', None) or time.time
+
+
+class Frame(object):
+    """Node of the timing tree - all calls with the same label in the same parent frame."""
+    __slots__ = ['label', 'parent', 'children', 'calls', 'wall', 'cpu']
+
+    def __init__(self, label, parent=None):
+        self.label = label
+        self.parent = parent
+        self.children = {}
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def child(self, label):
+        if label not in self.children:
+            self.children[label] = Frame(label, self)
+        return self.children[label]
+
+    def stack(self):
+        """Returns labels of this frame and all its parents (except the root), outermost
+        first."""
+        frame, labels = self, []
+        while frame.parent is not None:
+            labels.append(frame.label)
+            frame = frame.parent
+        return list(reversed(labels))
+
+
+class Profiler(object):
+    def __init__(self):
+        self.enabled = False
+        self.root = Frame('all')
+        # stacks of open frames, per thread
+        self._stacks = threading.local()
+        # open frames of the thread that enabled profiling; threads started later (e.g.
+        #  branches of "parallel") put their frames under the current one of this thread
+        self._main_stack = [self.root]
+        self._lock = threading.Lock()
+        self._wrapped = []
+
+    def _stack(self):
+        stack = getattr(self._stacks, 'frames', None)
+        if stack is None:
+            stack = self._stacks.frames = [self._main_stack[-1]]
+        return stack
+
+    @contextlib.contextmanager
+    def frame(self, label):
+        """Context manager recording time spent in its block as a frame of given label
+        (does nothing, if profiling isn't enabled)."""
+        if not self.enabled:
+            yield
+            return
+        stack = self._stack()
+        with self._lock:
+            frame = stack[-1].child(label)
+        stack.append(frame)
+        wall, cpu = _wall_time(), _cpu_time()
+        try:
+            yield
+        finally:
+            wall, cpu = _wall_time() - wall, _cpu_time() - cpu
+            stack.pop()
+            with self._lock:
+                frame.calls += 1
+                frame.wall += wall
+                frame.cpu += cpu
+
+    def wrap(self, owner, name, get_label):
+        """Replaces function (or classmethod) "name" of given module or class by a function
+        that records its calls as frames labeled by get_label(*args, **kwargs), where args
+        don't include the class for classmethods."""
+        orig = vars(owner)[name]
+        is_classmethod = isinstance(orig, classmethod)
+        func = orig.__func__ if is_classmethod else orig
+
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            label = get_label(*(args[1:] if is_classmethod else args), **kwargs)
+            with self.frame(label):
+                return func(*args, **kwargs)
+
+        setattr(owner, name, classmethod(profiled) if is_classmethod else profiled)
+        self._wrapped.append((owner, name, orig))
+
+    def enable(self):
+        """Starts profiling the current thread and instruments lang, "use" and ClHelper."""
+        if self.enabled:
+            return
+        # these import (indirectly) this module
+        from devassistant.command_helpers import ClHelper
+        from devassistant import command_runners
+        from devassistant import lang
+
+        self.root = Frame('all')
+        self._main_stack = self._stacks.frames = [self.root]
+        self.wrap(lang.Command, 'run', _command_label)
+        self.wrap(lang, 'eval_exec_section', _section_label)
+        self.wrap(command_runners.UseCommandRunner, 'run', _use_label)
+        self.wrap(ClHelper, 'run_command', _cl_label)
+        self.enabled = True
+
+    def disable(self):
+        """Stops profiling and restores all instrumented functions."""
+        for owner, name, orig in reversed(self._wrapped):
+            setattr(owner, name, orig)
+        self._wrapped = []
+        self.enabled = False
+
+    def report(self, min_wall=0.001):
+        """Returns lines of the timing tree (frames faster than min_wall seconds are
+        omitted)."""
+        lines = ['{0:>10} {1:>10} {2:>7}  {3}'.format('wall [s]', 'cpu [s]', 'calls', 'frame')]
+
+        def add(frame, depth):
+            for child in sorted(frame.children.values(), key=lambda f: -f.wall):
+                if child.wall < min_wall:
+                    continue
+                lines.append('{0:>10.3f} {1:>10.3f} {2:>7}  {3}{4}'.format(
+                    child.wall, child.cpu, child.calls, '  ' * depth, child.label))
+                add(child, depth + 1)
+        add(self.root, 0)
+        return lines
+
+    def collapsed_stacks(self):
+        """Returns lines of collapsed stacks - frame labels separated by ";" followed
+        by microseconds of wall time spent in the frame itself (not in its children)."""
+        lines = []
+
+        def add(frame):
+            for child in frame.children.values():
+                own = child.wall - sum(f.wall for f in child.children.values())
+                stack = ';'.join(_clean_label(l) for l in child.stack())
+                lines.append('{0} {1}'.format(stack, max(int(own * 1000000), 0)))
+                add(child)
+        add(self.root)
+        return lines
+
+    def write_report(self, path=None):
+        """Logs the timing tree and writes collapsed stacks to given file
+        (settings.PROFILE_FILE by default)."""
+        path = path or settings.PROFILE_FILE
+        logger.info('Profile of this run:')
+        for line in self.report():
+            logger.info(line)
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write('\n'.join(self.collapsed_stacks()) + '\n')
+            logger.info('Collapsed stacks for flamegraph tools written to {0}'.format(path))
+        except (IOError, OSError) as e:
+            logger.warning('Could not write profile to {0}: {1}'.format(path, e))
+
+
+def _command_label(c):
+    return 'command ' + (c.prefix + '.' + c.comm_type if c.prefix else c.comm_type)
+
+
+def _section_label(section, *args, **kwargs):
+    return 'expression' if isinstance(section, six.string_types) else 'section'
+
+
+def _use_label(c):
+    inp = c.input_res
+    return 'use ' + (inp.get('sect', '') if isinstance(inp, dict) else '{0}'.format(inp))
+
+
+def _cl_label(cmd_str, *args, **kwargs):
+    cmd = ' '.join('{0}'.format(cmd_str).split())
+    return 'cl ' + (cmd if len(cmd) <= 60 else cmd[:57] + '...')
+
+
+def _clean_label(label):
+    # ";" separates frames in collapsed stacks
+    return label.replace(';', ',').replace('\n', ' ')
+
+
+profiler = Profiler()
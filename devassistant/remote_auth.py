@@ -18,13 +18,8 @@ class GitHubAuth(object):
     """
     _user = None
     _token = None
-    try:
-        _gh_module = utils.import_module('github')
-        _gh_exceptions = utils.import_module('github.GithubException')
-
-    except:
-        _gh_module = None
-        _gh_exceptions = None
+    _gh_module = utils.LazyImport('github')
+    _gh_exceptions = utils.LazyImport('github.GithubException')
 
     @classmethod
     def _github_token(cls, login):
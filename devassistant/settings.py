@@ -21,6 +21,12 @@ for level_short, level_name in LOG_LEVELS_MAP.items():
 
 LAST_LR_VAR = 'LAST_LRES'
 LAST_R_VAR = 'LAST_RES'
+# number of parsed DSL expressions to keep in memory, see lang.compile_expression
+EXPRESSION_CACHE_SIZE = 1024
+# number of compiled strings with variables to keep in memory, see lang.compile_template
+TEMPLATE_CACHE_SIZE = 4096
+# default number of threads running branches of "parallel" block, see lang.run_parallel
+PARALLEL_MAX_WORKERS = 8
 
 ROOT_EXECUTABLE = '/usr/libexec/da_auth'
 
@@ -45,9 +51,39 @@ if 'DEVASSISTANT_HOME' in os.environ:
     DEVASSISTANT_HOME = os.path.abspath(os.path.expanduser(os.environ['DEVASSISTANT_HOME']))
 
 USE_CACHE = True
-CACHE_FILE = os.path.join(DEVASSISTANT_HOME, '.cache.yaml')
+# If not None, only roles and assistants with these names get their subassistants loaded.
+# Frontends set this according to sys.argv before loading assistants, so that only
+# the part of assistant tree that can actually be selected is loaded.
+LAZY_LOAD_NAMES = None
+# number of processes to parse yaml files in when cache is cold or invalidated;
+# 0 or 1 means that files are parsed sequentially
+LOAD_WORKERS = int(os.environ.get('DEVASSISTANT_LOAD_WORKERS', '0'))
+# "binary" is much faster to load, "yaml" is human readable (useful for debugging)
+CACHE_FORMAT = os.environ.get('DEVASSISTANT_CACHE_FORMAT', 'binary')
+CACHE_FILE = os.path.join(DEVASSISTANT_HOME,
+                          '.cache.yaml' if CACHE_FORMAT == 'yaml' else '.cache.bin')
+# whether the cache also stores full parsed bodies of assistants (only in binary format),
+#  so that running an assistant doesn't need to parse its yaml file again
+CACHE_BODIES = os.environ.get('DEVASSISTANT_CACHE_BODIES', '1') != '0'
+# assistants are cached in layers, one for each of DATA_DIRECTORIES (see cache.LayeredCache);
+#  layers that are not prebuilt in the directories themselves are stored here
+CACHE_LAYERS_DIR = os.path.join(DEVASSISTANT_HOME, '.cache.layers')
+# name of prebuilt read-only layer in assistant directories, see "da cache build --system"
+SYSTEM_CACHE_NAME = '.cache.system'
+# index of snippets with their parsed content, see cache.SnippetIndex
+SNIPPET_INDEX_FILE = os.path.join(DEVASSISTANT_HOME, '.cache.snippets')
+# bundle of all assistants and snippets created by "da compile", used instead of scanning
+#  and parsing load paths, see devassistant.bundle
+BUNDLE_FILE = os.environ.get('DEVASSISTANT_BUNDLE', os.path.join(DEVASSISTANT_HOME, '.bundle'))
+# precompiled argument parser specifications derived from cached assistants
+PARSER_CACHE_FILE = os.path.join(DEVASSISTANT_HOME, '.cache.argparse')
 CONFIG_FILE = os.path.join(DEVASSISTANT_HOME, '.config')
+# socket of "da daemon", see devassistant.daemon
+DAEMON_SOCKET = os.environ.get('DEVASSISTANT_DAEMON_SOCKET',
+                               os.path.join(DEVASSISTANT_HOME, 'daemon.sock'))
 LOG_FILE = os.path.join(DEVASSISTANT_HOME, 'lastrun.log')
+# collapsed stacks of the last run with "--profile", see devassistant.profiler
+PROFILE_FILE = os.path.join(DEVASSISTANT_HOME, 'lastrun.profile')
 
 ASSISTANT_ROLES = ['crt', 'twk', 'prep', 'extra']
 DEFAULT_ASSISTANT_ROLE = 'crt'
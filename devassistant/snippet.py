@@ -1,5 +1,6 @@
 import copy
 
+from devassistant import lang
 from devassistant import loaded_yaml
 
 
@@ -9,6 +10,8 @@ class Snippet(loaded_yaml.LoadedYaml):
         self.dotted_name = dotted_name
         self.parsed_yaml = parsed_yaml
         self.path = path
+        # lowered sections by their names, see lang.Section
+        self._sections = {}
 
     @property
     def args(self):
@@ -18,19 +21,30 @@ class Snippet(loaded_yaml.LoadedYaml):
         return self.args.get(name) or {}
 
     def get_run_section(self, section_name='run'):
-        return copy.deepcopy(self.parsed_yaml.get(section_name))
+        """Returns lowered run section of given name (it is only lowered once, so it
+        must not be modified), None if there's no such section."""
+        if section_name not in self._sections:
+            self._sections[section_name] = lang.lower_section(
+                self.parsed_yaml.get(section_name))
+        return self._sections[section_name]
 
     def get_files_dir(self):
         return self.parsed_yaml.get('files_dir') or self.default_files_dir_for('snippets')
 
     def get_dependencies_section(self, section_name='dependencies'):
+        """Returns lowered dependencies section of given name, including the basic
+        "dependencies" section (it is only lowered once, so it must not be modified),
+        None if there's no such section."""
         if section_name not in self.parsed_yaml:
             return None
-        # we also want to include the basic "dependencies" section
-        deps = copy.deepcopy(self.parsed_yaml.get('dependencies', []))
-        if section_name != 'dependencies':
-            deps.extend(copy.deepcopy(self.parsed_yaml.get(section_name, [])))
-        return deps
+        key = ('dependencies', section_name)
+        if key not in self._sections:
+            deps = self.parsed_yaml.get('dependencies', [])
+            if section_name != 'dependencies':
+                # we also want to include the basic "dependencies" section
+                deps = list(deps) + list(self.parsed_yaml.get(section_name, []))
+            self._sections[key] = lang.lower_section(deps)
+        return self._sections[key]
 
     def get_files_section(self):
         return copy.deepcopy(self.parsed_yaml.get('files') or {})
@@ -1,7 +1,9 @@
 from __future__ import print_function
 
+import errno
 import os
 import platform
+import stat
 import sys
 
 import six
@@ -24,6 +26,14 @@ except ImportError:
     importlib.import_module = import_module
     del import_module
 
+try:
+    from os import scandir
+except ImportError:  # Python < 3.5
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 from devassistant import settings
 
 
@@ -31,6 +41,30 @@ def import_module(module):
     return importlib.import_module(module)
 
 
+class LazyImport(object):
+    """Class attribute that imports module of given name on first access, so that modules
+    that take long to import are only imported by code paths that need them:
+
+        class GitHubCommandRunner(CommandRunner):
+            _gh_module = utils.LazyImport('github')
+
+    The attribute is None if the module can't be imported.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+        self.imported = False
+
+    def __get__(self, obj, objtype=None):
+        if not self.imported:
+            try:
+                self.module = import_module(self.name)
+            except Exception:
+                self.module = None
+            self.imported = True
+        return self.module
+
+
 def import_by_path(modname, path):
     if importlib.machinery:  # Python >= 3.3
         loader = importlib.machinery.SourceFileLoader(modname, path)
@@ -118,6 +152,55 @@ def find_file_in_load_dirs(relpath):
             return possible_path
 
 
+def stat_info(st):
+    """Returns dict with modification time, change time (both in nanoseconds) and size
+    of file from given os.stat result."""
+    if hasattr(st, 'st_mtime_ns'):
+        mtime_ns, ctime_ns = st.st_mtime_ns, st.st_ctime_ns
+    else:  # Python 2
+        mtime_ns, ctime_ns = int(st.st_mtime * 1e9), int(st.st_ctime * 1e9)
+    return {'mtime_ns': mtime_ns, 'ctime_ns': ctime_ns, 'size': st.st_size}
+
+
+def scan_dir(directory, suffix=''):
+    """Lists given directory in a single pass (using os.scandir where available).
+
+    Args:
+        directory: directory to list
+        suffix: only return files with names ending with this suffix
+    Returns:
+        tuple (files, subdirs), where files is a list of tuples
+        (filename, fullpath, stat_info(fullpath)) in listing order and subdirs is a set
+        of names of subdirectories; ([], set()) if directory doesn't exist
+    """
+    files = []
+    subdirs = set()
+    try:
+        entries = scandir(directory) if scandir is not None else os.listdir(directory)
+    except OSError as e:
+        if e.errno not in [errno.ENOENT, errno.ENOTDIR]:
+            raise
+        return files, subdirs
+    for entry in entries:
+        # an entry can disappear or be a dangling symlink - skip it, but not the others
+        try:
+            if scandir is not None:
+                name, fullpath = entry.name, entry.path
+                is_dir = entry.is_dir()
+                st = None if is_dir or not name.endswith(suffix) else entry.stat()
+            else:
+                name, fullpath = entry, os.path.join(directory, entry)
+                st = os.stat(fullpath)
+                is_dir = stat.S_ISDIR(st.st_mode)
+        except OSError:
+            continue
+        if is_dir:
+            subdirs.add(name)
+        elif name.endswith(suffix):
+            files.append((name, fullpath, stat_info(st)))
+    return files, subdirs
+
+
 def add_no_cache_argument(parser):
     # This really only stores the True/False value. We need to set
     # settings.USE_CACHE before we create the parser, but for creating
@@ -1,4 +1,3 @@
-import copy
 import functools
 import logging
 import os
@@ -7,6 +6,8 @@ import six
 
 from devassistant import argument
 from devassistant import assistant_base
+from devassistant import cache
+from devassistant import context
 from devassistant import exceptions
 from devassistant.logger import logger
 from devassistant import lang
@@ -19,12 +20,18 @@ from devassistant import yaml_loader
 def needs_fully_loaded(method):
     """Wraps all publicly callable methods of YamlAssistant. If the assistant was loaded
     from cache, this decorator will fully load it first time a publicly callable method
-    is used.
+    is used. Body of the assistant is taken from cache (see cache.Cache.get_body), if
+    possible, so that its yaml file doesn't need to be parsed again.
     """
     @functools.wraps(method)
     def inner(self, *args, **kwargs):
         if not self.fully_loaded:
-            loaded_yaml = yaml_loader.YamlLoader.load_yaml_by_path(self.path)
+            loaded_yaml = None
+            if self.body_loader is not None:
+                loaded_yaml = self.body_loader()
+                cache.stats.incr('body_misses' if loaded_yaml is None else 'body_hits')
+            if loaded_yaml is None:
+                loaded_yaml = yaml_loader.YamlLoader.load_yaml_by_path(self.path)
             self.parsed_yaml = loaded_yaml
             self.fully_loaded = True
         return method(self, *args, **kwargs)
@@ -32,13 +39,123 @@ def needs_fully_loaded(method):
     return inner
 
 
-class YamlAssistant(assistant_base.AssistantBase, loaded_yaml.LoadedYaml):
+class YamlAssistantBase(assistant_base.AssistantBase, loaded_yaml.LoadedYaml):
+    """Base of YamlAssistant and AssistantDescriptor with things that don't depend on
+    anything but the cached attributes."""
+    __slots__ = ()
+
+    @property
+    def default_icon_path(self):
+        """Returns default path to icon of this assistant.
+
+        Assuming self.path == "/foo/assistants/crt/python/django.yaml"
+        For image format in [png, svg]:
+            1) Take the path of this assistant and strip it of load path
+               (=> "crt/python/django.yaml")
+            2) Substitute its extension for <image format>
+               (=> "crt/python/django.<image format>")
+            3) Prepend self.load_path + 'icons'
+               (=> "/foo/icons/crt/python/django.<image format>")
+            4) If file from 3) exists, return it
+        Return empty string if no icon found.
+        """
+        supported_exts = ['.png', '.svg']
+        stripped = self.path.replace(os.path.join(self.load_path, 'assistants'), '').strip(os.sep)
+        for ext in supported_exts:
+            icon_with_ext = os.path.splitext(stripped)[0] + ext
+            icon_fullpath = os.path.join(self.load_path, 'icons', icon_with_ext)
+            if os.path.exists(icon_fullpath):
+                return icon_fullpath
+        return ''
+
+    def _construct_args(self, struct):
+        args = []
+        for arg_name, arg_params in struct.items():
+            try:
+                args.append(argument.Argument.construct_arg(arg_name, arg_params))
+            except exceptions.ExecutionException as e:
+                msg = 'Problem when constructing argument {arg} in assistant {a}: {e}'.\
+                    format(arg=arg_name, a=self.name, e=six.text_type(e))
+                logger.warning(msg)
+        return args
+
+
+class AssistantDescriptor(YamlAssistantBase):
+    """Lightweight representation of an assistant loaded from cache, that only holds its
+    cached attributes (see cache.Cache). These are enough to compose cli/gui, so the whole
+    tree of assistants consists of descriptors, that only compute their arguments and icon
+    path when they're first needed. A descriptor is upgraded to YamlAssistant once it
+    is selected to run (see get_full_assistant).
+    """
+    __slots__ = ['name', 'path', 'superassistant', 'role', 'attrs', 'body_loader',
+                 '_args', '_icon_path', '_subassistants', '_tree', '_full_assistant']
+    fully_loaded = False
+
+    def __init__(self, name, attrs, path, superassistant,
+                 role=settings.DEFAULT_ASSISTANT_ROLE, body_loader=None):
+        self.name = name
+        self.attrs = attrs
+        self.path = path
+        self.superassistant = superassistant
+        self.role = role
+        # see YamlAssistant
+        self.body_loader = body_loader
+        self._args = None
+        self._icon_path = None
+        self._full_assistant = None
+
+    @property
+    def fullname(self):
+        return self.attrs.get('fullname') or self.name
+
+    @property
+    def description(self):
+        return self.attrs.get('description') or ''
+
+    @property
+    def args(self):
+        if self._args is None:
+            self._args = self._construct_args(self.attrs.get('args') or {})
+        return self._args
+
+    @property
+    def icon_path(self):
+        if self._icon_path is None:
+            self._icon_path = self.attrs.get('icon_path') or self.default_icon_path
+        return self._icon_path
+
+    @property
+    def files_dir(self):
+        return self.default_files_dir_for('assistants')
+
+    def get_subassistants(self):
+        return self._subassistants
+
+    def get_full_assistant(self):
+        """Returns YamlAssistant (not fully loaded yet) with the same attributes and
+        subassistants as this descriptor; its superassistant is upgraded, too, so that
+        it can be used by "use: super.<section>"."""
+        if self._full_assistant is None:
+            superassistant = self.superassistant
+            if superassistant is not None:
+                superassistant = superassistant.get_full_assistant()
+            full = YamlAssistant(self.name, self.attrs, self.path, superassistant,
+                                 fully_loaded=False, role=self.role,
+                                 body_loader=self.body_loader)
+            full._subassistants = self.get_subassistants()
+            self._full_assistant = full
+        return self._full_assistant
+
+
+class YamlAssistant(YamlAssistantBase):
     def __init__(self, name, parsed_yaml, path, superassistant, fully_loaded=True,
-                 role=settings.DEFAULT_ASSISTANT_ROLE):
+                 role=settings.DEFAULT_ASSISTANT_ROLE, body_loader=None):
         self.name = name
         self.path = path
         self.superassistant = superassistant
         self.fully_loaded = fully_loaded
+        # function returning full body of this assistant (or None), used to fully load it
+        self.body_loader = body_loader
         self.role = role
         self.stop_flag = False
         self.parsed_yaml = parsed_yaml
@@ -66,16 +183,17 @@ class YamlAssistant(assistant_base.AssistantBase, loaded_yaml.LoadedYaml):
         self._project_type = value.get('project_type') or []
         self._logging = value.get('logging') or []
         # set _run and _dependencies as empty in case assistant doesn't have them at all
-        self._dependencies = value.get('dependencies') or []
-        self._run = value.get('run') or []
+        # (sections are lowered right away, unless they were already lowered in cache)
+        self._dependencies = lang.lower_section(value.get('dependencies') or [])
+        self._run = lang.lower_section(value.get('run') or [])
         # handle more dependencies* and run* sections (except 'run' and 'dependencies'),
         # these two were already handled above
         for k, v in value.items():
             if k.startswith('run') or k.startswith('dependencies') and \
                k not in ['run', 'dependencies']:
-                setattr(self, '_{0}'.format(k), v or [])
-        self._pre_run = value.get('pre_run') or []
-        self._post_run = value.get('post_run') or []
+                setattr(self, '_{0}'.format(k), lang.lower_section(v or []))
+        self._pre_run = lang.lower_section(value.get('pre_run') or [])
+        self._post_run = lang.lower_section(value.get('post_run') or [])
 
     @needs_fully_loaded
     def assert_fully_loaded(self):
@@ -91,41 +209,6 @@ class YamlAssistant(assistant_base.AssistantBase, loaded_yaml.LoadedYaml):
                 pt = self.superassistant.project_type + pt
         return pt
 
-    @property
-    def default_icon_path(self):
-        """Returns default path to icon of this assistant.
-
-        Assuming self.path == "/foo/assistants/crt/python/django.yaml"
-        For image format in [png, svg]:
-            1) Take the path of this assistant and strip it of load path
-               (=> "crt/python/django.yaml")
-            2) Substitute its extension for <image format>
-               (=> "crt/python/django.<image format>")
-            3) Prepend self.load_path + 'icons'
-               (=> "/foo/icons/crt/python/django.<image format>")
-            4) If file from 3) exists, return it
-        Return empty string if no icon found.
-        """
-        supported_exts = ['.png', '.svg']
-        stripped = self.path.replace(os.path.join(self.load_path, 'assistants'), '').strip(os.sep)
-        for ext in supported_exts:
-            icon_with_ext = os.path.splitext(stripped)[0] + ext
-            icon_fullpath = os.path.join(self.load_path, 'icons', icon_with_ext)
-            if os.path.exists(icon_fullpath):
-                return icon_fullpath
-        return ''
-
-    def _construct_args(self, struct):
-        args = []
-        for arg_name, arg_params in struct.items():
-            try:
-                args.append(argument.Argument.construct_arg(arg_name, arg_params))
-            except exceptions.ExecutionException as e:
-                msg = 'Problem when constructing argument {arg} in assistant {a}: {e}'.\
-                    format(arg=arg_name, a=self.name, e=six.text_type(e))
-                logger.warning(msg)
-        return args
-
     def get_subassistants(self, use_cache=True):
         return self._subassistants
 
@@ -137,7 +220,7 @@ class YamlAssistant(assistant_base.AssistantBase, loaded_yaml.LoadedYaml):
         """
         kwargs['__section__'] = section
         kwargs['__assistant__'] = self
-        kwargs['__env__'] = copy.deepcopy(os.environ)
+        kwargs['__env__'] = context.EnvOverlay()
         kwargs['__files__'] = [self._files]
         kwargs['__files_dir__'] = [self.files_dir]
         kwargs['__sourcefiles__'] = [self.path]
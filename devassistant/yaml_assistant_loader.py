@@ -1,10 +1,14 @@
+import atexit
+import functools
 import os
+import shutil
 
 from devassistant import cache
 from devassistant import exceptions
 from devassistant.logger import logger
 from devassistant import yaml_loader
 from devassistant import settings
+from devassistant import utils
 from devassistant import yaml_assistant
 from devassistant import yaml_checker
 
@@ -13,6 +17,10 @@ class YamlAssistantLoader(object):
     assistants_dirs = list(map(lambda x: os.path.join(x, 'assistants'), settings.DATA_DIRECTORIES))
     # mapping of assistant roles to lists of top-level assistant instances
     _assistants = {}
+    # mapping of assistant roles to cache.LayeredCache instances they were loaded with
+    _caches = {}
+    # cache.LayeredCache instance shared by all roles, see get_cache
+    _cache = None
 
     @classmethod
     def get_assistants(cls, superassistants):
@@ -38,66 +46,241 @@ class YamlAssistantLoader(object):
         Tries to use cache (updated/created if needed). If cache is unusable, it
         falls back to loading all assistants.
 
+        If there is a usable bundle (see devassistant.bundle), assistants are loaded
+        from it instead.
+
+        If settings.LAZY_LOAD_NAMES is not None, roles that are not named there (neither
+        by name nor by alias) are not loaded at all and only assistants named there get
+        their subassistants loaded.
+
         Args:
             roles: list of required assistant roles
         """
         # {'crt': CreatorAssistant, ...}
         superas_dict = dict(map(lambda a: (a.name, a), superassistants))
         to_load = set(superas_dict.keys()) - set(cls._assistants.keys())
+        only = settings.LAZY_LOAD_NAMES
         for tl in to_load:
-            dirs = [os.path.join(d, tl) for d in cls.assistants_dirs]
-            file_hierarchy = cls.get_assistants_file_hierarchy(dirs)
+            cls._caches.pop(tl, None)
+            if only is not None and \
+                    not set([tl] + getattr(superas_dict[tl], 'aliases', [])) & set(only):
+                cls._assistants[tl] = []
+                continue
+            bndl = cls.get_bundle()
+            if bndl is not None:
+                cls._assistants[tl] = cls.get_assistants_from_cache_hierarchy(
+                    bndl.cache.get(tl, {}), superas_dict[tl], role=tl, only=only, cch=bndl)
+                cls._caches[tl] = bndl
+                continue
+            layers = cls.get_layers(tl, only=only)
             # load all if we're not using cache or if we fail to load it
             load_all = not settings.USE_CACHE
             if settings.USE_CACHE:
                 try:
-                    cch = cache.Cache()
-                    cch.refresh_role(tl, file_hierarchy)
+                    cch = cls.get_cache()
+                    cch.refresh_role(tl, layers)
                     cls._assistants[tl] = cls.get_assistants_from_cache_hierarchy(cch.cache[tl],
                                                                                   superas_dict[tl],
-                                                                                  role=tl)
+                                                                                  role=tl,
+                                                                                  only=only,
+                                                                                  cch=cch)
+                    cls._caches[tl] = cch
                 except BaseException as e:
-                    logger.debug('Failed to use DevAssistant cachefile {0}: {1}'.format(
-                        settings.CACHE_FILE, e))
+                    logger.debug('Failed to use DevAssistant cache in {0}: {1}'.format(
+                        settings.CACHE_LAYERS_DIR, e))
+                    cache.stats.fallback('{0}: {1}'.format(tl, e))
                     load_all = True
             if load_all:
+                file_hierarchy = cache.merge_hierarchies([fh for _, fh in layers])
                 cls._assistants[tl] = cls.get_assistants_from_file_hierarchy(file_hierarchy,
                                                                              superas_dict[tl],
                                                                              role=tl)
 
+    @classmethod
+    def get_bundle(cls):
+        """Returns bundle.Bundle to load assistants from, if there is a usable one that was
+        compiled from cls.assistants_dirs, None otherwise."""
+        # bundle imports this module
+        from devassistant import bundle
+        bndl = bundle.Bundle.get_default()
+        if bndl is None or cls.assistants_dirs != \
+                [os.path.join(d, 'assistants') for d in bndl.data_dirs]:
+            return None
+        return bndl
+
+    @classmethod
+    def get_cache(cls):
+        """Returns cache.LayeredCache instance shared by all roles. Roles refreshed in it are
+        written to cache files just once, when DevAssistant exits (see flush_cache).
+        """
+        if cls._cache is None:
+            cls._cache = cache.LayeredCache()
+        return cls._cache
+
+    @classmethod
+    def flush_cache(cls):
+        """Writes all roles refreshed in shared cache (see get_cache) to cache files."""
+        if cls._cache is not None:
+            try:
+                cls._cache.flush()
+            except BaseException as e:
+                logger.debug('Failed to write DevAssistant cache to {0}: {1}'.format(
+                    settings.CACHE_LAYERS_DIR, e))
+
+    @classmethod
+    def build_cache(cls, system=False):
+        """Refreshes cache of all assistants in all assistant directories (unlike
+        load_all_assistants, regardless of settings.LAZY_LOAD_NAMES) and writes it.
+
+        Args:
+            system: if True, writes prebuilt read-only layers (see cache.LayeredCache) of
+                    assistant directories outside of settings.DEVASSISTANT_HOME instead
+                    of user's layers
+        Returns:
+            list of assistant directories that the cache has been built for
+        """
+        if system:
+            home = os.path.join(os.path.abspath(settings.DEVASSISTANT_HOME), '')
+            dirs = [d for d in cls.assistants_dirs
+                    if os.path.isdir(d) and not os.path.abspath(d).startswith(home)]
+            for d in dirs:
+                layer = cache.Cache(cache.LayeredCache.system_layer_file(d),
+                                    cache_format='binary')
+                for role in settings.ASSISTANT_ROLES:
+                    layer.refresh_role(role, cls.get_layers(role, dirs=[d])[0][1])
+                # write all roles, so that none of them needs user's layer
+                layer.flush(roles=settings.ASSISTANT_ROLES)
+        else:
+            dirs = list(cls.assistants_dirs)
+            cch = cache.LayeredCache()
+            for role in settings.ASSISTANT_ROLES:
+                cch.refresh_role(role, cls.get_layers(role))
+            cch.flush()
+        return dirs
+
+    @classmethod
+    def rebuild_cache(cls):
+        """Removes user's cache of assistants (together with snippet index and parser
+        cache) and builds it again from scratch, see build_cache.
+
+        Returns:
+            list of assistant directories that the cache has been built for
+        """
+        # cache loaded in this process would be written at exit
+        cls._cache = None
+        cls._caches = {}
+        if os.path.exists(settings.CACHE_LAYERS_DIR):
+            shutil.rmtree(settings.CACHE_LAYERS_DIR)
+        for f in [settings.SNIPPET_INDEX_FILE, settings.PARSER_CACHE_FILE]:
+            if os.path.exists(f):
+                os.unlink(f)
+        return cls.build_cache()
+
+    @classmethod
+    def dump_cache(cls, stream):
+        """Refreshes cache of all assistants (like build_cache, but without writing it)
+        and exports it as yaml to given stream."""
+        cch = cache.LayeredCache()
+        for role in settings.ASSISTANT_ROLES:
+            cch.refresh_role(role, cls.get_layers(role))
+        cch.dump_yaml(stream)
+
+    @classmethod
+    def verify_cache(cls):
+        """Finds cached assistants in all assistant directories that need to be rebuilt
+        (see cache.Cache.verify_role), without changing the cache.
+
+        Returns:
+            list of tuples (layer file, path of assistant, reason)
+        """
+        cch = cache.LayeredCache()
+        problems = []
+        for role in settings.ASSISTANT_ROLES:
+            problems.extend(cch.verify_role(role, cls.get_layers(role)))
+        return problems
+
+    @classmethod
+    def get_layers(cls, role, only=None, dirs=None):
+        """Returns file hierarchies of given role in assistant directories, as accepted by
+        cache.LayeredCache.refresh_role.
+
+        Args:
+            role: role of assistants
+            only: see get_assistants_file_hierarchy
+            dirs: assistant directories, cls.assistants_dirs by default
+        Returns:
+            list of tuples (assistant directory, file hierarchy of given role in it)
+        """
+        return [(d, cls.get_assistants_file_hierarchy([os.path.join(d, role)],
+                                                      only=only,
+                                                      orphans=True))
+                for d in (cls.assistants_dirs if dirs is None else dirs)]
+
+    @classmethod
+    def get_cached_role(cls, role):
+        """Returns cached hierarchy of given role and its fingerprint (see cache.Cache),
+        if assistants of this role were loaded from cache.
+
+        Args:
+            role: role to return cached hierarchy for
+        Returns:
+            tuple (cached hierarchy, fingerprint) or (None, None) if assistants of given role
+            weren't loaded from cache
+        """
+        cch = cls._caches.get(role)
+        if cch is None:
+            return None, None
+        return cch.cache[role], cch.fingerprint(role)
+
     @classmethod
     def get_assistants_from_cache_hierarchy(cls, cache_hierarchy, superassistant,
-                                            role=settings.DEFAULT_ASSISTANT_ROLE):
+                                            role=settings.DEFAULT_ASSISTANT_ROLE, only=None,
+                                            cch=None):
         """Accepts cache_hierarch as described in devassistant.cache and returns
-        instances of YamlAssistant (only with cached attributes) for loaded files
+        instances of yaml_assistant.AssistantDescriptor (only with cached attributes)
+        for loaded files
 
         Args:
             cache_hierarchy: structure as described in devassistant.cache
             role: role of all assistants in this hierarchy (we could find
                   this out dynamically but it's not worth the pain)
+            only: if not None, only assistants with names from this collection
+                  get their subassistants loaded
+            cch: cache (cache.Cache or cache.LayeredCache) that cache_hierarchy comes from;
+                 if given, assistants are fully loaded from bodies cached in it
         Returns:
             list of top level assistants from given hierarchy; these assistants contain
             references to instances of their subassistants (and their subassistants, ...)
-            Note, that the assistants are not fully loaded, but contain just cached attrs.
+            Note, that the assistants are not fully loaded, but contain just cached attrs;
+            they're upgraded to YamlAssistant instances when selected.
         """
         result = []
 
         for name, attrs in cache_hierarchy.items():
-            ass = cls.assistant_from_yaml(attrs['source'],
-                                          {name: attrs['attrs']},
-                                          superassistant,
-                                          fully_loaded=False,
-                                          role=role)
-            ass._subassistants = cls.get_assistants_from_cache_hierarchy(attrs['subhierarchy'],
-                                                                         ass,
-                                                                         role=role)
+            body_loader = None
+            if cch is not None:
+                body_loader = functools.partial(cch.get_body, role, attrs['source'],
+                                                attrs.get('ctime'))
+            # cached attributes have been checked when they were cached
+            ass = yaml_assistant.AssistantDescriptor(name,
+                                                     attrs['attrs'],
+                                                     attrs['source'],
+                                                     superassistant,
+                                                     role=role,
+                                                     body_loader=body_loader)
+            if only is None or name in only:
+                ass._subassistants = cls.get_assistants_from_cache_hierarchy(
+                    attrs['subhierarchy'], ass, role=role, only=only, cch=cch)
+            else:
+                ass._subassistants = []
             result.append(ass)
 
         return result
 
     @classmethod
     def get_assistants_from_file_hierarchy(cls, file_hierarchy, superassistant,
-                                           role=settings.DEFAULT_ASSISTANT_ROLE):
+                                           role=settings.DEFAULT_ASSISTANT_ROLE,
+                                           preloaded=None):
         """Accepts file_hierarch as returned by cls.get_assistant_file_hierarchy and returns
         instances of YamlAssistant for loaded files
 
@@ -105,72 +288,127 @@ class YamlAssistantLoader(object):
             file_hierarchy: structure as described in cls.get_assistants_file_hierarchy
             role: role of all assistants in this hierarchy (we could find
                   this out dynamically but it's not worth the pain)
+            preloaded: files from file_hierarchy loaded in parallel, as returned by
+                       yaml_loader.YamlLoader.preload_yamls (they're preloaded here
+                       if None is given)
         Returns:
             list of top level assistants from given hierarchy; these assistants contain
-            references to instances of their subassistants (and their subassistants, ...)
+            references to instances of their subassistants (and their subassistants, ...);
+            assistants with unscanned subhierarchy get no subassistants
         """
         result = []
         warn_msg = 'Failed to load assistant {source}, skipping subassistants.'
+        if preloaded is None:
+            preloaded = {}
+            if settings.LOAD_WORKERS > 1:
+                preloaded = yaml_loader.YamlLoader.preload_yamls(
+                    cls.get_sources(file_hierarchy), check=True)
 
         for name, attrs in file_hierarchy.items():
-            loaded_yaml = yaml_loader.YamlLoader.load_yaml_by_path(attrs['source'])
+            check_error = None
+            if attrs['source'] in preloaded:
+                loaded_yaml, check_error = preloaded[attrs['source']]
+            else:
+                loaded_yaml = yaml_loader.YamlLoader.load_yaml_by_path(attrs['source'])
             if loaded_yaml is None:  # there was an error parsing yaml
                 logger.warning(warn_msg.format(source=attrs['source']))
                 continue
             try:
+                if check_error is not None:
+                    raise check_error
                 ass = cls.assistant_from_yaml(attrs['source'],
                                               loaded_yaml,
                                               superassistant,
-                                              role=role)
+                                              role=role,
+                                              check=attrs['source'] not in preloaded)
             except exceptions.YamlError as e:
                 logger.warning(e)
                 continue
-            ass._subassistants = cls.get_assistants_from_file_hierarchy(attrs['subhierarchy'],
-                                                                        ass,
-                                                                        role=role)
+            ass._subassistants = cls.get_assistants_from_file_hierarchy(
+                attrs['subhierarchy'] or {}, ass, role=role, preloaded=preloaded)
             result.append(ass)
 
         return result
 
     @classmethod
-    def get_assistants_file_hierarchy(cls, dirs):
+    def get_sources(cls, file_hierarchy):
+        """Returns list of source files of all assistants in given file hierarchy
+        (see get_assistants_file_hierarchy)."""
+        sources = []
+        for attrs in file_hierarchy.values():
+            if attrs['source'] is not None:
+                sources.append(attrs['source'])
+            sources.extend(cls.get_sources(attrs['subhierarchy'] or {}))
+        return sources
+
+    @classmethod
+    def get_assistants_file_hierarchy(cls, dirs, only=None, orphans=False):
         """Returns assistants file hierarchy structure (see below) representing assistant
         hierarchy in given directories.
 
         It works like this:
-        1. It goes through all *.yaml files in all given directories and adds them into
-           hierarchy (if there are two files with same name in more directories, the file
-           from first directory wins).
+        1. It lists all given directories (each of them just once) and adds all *.yaml
+           files into hierarchy (if there are two files with same name in more directories,
+           the file from first directory wins).
         2. For each {name}.yaml file, it calls itself recursively for {name} subdirectories
-           of all given directories.
+           of all given directories (only those that were found when listing them).
 
         Args:
             dirs: directories to search
+            only: if not None, only {name} subdirectories for names from this collection
+                  are searched, other assistants get None as subhierarchy
+            orphans: if True, {name} subdirectories (with some subassistants) that have no
+                     {name}.yaml file are also added to hierarchy, with None as source
+                     (see cache.merge_hierarchies)
         Returns:
-            hierarchy structure that looks like this:
+            hierarchy structure that looks like this (the stat information are taken
+            from listing the directories, so that cache doesn't need to stat files again):
             {'assistant1':
                 {'source': '/path/to/assistant1.yaml',
+                 'mtime_ns': 1400000000000000000,
+                 'ctime_ns': 1400000000000000000,
+                 'size': 1024,
                  'subhierarchy': {<hierarchy of subassistants>}},
              'assistant2':
                 {'source': '/path/to/assistant2.yaml',
+                 ...
                  'subhierarchy': {<another hierarchy of subassistants}}
             }
         """
         result = {}
-        for d in filter(lambda d: os.path.exists(d), dirs):
-            for f in filter(lambda f: f.endswith('.yaml'), os.listdir(d)):
+        listings = [(d, utils.scan_dir(d, suffix='.yaml')) for d in dirs]
+        for d, (files, subdirs) in listings:
+            for f, fullpath, stat_info in files:
                 assistant_name = f[:-5]
                 if assistant_name not in result:
-                    subas_dirs = [os.path.join(dr, assistant_name) for dr in dirs]
-                    result[assistant_name] = {'source': os.path.join(d, f),
-                                              'subhierarchy':
-                                              cls.get_assistants_file_hierarchy(subas_dirs)}
+                    subhierarchy = None
+                    if only is None or assistant_name in only:
+                        subas_dirs = [os.path.join(dr, assistant_name)
+                                      for dr, (_, dr_subdirs) in listings
+                                      if assistant_name in dr_subdirs]
+                        subhierarchy = cls.get_assistants_file_hierarchy(subas_dirs, only=only,
+                                                                         orphans=orphans)
+                    result[assistant_name] = dict(stat_info,
+                                                  source=fullpath,
+                                                  subhierarchy=subhierarchy)
+        if orphans:
+            all_subdirs = set().union(*[subdirs for _, (_, subdirs) in listings])
+            for subdir in sorted(all_subdirs - set(result)):
+                if only is not None and subdir not in only:
+                    continue
+                subas_dirs = [os.path.join(dr, subdir)
+                              for dr, (_, dr_subdirs) in listings if subdir in dr_subdirs]
+                subhierarchy = cls.get_assistants_file_hierarchy(subas_dirs, only=only,
+                                                                 orphans=True)
+                if subhierarchy:
+                    result[subdir] = {'source': None, 'mtime_ns': 0, 'ctime_ns': 0,
+                                      'size': 0, 'subhierarchy': subhierarchy}
 
         return result
 
     @classmethod
     def assistant_from_yaml(cls, source, y, superassistant, fully_loaded=True,
-                            role=settings.DEFAULT_ASSISTANT_ROLE):
+                            role=settings.DEFAULT_ASSISTANT_ROLE, check=True, body_loader=None):
         """Constructs instance of YamlAssistant loaded from given structure y, loaded
         from source file source.
 
@@ -178,6 +416,9 @@ class YamlAssistantLoader(object):
             source: path to assistant source file
             y: loaded yaml structure
             superassistant: superassistant of this assistant
+            check: whether to check y by yaml_checker (False if it was already checked)
+            body_loader: function returning full body of the assistant, if y isn't
+                         fully loaded (see YamlAssistant)
         Returns:
             YamlAssistant instance constructed from y with source file source
         Raises:
@@ -187,8 +428,12 @@ class YamlAssistantLoader(object):
         # now we allow that, but we also allow omitting the assistant name and putting
         # the attributes to top_level, too.
         name = os.path.splitext(os.path.basename(source))[0]
-        yaml_checker.check(source, y)
+        if check:
+            yaml_checker.check(source, y)
         assistant = yaml_assistant.YamlAssistant(name, y, source, superassistant,
-            fully_loaded=fully_loaded, role=role)
+            fully_loaded=fully_loaded, role=role, body_loader=body_loader)
 
         return assistant
+
+
+atexit.register(YamlAssistantLoader.flush_cache)
@@ -173,11 +173,33 @@ class YamlChecker(object):
                 if command_type.startswith('if ') or command_type.startswith('else ') or \
                    command_type.startswith('for ') or command_type.endswith('~'):
                     self._check_execution_section(path, command_type, command_input)
+                elif command_type == 'parallel':
+                    self._check_parallel(path, command_type, command_input)
                 else:
                     self._check_literal_section(path, command_type, command_input)
         else:  # expression
             pass  # TODO: check expression syntax here or leave it up for the actual run?
 
+    def _check_parallel(self, path, sectname, struct):
+        extra_info = '"parallel" has to be a list of branches or a mapping with "branches" ' +\
+            'and optional "max_workers"; each branch has to be a list of commands or ' +\
+            'a single command.'
+        self._assert_struct_type(struct, sectname, (list, dict), path, extra_info)
+        path = path + [sectname]
+        if isinstance(struct, dict):
+            self._assert_key_in('branches', struct, sectname, path, extra_info)
+            self._assert_list(struct['branches'], 'branches', path, extra_info)
+            if 'max_workers' in struct:
+                self._assert_struct_type(struct['max_workers'], 'max_workers',
+                                         (int, ) + six.string_types, path, extra_info)
+            struct = struct['branches']
+        for i, branch in enumerate(struct):
+            name = 'branch {0}'.format(i + 1)
+            if isinstance(branch, dict):
+                self._assert_command_dict(branch, name, path, extra_info)
+                branch = [branch]
+            self._check_execution_section(path, name, branch)
+
     def _check_literal_section(self, path, sectname, struct):
         # input section can be pretty much anything; we just want to check that when there's
         # a dict somewhere in the structure  and one of its members ends with execution flag,
@@ -7,8 +7,39 @@ try:
     from yaml import CLoader as Loader
 except:
     from yaml import Loader
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:  # Python 2 without "futures" backport
+    ProcessPoolExecutor = None
 
+from devassistant import exceptions
 from devassistant.logger import logger
+from devassistant import settings
+from devassistant import yaml_checker
+
+# parallel loading is only worth starting worker processes for at least this many files
+PARALLEL_MIN_FILES = 16
+
+
+def _load_yaml_worker(args):
+    """Loads (and optionally checks) a yaml file in a worker process of
+    YamlLoader.preload_yamls. Nothing is logged here, problems are returned to the parent.
+
+    Args:
+        args: tuple (path, check)
+    Returns:
+        tuple (path, loaded yaml or None, yaml syntax error message or None,
+               YamlError raised by yaml_checker.check or None)
+    """
+    path, check = args
+    loaded, error = YamlLoader._load_yaml(path)
+    check_error = None
+    if check:
+        try:
+            yaml_checker.check(path, loaded)
+        except exceptions.YamlError as e:
+            check_error = e
+    return path, loaded, error, check_error
 
 
 class YamlLoader(object):
@@ -31,8 +62,12 @@ class YamlLoader(object):
                 yaml_files.extend(map(lambda x: os.path.join(dirname, x),
                                       filter(lambda x: x.endswith('.yaml'), files)))
 
+        preloaded = cls.preload_yamls(yaml_files)
         for f in yaml_files:
-            loaded_yamls[f] = cls.load_yaml_by_path(f)
+            if f in preloaded:
+                loaded_yamls[f] = preloaded[f][0]
+            else:
+                loaded_yamls[f] = cls.load_yaml_by_path(f)
 
         return loaded_yamls
 
@@ -54,20 +89,62 @@ class YamlLoader(object):
             if os.path.exists(possible_path):
                 loaded = cls.load_yaml_by_path(possible_path, log_debug=log_debug)
                 if loaded is not None:
-                    return (possible_path, cls.load_yaml_by_path(possible_path))
+                    return (possible_path, loaded)
 
         return None
 
     @classmethod
     def load_yaml_by_path(cls, path, log_debug=False):
         """Load a yaml file that is at given path"""
+        loaded, error = cls._load_yaml(path)
+        if error is not None:
+            logger.log(logging.DEBUG if log_debug else logging.WARNING, error)
+        return loaded
+
+    @classmethod
+    def _load_yaml(cls, path):
+        """Returns tuple (loaded yaml, None) or (None, error message) on yaml syntax error"""
         try:
-            return yaml.load(open(path, 'r'), Loader=Loader) or {}
+            with open(path, 'r') as f:
+                return yaml.load(f, Loader=Loader) or {}, None
         except (yaml.scanner.ScannerError, yaml.parser.ParserError) as e:
-            log_level = logging.DEBUG if log_debug else logging.WARNING
-            logger.log(log_level, 'Yaml error in {path} (line {ln}, column {col}): {err}'.
-                       format(path=path,
-                              ln=e.problem_mark.line,
-                              col=e.problem_mark.column,
-                              err=e.problem))
-            return None
+            return None, 'Yaml error in {path} (line {ln}, column {col}): {err}'.\
+                format(path=path,
+                       ln=e.problem_mark.line,
+                       col=e.problem_mark.column,
+                       err=e.problem)
+
+    @classmethod
+    def preload_yamls(cls, paths, check=False, log_debug=False):
+        """Loads given yaml files in parallel by a pool of settings.LOAD_WORKERS processes.
+        Callers use the result instead of loading the files one by one; if a file is not
+        present in the result, they should load it by load_yaml_by_path as usual.
+
+        Args:
+            paths: list of paths of yaml files to load
+            check: whether to also check the loaded files by yaml_checker.check
+            log_debug: log yaml syntax errors as debug
+        Returns:
+            dict {path: (loaded yaml or None on syntax error, YamlError raised by check
+            or None)}; empty if parallel loading is disabled or not worth it
+        """
+        workers = settings.LOAD_WORKERS
+        if workers < 2 or ProcessPoolExecutor is None or len(paths) < PARALLEL_MIN_FILES:
+            return {}
+
+        result = {}
+        chunksize = max(1, len(paths) // (workers * 4))
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                loaded = list(pool.map(_load_yaml_worker,
+                                       [(p, check) for p in paths],
+                                       chunksize=chunksize))
+        except Exception as e:
+            logger.debug('Failed to load yaml files in parallel: {0}'.format(e))
+            return result
+
+        for path, loaded_yaml, error, check_error in loaded:
+            if error is not None:
+                logger.log(logging.DEBUG if log_debug else logging.WARNING, error)
+            result[path] = (loaded_yaml, check_error)
+        return result
@@ -1,7 +1,8 @@
+import atexit
 import os
 
 from devassistant import exceptions
-from devassistant import yaml_loader
+from devassistant.logger import logger
 from devassistant import settings
 from devassistant import snippet
 from devassistant import yaml_checker
@@ -12,6 +13,8 @@ class YamlSnippetLoader(object):
     # maps dotted snippet names to Snippet objects, e.g. {'foo.bar': <Snippet object>, ...}
     _snippets = {}
     _loaded_all = False
+    # cache.SnippetIndex of snippets_dirs, see get_index
+    _index = None
 
     @classmethod
     def _create_snippet(cls, name, path, parsed_yaml):
@@ -24,30 +27,71 @@ class YamlSnippetLoader(object):
 
         return snip
 
+    @classmethod
+    def get_index(cls):
+        """Returns cache.SnippetIndex of cls.snippets_dirs. The index is only stored between
+        invocations if settings.USE_CACHE is True; it is written when DevAssistant exits
+        (see flush_index). If there is a usable bundle compiled from cls.snippets_dirs (see
+        devassistant.bundle), returns index of snippets from the bundle instead."""
+        if cls._index is None or cls._index.dirs != cls.snippets_dirs:
+            # cache and bundle import this module
+            from devassistant import bundle
+            from devassistant import cache
+            bndl = bundle.Bundle.get_default()
+            if bndl is not None and cls.snippets_dirs == \
+                    [os.path.join(d, 'snippets') for d in bndl.data_dirs]:
+                cls._index = bndl.get_snippet_index(cls.snippets_dirs)
+            else:
+                index_file = settings.SNIPPET_INDEX_FILE if settings.USE_CACHE else None
+                cls._index = cache.SnippetIndex(cls.snippets_dirs, index_file=index_file)
+        return cls._index
+
+    @classmethod
+    def flush_index(cls):
+        """Writes snippet index (see get_index) to its file, if it has changed."""
+        if cls._index is not None:
+            try:
+                cls._index.write()
+            except BaseException as e:
+                logger.debug('Failed to write snippet index {0}: {1}'.format(
+                    cls._index.index_file, e))
+
+    @classmethod
+    def _get_snippet_file(cls, name):
+        snippet_file = cls.get_index().get(name)
+        if snippet_file is None:
+            raise exceptions.SnippetNotFoundException('no such snippet: {name}'.
+                                                      format(name=name.replace('.', os.sep)))
+        return snippet_file
+
     @classmethod
     def get_snippet_by_name(cls, name):
         """name is in dotted format, e.g. topsnippet.something.wantedsnippet"""
         if name in cls._snippets:
             return cls._snippets[name]
-        name_with_dir_separators = name.replace('.', os.path.sep)
-        loaded = yaml_loader.YamlLoader.load_yaml_by_relpath(cls.snippets_dirs,
-                                                             name_with_dir_separators + '.yaml')
-        if loaded:
-            return cls._create_snippet(name, *loaded)
+        snippet_file = cls._get_snippet_file(name)
+        return cls._create_snippet(name, snippet_file['path'], snippet_file['parsed'])
 
-        raise exceptions.SnippetNotFoundException('no such snippet: {name}'.
-                                                  format(name=name_with_dir_separators))
+    @classmethod
+    def get_snippet_ctime(cls, name):
+        """Returns ctime (in ns) of file of snippet with given dotted name (without
+        stat-ing it again, see cache.SnippetIndex)."""
+        return cls._get_snippet_file(name)['ctime_ns']
 
     @classmethod
     def get_all_snippets(cls):
+        """Loads all snippets from cls.snippets_dirs. If there are snippets with the same
+        name in more directories, the one from the first directory wins, the same as
+        with get_snippet_by_name (so that preloaded snippets, e.g. in the daemon, are the
+        same that would be loaded by name)."""
         if not cls._loaded_all:
-            for d in cls.snippets_dirs:
-                loaded = yaml_loader.YamlLoader.load_all_yamls([d])
-                for path, parsed_yaml in loaded.items():
-                    name = path[len(d):].strip(os.path.sep)
-                    name = os.path.splitext(name)[0].replace(os.path.sep, '.')
-                    # override even if the snippet is already there - we need to make
-                    # sure that we prefer snippets from the last load path
-                    cls._create_snippet(name, path, parsed_yaml)
+            index = cls.get_index()
+            for name in index.names():
+                snippet_file = index.get(name)
+                if name not in cls._snippets and snippet_file is not None:
+                    cls._create_snippet(name, snippet_file['path'], snippet_file['parsed'])
             cls._loaded_all = True
         return cls._snippets
+
+
+atexit.register(YamlSnippetLoader.flush_index)
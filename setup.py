@@ -118,9 +118,9 @@ setup(
     license = 'GPLv2+',
     packages = find_packages(exclude=["test", "*test.*"]),
     include_package_data = True,
-    entry_points = {'console_scripts':['da=devassistant.cli.cli_runner:CliRunner.run',
+    entry_points = {'console_scripts':['da=devassistant.daemon_client:run',
                                        'da-gui=devassistant.gui:run_gui',
-                                       'devassistant=devassistant.cli.cli_runner:CliRunner.run',
+                                       'devassistant=devassistant.daemon_client:run',
                                        'devassistant-gui=devassistant.gui:run_gui']},
     install_requires=_install_requirements(),
     setup_requires = [],
@@ -1,8 +1,26 @@
+import atexit
 import os
+import shutil
+import tempfile
 
 from devassistant import settings
 
 fixtures_dir = os.path.join(os.path.dirname(__file__), 'fixtures')
+# caches written by tests go to a temporary directory that lives as long as the test run,
+#  so that they don't litter fixtures
+cache_dir = tempfile.mkdtemp(prefix='da-test-cache-')
+_owner_pid = os.getpid()
 
-settings.CACHE_FILE = os.path.join(fixtures_dir, '.cache.yaml')
+
+@atexit.register
+def _remove_cache_dir():
+    # processes forked by tests inherit the handler, only the test run itself should remove
+    if os.getpid() == _owner_pid:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+settings.CACHE_FILE = os.path.join(cache_dir, '.cache.bin')
+settings.CACHE_LAYERS_DIR = os.path.join(cache_dir, '.cache.layers')
+settings.SNIPPET_INDEX_FILE = os.path.join(cache_dir, '.cache.snippets')
+settings.BUNDLE_FILE = os.path.join(cache_dir, '.cache.bundle')
+settings.PARSER_CACHE_FILE = os.path.join(cache_dir, '.cache.argparse')
 settings.DATA_DIRECTORIES = [fixtures_dir]
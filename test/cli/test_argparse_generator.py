@@ -1,4 +1,7 @@
+from flexmock import flexmock
+
 from devassistant.cli import argparse_generator
+from devassistant.yaml_assistant_loader import YamlAssistantLoader
 
 from test.fake_assistants import *
 
@@ -23,3 +26,34 @@ class TestArgparseGenerator(object):
         assert parser.parse_args(['python', 'django'])
         assert parser.parse_args(['ruby', 'rails', 'crazy'])
         # can't test something that doesn't get parsed, because argparse would sys.exit :(
+
+    def test_only_used_parsers_get_populated(self):
+        parser = self.ag.generate_argument_parser(self.chain)
+        # parsers are populated from spec, don't walk the tree anymore
+        flexmock(argparse_generator.ArgparseGenerator).should_receive('get_spec').never()
+        assert parser.parse_args(['ruby', 'rails', 'crazy'])
+        subparsers = [a for a in parser._actions if a.dest == 'subassistant_0'][0]
+        assert subparsers.choices['python']._populate is not None
+        assert subparsers.choices['ruby']._populate is None
+
+    def test_role_spec_is_created_from_cache(self):
+        cached = {'django': {'attrs': {'description': 'Django!',
+                                       'args': {'name': {'flags': ['-n']}}},
+                             'subhierarchy': {}}}
+        flexmock(YamlAssistantLoader).should_receive('get_cached_role').\
+            with_args('python').and_return((cached, 'fp'))
+        spec_cache = flexmock(get=lambda role, fingerprint: None)
+        spec_cache.should_receive('set').with_args('python', 'fp', list).once()
+        spec = self.ag.get_role_spec(self.python_chain, spec_cache)
+        assert [s['name'] for s in spec['subassistants']] == ['django']
+        assert spec['subassistants'][0]['description'] == 'Django!'
+        assert spec['subassistants'][0]['args'] == \
+            [(['-n'], {'dest': 'name', 'help': '(No help provided)'})]
+
+    def test_role_spec_is_taken_from_spec_cache(self):
+        flexmock(YamlAssistantLoader).should_receive('get_cached_role').\
+            with_args('python').and_return(({}, 'fp'))
+        spec_cache = flexmock(get=lambda role, fingerprint: [{'name': 'cached'}])
+        spec_cache.should_receive('set').never()
+        spec = self.ag.get_role_spec(self.python_chain, spec_cache)
+        assert spec['subassistants'] == [{'name': 'cached'}]
@@ -0,0 +1,18 @@
+import pytest
+
+from devassistant.cli.cli_runner import CliRunner
+
+
+class TestCliRunner(object):
+    @pytest.mark.parametrize('argv, names', [
+        ([], None),
+        (['-h'], None),
+        (['--debug', '--help'], None),
+        # values of options are included, since it's not known which options take them
+        (['crt', 'python', 'django', '-n', 'foo'], set(['crt', 'python', 'django', 'foo'])),
+        (['crt', 'python', '--flag', 'django'], set(['crt', 'python', 'django'])),
+        (['create', '--no-cache', 'python'], set(['create', 'python'])),
+        (['pkg', 'list'], set(['pkg', 'list'])),
+    ])
+    def test_get_lazy_load_names(self, argv, names):
+        assert CliRunner.get_lazy_load_names(argv) == names
@@ -0,0 +1,47 @@
+import os
+import signal
+
+import pytest
+
+# importing the test package points settings to test fixtures; it must happen before any
+#  devassistant module is imported by test modules, since some of them read settings
+#  on import (e.g. YamlSnippetLoader.snippets_dirs or default arguments of cache.Cache)
+import test  # noqa
+
+from devassistant import bundle
+from devassistant.cli.cli_runner import CliRunner
+from devassistant import command_runners
+from devassistant import settings
+from devassistant.yaml_assistant_loader import YamlAssistantLoader
+from devassistant.yaml_snippet_loader import YamlSnippetLoader
+
+
+def reset_loaders():
+    """Forgets everything that loaders of assistants and snippets (and command runners)
+    keep in class attributes, as if DevAssistant was started again."""
+    YamlAssistantLoader.assistants_dirs = \
+        [os.path.join(d, 'assistants') for d in settings.DATA_DIRECTORIES]
+    YamlAssistantLoader._assistants = {}
+    YamlAssistantLoader._caches = {}
+    YamlAssistantLoader._cache = None
+    YamlSnippetLoader.snippets_dirs = \
+        [os.path.join(d, 'snippets') for d in settings.DATA_DIRECTORIES]
+    YamlSnippetLoader._snippets = {}
+    YamlSnippetLoader._loaded_all = False
+    YamlSnippetLoader._index = None
+    bundle.Bundle._loaded = {}
+    CliRunner.argparser = None
+    command_runners._dispatch = {}
+    command_runners._dispatch_for = (None, None)
+
+
+@pytest.fixture(autouse=True)
+def fresh_loaders():
+    """Makes each test independent of state that loaders kept from previous tests."""
+    reset_loaders()
+    yield
+    reset_loaders()
+    # dapp (used by PingPong tests) times out communication by SIGALRM and doesn't cancel
+    #  the alarm, which would kill the test run later
+    if hasattr(signal, 'alarm'):
+        signal.alarm(0)
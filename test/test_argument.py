@@ -57,6 +57,11 @@ class TestArgument(object):
         assert a.name == name
         assert a.flags == ('-s', '--some-arg')
 
+    def test_construct_arg_doesnt_modify_params(self):
+        params = {'flags': ['-f'], 'help': 'foo'}
+        Argument.construct_arg('foo', params)
+        assert params == {'flags': ['-f'], 'help': 'foo'}
+
     @pytest.mark.parametrize(('name', 'params', 'exception'), [
                              ('bar',{'use':'doesnt_exist'},exceptions.SnippetNotFoundException),
                              ('some_arg',{'use':'snippet2'},exceptions.ExecutionException),
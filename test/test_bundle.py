@@ -0,0 +1,68 @@
+import os
+
+import pytest
+from flexmock import flexmock
+
+from devassistant import bundle
+from devassistant.cli.argparse_generator import ArgparseGenerator
+from devassistant import settings
+from devassistant.yaml_assistant_loader import YamlAssistantLoader
+from devassistant.yaml_loader import YamlLoader
+from devassistant.yaml_snippet_loader import YamlSnippetLoader
+
+from test.test_yaml_assistant_loader import CreatorAssistant
+
+
+class TestBundle(object):
+    @pytest.fixture(autouse=True)
+    def compiled(self, tmpdir, monkeypatch):
+        self.path = tmpdir.join('bundle').strpath
+        monkeypatch.setattr(settings, 'BUNDLE_FILE', self.path)
+        flexmock(bundle.Bundle, _loaded={})
+        flexmock(YamlAssistantLoader, _assistants={}, _caches={}, _cache=None)
+        flexmock(YamlSnippetLoader, _snippets={}, _index=None, _loaded_all=False)
+        bundle.compile_bundle(self.path)
+        YamlSnippetLoader._snippets = {}
+        YamlSnippetLoader._index = None
+
+    def source(self, path):
+        return os.path.join(settings.DATA_DIRECTORIES[0], 'assistants', path)
+
+    def test_bundle_contents(self):
+        bndl = bundle.Bundle.get_default()
+        assert bndl is not None
+        c = bndl.cache['crt']['c']
+        assert c['attrs']['fullname'] == 'C Language Tool'
+        assert set(c['subhierarchy']) == set(['d', 'e'])
+        assert bndl.get_body('crt', c['source'], c['ctime']) == \
+            YamlLoader.load_yaml_by_path(self.source('crt/c.yaml'))
+        assert bndl.get_body('crt', c['source'], c['ctime'] - 1) is None
+        fingerprint, specs = bndl.index['specs']['crt']
+        assert fingerprint == bndl.fingerprint('crt')
+        assert specs == ArgparseGenerator.get_cached_hierarchy_specs(bndl.cache['crt'])
+
+    def test_loaders_prefer_bundle(self):
+        flexmock(YamlAssistantLoader).should_receive('get_assistants_file_hierarchy').never()
+        flexmock(YamlLoader).should_receive('load_yaml_by_path').never()
+        assistants = dict((a.name, a) for a in
+                          YamlAssistantLoader.get_assistants([CreatorAssistant()]))
+        assert set(assistants) == set(['c', 'f'])
+        c = assistants['c'].get_full_assistant()
+        c.assert_fully_loaded()
+        assert c._run == [{'cl': 'ls foo/bar'}]
+        assert YamlSnippetLoader.get_snippet_by_name('snippet1').name == 'snippet1'
+        spec_cache = ArgparseGenerator._get_spec_cache()
+        assert spec_cache.get('crt', YamlAssistantLoader.get_cached_role('crt')[1]) is not None
+
+    def test_bundle_of_different_load_path_is_not_used(self, monkeypatch):
+        monkeypatch.setattr(settings, 'DATA_DIRECTORIES', settings.DATA_DIRECTORIES + ['/foo'])
+        assert bundle.Bundle.get_default() is None
+
+    def test_bundle_is_not_used_without_cache(self, monkeypatch):
+        monkeypatch.setattr(settings, 'USE_CACHE', False)
+        assert bundle.Bundle.get_default() is None
+
+    def test_corrupted_bundle_is_not_used(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'foo')
+        assert bundle.Bundle.get_default() is None
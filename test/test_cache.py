@@ -3,14 +3,20 @@ import shutil
 import time
 
 import pytest
+import six
 import yaml
+from flexmock import flexmock
 
 import devassistant
 
-from devassistant.cache import Cache
+from devassistant.cache import Cache, LayeredCache, ParserSpecCache, SnippetIndex, \
+    CACHE_MAGIC, merge_hierarchies
 from devassistant.exceptions import YamlTypeError
+from devassistant import lang
 from devassistant import settings
+from devassistant.yaml_loader import YamlLoader
 from devassistant.yaml_assistant_loader import YamlAssistantLoader
+from devassistant.yaml_snippet_loader import YamlSnippetLoader
 
 from test.logger import TestLoggingHandler
 
@@ -24,6 +30,7 @@ correct_cache = \
                              'fullname': 'C Language Tool'},
                    'snippets': {},
                    'ctime': 'dontcheck',
+                   'schema': 1,
                    'source': 'test/fixtures/assistants/crt/c.yaml',
                    'subhierarchy': {'d': {'attrs': {'args': {'name': {'flags': ['-n',
                                                                                 '--name'],
@@ -36,6 +43,7 @@ correct_cache = \
                                                     'fullname': 'D Language Tool'},
                                           'snippets': {'snippet1': 'dontcheck'},
                                           'ctime': 'dontcheck',
+                                          'schema': 1,
                                           'source': 'test/fixtures/assistants/crt/c/d.yaml',
                                           'subhierarchy': {}},
                                     'e': {'attrs': {'args': {'name': {'flags': ['-n',
@@ -44,6 +52,7 @@ correct_cache = \
                                                     'fullname': 'E Language Tool'},
                                           'snippets': {},
                                           'ctime': 'dontcheck',
+                                          'schema': 1,
                                           'source': 'test/fixtures/assistants/crt/c/e.yaml',
                                           'subhierarchy': {}}}},
              'f': {'attrs': {'args': {'name': {'flags': ['-n', '--name'],
@@ -51,6 +60,7 @@ correct_cache = \
                              'fullname': 'F Language Tool'},
                    'snippets': {},
                    'ctime': 'dontcheck',
+                   'schema': 1,
                    'source': 'test/fixtures/assistants/crt/f.yaml',
                    'subhierarchy': {'g': {'attrs': {'args': {'name': {'flags': ['-n',
                                                                                 '--name'],
@@ -59,6 +69,7 @@ correct_cache = \
                                                     'fullname': 'G Language Tool'},
                                           'snippets': {},
                                           'ctime': 'dontcheck',
+                                          'schema': 1,
                                           'source': 'test/fixtures/assistants/crt/f/g.yaml',
                                           'subhierarchy': {}}}}},
  'twk': {},
@@ -87,6 +98,7 @@ class TestCache(object):
             dirs =[os.path.join(d, assistants, role) for d in settings.DATA_DIRECTORIES]
             fh = YamlAssistantLoader.get_assistants_file_hierarchy(dirs)
             self.cch.refresh_role(role, fh)
+        self.cch.flush()
 
     def create_fake_cache(self, struct):
         f = open(self.cch.cache_file, 'w')
@@ -104,8 +116,9 @@ class TestCache(object):
     def touch_file(self, path):
         os.utime(self.datafile_path(path), None)
 
-    def assert_cache_newer(self, path):
-        assert os.path.getctime(self.cch.cache_file) >= os.path.getctime(self.datafile_path(path))
+    def assert_cache_newer(self, path, role='crt'):
+        assert os.path.getctime(self.cch._role_file(role)) >= \
+            os.path.getctime(self.datafile_path(path))
 
     def assert_cache_content(self, expected, actual):
         assert len(expected) == len(actual)
@@ -125,6 +138,12 @@ class TestCache(object):
         self.create_or_refresh_cache()
         self.assert_cache_content(correct_cache, self.cch.cache)
 
+    def test_cache_with_parallel_loading(self, monkeypatch):
+        monkeypatch.setattr(settings, 'LOAD_WORKERS', 2)
+        monkeypatch.setattr(devassistant.yaml_loader, 'PARALLEL_MIN_FILES', 0)
+        self.create_or_refresh_cache()
+        self.assert_cache_content(correct_cache, self.cch.cache)
+
     def test_cache_refreshes_if_assistant_touched(self):
         self.create_or_refresh_cache()
         time.sleep(0.1)
@@ -139,6 +158,7 @@ class TestCache(object):
         time.sleep(0.1)
 
         self.cch.snip_ctimes = {}
+        YamlSnippetLoader._index = None
         p = 'snippets/snippet1.yaml'
         self.touch_file(p)
         self.create_or_refresh_cache()
@@ -157,6 +177,8 @@ class TestCache(object):
         # add new assistant and test that everything is fine
         self.addme_copy('addme.yaml', 'assistants/crt/addme.yaml')
         self.addme_copy('addme_snippet.yaml', 'snippets/addme_snippet.yaml')
+        # snippet files are listed once per invocation => reset snippet index manually
+        YamlSnippetLoader._index = None
         self.create_or_refresh_cache()
         addme = self.cch.cache['crt']['addme']
         assert 'addme_snippet' in addme['snippets']
@@ -176,7 +198,8 @@ class TestCache(object):
         # TODO: fix this ^^
         time.sleep(0.1)
         self.addme_copy('addme_snippet_changed.yaml', 'snippets/addme_snippet.yaml')
-        from devassistant import yaml_snippet_loader; yaml_snippet_loader.YamlSnippetLoader._snippets = {}
+        YamlSnippetLoader._snippets = {}
+        YamlSnippetLoader._index = None
         self.cch.snip_ctimes = {}
         self.create_or_refresh_cache()
         addme = self.cch.cache['crt']['addme']
@@ -194,12 +217,228 @@ class TestCache(object):
         self.create_or_refresh_cache()
         assert 'addme' not in self.cch.cache['crt']
 
-    def test_cache_deletes_if_different_version(self):
-        self.create_fake_cache({'version': '0.0.0'})
-        prev_time = os.path.getctime(self.cch.cache_file)
+    def test_cache_only_rewrites_changed_roles(self):
+        self.create_or_refresh_cache()
+        # only roles that have some assistants are written
+        created = dict((f, os.path.getctime(f)) for f in
+                       [self.cf] + [self.cch._role_file(r) for r in settings.ASSISTANT_ROLES]
+                       if os.path.exists(f))
+        assert self.cch._role_file('crt') in created
         time.sleep(0.1)
-        Cache()
-        assert prev_time < os.path.getctime(self.cch.cache_file)
+
+        self.touch_file('assistants/crt/c.yaml')
+        self.create_or_refresh_cache()
+        for f, ctime in created.items():
+            if f == self.cch._role_file('crt'):
+                assert os.path.getctime(f) > ctime
+            else:
+                assert os.path.getctime(f) == ctime
+        self.assert_cache_content(correct_cache['crt'], Cache().cache['crt'])
+
+    def test_refresh_role_writes_only_on_flush(self):
+        dirs = [os.path.join(d, 'assistants', 'crt') for d in settings.DATA_DIRECTORIES]
+        fh = YamlAssistantLoader.get_assistants_file_hierarchy(dirs)
+        flexmock(devassistant.cache).should_receive('write_atomically').never()
+        self.cch.refresh_role('crt', fh)
+        assert not os.path.exists(self.cch._role_file('crt'))
+
+    def test_flush_writes_atomically(self):
+        self.create_or_refresh_cache()
+        # no temporary files are left behind
+        cache_dir = os.path.dirname(self.cf)
+        assert not [f for f in os.listdir(cache_dir) if '.tmp' in f]
+
+        # if writing fails, the original file stays intact
+        with open(self.cch._role_file('crt'), 'rb') as f:
+            original = f.read()
+        self.cch._dirty_roles.add('crt')
+        flexmock(devassistant.cache).should_receive('dump_binary').and_raise(IOError)
+        with pytest.raises(IOError):
+            self.cch.flush()
+        with open(self.cch._role_file('crt'), 'rb') as f:
+            assert f.read() == original
+        assert not [f for f in os.listdir(cache_dir) if '.tmp' in f]
+
+    @pytest.mark.parametrize('umask', [0o022, 0o077])
+    def test_written_files_respect_umask(self, tmpdir, umask):
+        path = tmpdir.join('foo').strpath
+        old_umask = os.umask(umask)
+        try:
+            devassistant.cache.write_atomically(path, lambda f: f.write(b'foo'))
+        finally:
+            os.umask(old_umask)
+        assert os.stat(path).st_mode & 0o777 == 0o666 & ~umask
+        assert os.listdir(tmpdir.strpath) == ['foo']
+
+    def test_cache_stores_bodies(self):
+        self.create_or_refresh_cache()
+        source = self.datafile_path('assistants/crt/c.yaml')
+        ctime = self.cch.cache['crt']['c']['ctime']
+        cch = Cache()
+        assert cch.get_body('crt', source, ctime) == YamlLoader.load_yaml_by_path(source)
+        # args in bodies are not expanded
+        d_body = cch.get_body('crt', self.datafile_path('assistants/crt/c/d.yaml'),
+                              cch.cache['crt']['c']['subhierarchy']['d']['ctime'])
+        assert d_body['args']['some_arg'] == {'use': 'snippet1'}
+        # sections are stored lowered
+        assert d_body['run']._run_ops is not None
+        assert cch.get_body('crt', source, ctime - 1) is None
+
+        # touched assistant gets its body replaced, others are kept
+        time.sleep(0.1)
+        self.touch_file('assistants/crt/c.yaml')
+        self.create_or_refresh_cache()
+        new_ctime = self.cch.cache['crt']['c']['ctime']
+        cch = Cache()
+        assert cch.get_body('crt', source, ctime) is None
+        assert cch.get_body('crt', source, new_ctime) == YamlLoader.load_yaml_by_path(source)
+        assert cch.get_body('crt', self.datafile_path('assistants/crt/f.yaml'),
+                            cch.cache['crt']['f']['ctime']) is not None
+
+    def test_body_that_cant_be_unpickled_is_not_used(self):
+        self.create_or_refresh_cache()
+        cached_c = self.cch.cache['crt']['c']
+        cch = Cache()
+        # e.g. pickled class of a lowered section doesn't exist anymore
+        flexmock(devassistant.cache.pickle).should_receive('loads').\
+            and_raise(AttributeError('no attribute IfOp'))
+        assert cch.get_body('crt', cached_c['source'], cached_c['ctime']) is None
+
+    def test_bodies_of_other_ir_version_are_rebuilt(self, monkeypatch):
+        self.create_or_refresh_cache()
+        source = self.datafile_path('assistants/crt/c.yaml')
+        monkeypatch.setattr(lang, 'IR_VERSION', lang.IR_VERSION + 1)
+        self.cch = Cache()
+        ctime = self.cch.cache['crt']['c']['ctime']
+        assert self.cch.get_body('crt', source, ctime) is None
+        assert self.cch.verify_role('crt', YamlAssistantLoader.get_assistants_file_hierarchy(
+            [self.datafile_path('assistants/crt')]))
+        self.create_or_refresh_cache()
+        cch = Cache()
+        assert cch.get_body('crt', source, ctime) == YamlLoader.load_yaml_by_path(source)
+        assert cch.cache['crt']['c']['ctime'] == ctime
+
+    def test_bodies_are_not_stored_if_disabled(self, monkeypatch):
+        monkeypatch.setattr(settings, 'CACHE_BODIES', False)
+        self.cch = Cache()
+        self.create_or_refresh_cache()
+        assert not os.path.exists(self.cch._body_file('crt'))
+        assert self.cch.get_body('crt', self.cch.cache['crt']['c']['source'],
+                                 self.cch.cache['crt']['c']['ctime']) is None
+
+    def test_cache_uses_stat_info_from_file_hierarchy(self):
+        self.create_or_refresh_cache()
+        cached_c = self.cch.cache['crt']['c']
+        file_c = {'source': cached_c['source'],
+                  'ctime_ns': cached_c['ctime'],
+                  'subhierarchy': dict((k, {}) for k in cached_c['subhierarchy'])}
+        # stat information from file hierarchy are used, no need to stat the file again
+        flexmock(os).should_receive('stat').never()
+        assert not self.cch._ass_needs_refresh(cached_c, file_c)
+        file_c['ctime_ns'] += 1
+        assert self.cch._ass_needs_refresh(cached_c, file_c)
+
+    def test_fingerprint_changes_with_cached_assistants(self):
+        self.create_or_refresh_cache()
+        fingerprint = self.cch.fingerprint('crt')
+        self.create_or_refresh_cache()
+        assert self.cch.fingerprint('crt') == fingerprint
+        assert self.cch.fingerprint('twk') != fingerprint
+
+        time.sleep(0.1)
+        self.addme_copy('addme_change_snippet.yaml', 'assistants/crt/addme.yaml')
+        self.create_or_refresh_cache()
+        assert self.cch.fingerprint('crt') != fingerprint
+
+    def test_parser_spec_cache(self):
+        psc = ParserSpecCache(settings.PARSER_CACHE_FILE)
+        self.remove_files.add(settings.PARSER_CACHE_FILE)
+        psc.set('crt', 'abc', [{'name': 'c'}])
+        psc.write()
+        psc = ParserSpecCache(settings.PARSER_CACHE_FILE)
+        assert psc.get('crt', 'abc') == [{'name': 'c'}]
+        assert psc.get('crt', 'def') is None
+        assert psc.get('twk', 'abc') is None
+
+    def test_cache_keeps_assistants_if_different_version(self, monkeypatch):
+        self.create_or_refresh_cache()
+        monkeypatch.setattr(devassistant, '__version__', '0.0.0')
+        cch = Cache()
+        assert cch.cache['version'] == '0.0.0'
+        self.assert_cache_content(correct_cache['crt'], cch.cache['crt'])
+        self.cch = cch
+        assert not self.cch.refresh_role('crt', YamlAssistantLoader.
+            get_assistants_file_hierarchy([self.datafile_path('assistants/crt')]))
+
+    def test_cache_migrates_assistants(self, monkeypatch):
+        self.create_or_refresh_cache()
+        crt_ctime = os.path.getctime(self.cch._role_file('crt'))
+        time.sleep(0.1)
+        migrated = []
+
+        def migrate(cached_ass):
+            migrated.append(cached_ass['source'])
+            return dict(cached_ass, migrated=True)
+        monkeypatch.setattr(devassistant.cache, 'ASSISTANT_SCHEMA', 2)
+        monkeypatch.setitem(devassistant.cache.ASSISTANT_MIGRATIONS, 1, migrate)
+        cch = Cache()
+        assert len(migrated) == 5
+        assert cch.cache['crt']['c']['schema'] == 2
+        assert cch.cache['crt']['c']['subhierarchy']['d']['migrated']
+        # migrated roles are written on flush
+        cch.flush()
+        assert os.path.getctime(self.cch._role_file('crt')) > crt_ctime
+        assert Cache().cache['crt']['c']['migrated']
+        assert len(migrated) == 5
+
+    def test_cache_refreshes_assistants_that_cant_be_migrated(self, monkeypatch):
+        self.create_or_refresh_cache()
+        monkeypatch.setattr(devassistant.cache, 'ASSISTANT_SCHEMA', 2)
+        self.cch = Cache()
+        fh = YamlAssistantLoader.get_assistants_file_hierarchy(
+            [self.datafile_path('assistants/crt')])
+        assert ('crt/c', 'cached with incompatible schema 1') in self.cch.verify_role('crt', fh)
+        assert self.cch.refresh_role('crt', fh)
+        assert self.cch.cache['crt']['c']['schema'] == 2
+        assert self.cch.verify_role('crt', fh) == []
+
+    def test_cache_keeps_unversioned_assistants(self):
+        # cache written before assistants were versioned: no schema, ctimes in float seconds
+        self.cch.cache_format = 'yaml'
+        self.create_or_refresh_cache()
+        loaded = yaml.load(open(self.cch.cache_file), Loader=yaml.Loader)
+
+        def unversion(hierarchy):
+            for ass in hierarchy.values():
+                del ass['schema']
+                if ass['source'] is not None:
+                    ass['ctime'] = os.path.getctime(ass['source'])
+                ass['snippets'] = dict((name, os.path.getctime(
+                    YamlSnippetLoader.get_snippet_by_name(name).path))
+                    for name in ass['snippets'])
+                unversion(ass['subhierarchy'])
+        unversion(loaded['crt'])
+        assert loaded['crt']['c']['subhierarchy']['d']['snippets']
+        self.create_fake_cache(loaded)
+        self.cch = Cache(cache_format='yaml')
+        fh = YamlAssistantLoader.get_assistants_file_hierarchy(
+            [self.datafile_path('assistants/crt')])
+        assert self.cch.verify_role('crt', fh) == []
+        assert not self.cch.refresh_role('crt', fh)
+
+    def test_verify_role(self):
+        self.create_or_refresh_cache()
+        fh = YamlAssistantLoader.get_assistants_file_hierarchy(
+            [self.datafile_path('assistants/crt')])
+        assert self.cch.verify_role('crt', fh) == []
+        time.sleep(0.1)
+        self.touch_file('assistants/crt/c/d.yaml')
+        self.addme_copy('assistants/crt/f/g.yaml', 'assistants/crt/f/h.yaml')
+        fh = YamlAssistantLoader.get_assistants_file_hierarchy(
+            [self.datafile_path('assistants/crt')])
+        assert self.cch.verify_role('crt', fh) == [('crt/c/d', 'source file modified'),
+                                                   ('crt/f', 'subassistants changed'),
+                                                   ('crt/f/h', 'not cached')]
 
     def test_cache_stays_if_same_version(self):
         self.create_fake_cache({'version': devassistant.__version__})
@@ -208,6 +447,60 @@ class TestCache(object):
         Cache()
         assert prev_time == os.path.getctime(self.cch.cache_file)
 
+    def test_cache_is_binary_by_default(self):
+        self.create_or_refresh_cache()
+        with open(self.cch.cache_file, 'rb') as f:
+            assert f.read(len(CACHE_MAGIC)) == CACHE_MAGIC
+        self.assert_cache_content(correct_cache['crt'], Cache().cache['crt'])
+
+    def test_cache_deletes_if_different_schema(self, monkeypatch):
+        self.create_or_refresh_cache()
+        monkeypatch.setattr(devassistant.cache, 'CACHE_SCHEMA', 0)
+        assert Cache().cache == {'version': devassistant.__version__}
+
+    def test_yaml_cache_format(self):
+        self.cch.cache_format = 'yaml'
+        self.create_or_refresh_cache()
+        loaded = yaml.load(open(self.cch.cache_file), Loader=yaml.Loader)
+        self.assert_cache_content(correct_cache['crt'], loaded['crt'])
+        # yaml cache is still readable, even if binary format is configured
+        self.assert_cache_content(correct_cache['crt'],
+                                  Cache(cache_format='binary').cache['crt'])
+
+    def test_dump_yaml(self):
+        self.create_or_refresh_cache()
+        out = six.StringIO()
+        self.cch.dump_yaml(out)
+        self.assert_cache_content(correct_cache, yaml.load(out.getvalue(), Loader=yaml.Loader))
+
+    def test_stats_count_cache_events(self, monkeypatch):
+        monkeypatch.setattr(devassistant.cache, 'stats', devassistant.cache.CacheStats())
+        stats = devassistant.cache.stats
+        self.create_or_refresh_cache(roles=['crt'])
+        assert stats.values['misses'] == 5
+        assert stats.values['hits'] == stats.values['refreshes'] == 0
+        assert stats.values['snippet_ctime_lookups'] == 1
+
+        stats.reset()
+        self.touch_file('assistants/crt/c.yaml')
+        self.create_or_refresh_cache(roles=['crt'])
+        assert stats.values['refreshes'] == 1
+        assert stats.values['hits'] == 4
+        assert stats.values['misses'] == 0
+
+    def test_stats_log_record(self):
+        stats = devassistant.cache.CacheStats()
+        flexmock(devassistant.cache.logger).should_receive('debug').never()
+        stats.log_record()
+
+        stats.incr('hits', 2)
+        stats.fallback('crt: foo')
+        expected = dict((c, 0) for c in stats.counters)
+        expected.update(hits=2, fallbacks=1, fallback_reasons=['crt: foo'])
+        flexmock(devassistant.cache.logger).should_receive('debug').once().with_args(
+            str, extra={'event_type': 'cache_stats', 'cache_stats': expected})
+        stats.log_record()
+
     def test_cache_doesnt_log_higher_than_debug(self):
         # make sure that there's an assistant with an error
         with pytest.raises(YamlTypeError):
@@ -215,3 +508,175 @@ class TestCache(object):
         # make sure that there are only DEBUG messages logged
         for msg in self.tlh.msgs:
             assert msg[0] == 'DEBUG'
+
+
+class TestLayeredCache(object):
+    def create_dirs(self, tmpdir):
+        """Creates two assistant directories, user/ and system/, that look like this:
+        user/crt/a.yaml, user/crt/b/x.yaml, system/crt/a.yaml, system/crt/a/z.yaml,
+        system/crt/b.yaml, system/crt/b/y.yaml; returns their paths"""
+        user = tmpdir.mkdir('user')
+        user.mkdir('crt').join('a.yaml').write('fullname: user a')
+        user.join('crt').mkdir('b').join('x.yaml').write('fullname: x')
+        system = tmpdir.mkdir('system')
+        system.mkdir('crt').join('a.yaml').write('fullname: system a')
+        system.join('crt').mkdir('a').join('z.yaml').write('fullname: z')
+        system.join('crt', 'b.yaml').write('fullname: b')
+        system.join('crt').mkdir('b').join('y.yaml').write('fullname: y')
+        return user.strpath, system.strpath
+
+    def refresh(self, cch, dirs):
+        layers = [(d, YamlAssistantLoader.get_assistants_file_hierarchy(
+            [os.path.join(d, 'crt')], orphans=True)) for d in dirs]
+        cch.refresh_role('crt', layers)
+        return cch.cache['crt']
+
+    def test_merge_hierarchies(self):
+        first = {'a': {'source': '1/a.yaml', 'subhierarchy': {}},
+                 'b': {'source': None, 'subhierarchy': {'x': {'source': '1/b/x.yaml',
+                                                              'subhierarchy': {}}}},
+                 'c': {'source': None, 'subhierarchy': {}}}
+        second = {'a': {'source': '2/a.yaml', 'subhierarchy': {'z': {'source': '2/a/z.yaml',
+                                                                     'subhierarchy': {}}}},
+                  'b': {'source': '2/b.yaml', 'subhierarchy': {}}}
+        merged = merge_hierarchies([first, second])
+        assert set(merged) == set(['a', 'b'])
+        assert merged['a']['source'] == '1/a.yaml'
+        assert list(merged['a']['subhierarchy']) == ['z']
+        assert merged['b']['source'] == '2/b.yaml'
+        assert list(merged['b']['subhierarchy']) == ['x']
+        # given hierarchies are not modified
+        assert first['a']['subhierarchy'] == {}
+
+    def test_layers_are_same_as_single_cache(self, tmpdir):
+        dirs = self.create_dirs(tmpdir)
+        cached = self.refresh(LayeredCache(tmpdir.join('layers').strpath), dirs)
+        single = Cache(tmpdir.join('single').strpath)
+        single.refresh_role('crt', YamlAssistantLoader.get_assistants_file_hierarchy(
+            [os.path.join(d, 'crt') for d in dirs]))
+        assert cached == single.cache['crt']
+        assert cached['a']['attrs']['fullname'] == 'user a'
+        assert set(cached['a']['subhierarchy']) == set(['z'])
+        assert set(cached['b']['subhierarchy']) == set(['x', 'y'])
+
+    def test_system_layer_is_used_if_up_to_date(self, tmpdir):
+        user, system = self.create_dirs(tmpdir)
+        layers_dir = tmpdir.join('layers')
+        system_layer = Cache(LayeredCache.system_layer_file(system))
+        system_layer.refresh_role('crt', YamlAssistantLoader.get_assistants_file_hierarchy(
+            [os.path.join(system, 'crt')], orphans=True))
+        system_layer.flush(roles=settings.ASSISTANT_ROLES)
+
+        cch = LayeredCache(layers_dir.strpath)
+        cached = self.refresh(cch, [user, system])
+        cch.flush()
+        assert cached['b']['attrs']['fullname'] == 'b'
+        # only user's directory gets a layer
+        assert os.path.exists(cch.user_layer_file(user))
+        assert not os.path.exists(cch.user_layer_file(system))
+
+        # system layer gets outdated => user's layer is created for system directory
+        time.sleep(0.1)
+        os.utime(os.path.join(system, 'crt', 'b.yaml'), None)
+        system_mtime = os.path.getmtime(LayeredCache.system_layer_file(system) + '.crt')
+        cch = LayeredCache(layers_dir.strpath)
+        refreshed = self.refresh(cch, [user, system])
+        assert refreshed['b']['ctime'] > cached['b']['ctime']
+        cch.flush()
+        assert os.path.exists(cch.user_layer_file(system))
+        assert system_mtime == os.path.getmtime(LayeredCache.system_layer_file(system) + '.crt')
+        assert self.refresh(LayeredCache(layers_dir.strpath), [user, system]) == refreshed
+        # bodies of assistants that haven't changed are copied from system layer
+        cch = LayeredCache(layers_dir.strpath)
+        self.refresh(cch, [user, system])
+        y = os.path.join(system, 'crt', 'b', 'y.yaml')
+        assert cch.get_body('crt', y, refreshed['b']['subhierarchy']['y']['ctime']) == \
+            {'fullname': 'y'}
+        assert cch._user_layers[system].get_body('crt', y,
+            refreshed['b']['subhierarchy']['y']['ctime']) == {'fullname': 'y'}
+
+    def test_no_layer_for_directories_without_assistants(self, tmpdir):
+        cch = LayeredCache(tmpdir.join('layers').strpath)
+        assert self.refresh(cch, [tmpdir.join('nonexistent').strpath]) == {}
+        cch.flush()
+        assert not tmpdir.join('layers').check()
+
+
+class TestSnippetIndex(object):
+    def create_dirs(self, tmpdir):
+        first = tmpdir.mkdir('first')
+        first.join('common.yaml').write('args: {foo: {flags: [-f]}}')
+        first.join('broken.yaml').write('args: [')
+        second = tmpdir.mkdir('second')
+        second.join('common.yaml').write('args: {foo: {flags: [-x]}}')
+        second.join('broken.yaml').write('args: {bar: {flags: [-b]}}')
+        second.mkdir('sub').join('snip.yaml').write('run: [ls]')
+        return [first.strpath, second.strpath]
+
+    def test_snippets_are_found_by_dotted_names(self, tmpdir):
+        dirs = self.create_dirs(tmpdir)
+        index = SnippetIndex(dirs, index_file=None)
+        assert set(index.names()) == set(['common', 'broken', 'sub.snip'])
+        common = index.get('common')
+        assert common['path'] == os.path.join(dirs[0], 'common.yaml')
+        assert common['parsed'] == {'args': {'foo': {'flags': ['-f']}}}
+        assert common['ctime_ns'] == os.stat(common['path']).st_ctime_ns
+        assert index.get('sub.snip')['parsed'] == {'run': ['ls']}
+        # unparseable file is skipped in favour of the one from next directory
+        assert index.get('broken')['path'] == os.path.join(dirs[1], 'broken.yaml')
+        assert index.get('nonexistent') is None
+
+    def test_snippets_are_parsed_once(self, tmpdir):
+        dirs = self.create_dirs(tmpdir)
+        index_file = tmpdir.join('index').strpath
+        index = SnippetIndex(dirs, index_file=index_file)
+        index.get('common')
+        index.get('common')
+        index.write()
+
+        flexmock(YamlLoader).should_receive('load_yaml_by_path').never()
+        index = SnippetIndex(dirs, index_file=index_file)
+        assert index.get('common')['parsed'] == {'args': {'foo': {'flags': ['-f']}}}
+        assert not index.changed
+
+    def test_changed_snippets_are_parsed_again(self, tmpdir, monkeypatch):
+        dirs = self.create_dirs(tmpdir)
+        index_file = tmpdir.join('index').strpath
+        index = SnippetIndex(dirs, index_file=index_file)
+        for name in index.names():
+            index.get(name)
+        index.write()
+
+        time.sleep(0.1)
+        tmpdir.join('first', 'common.yaml').write('args: {foo: {flags: [-c]}}')
+        parsed = []
+        load_yaml_by_path = YamlLoader.load_yaml_by_path
+        monkeypatch.setattr(YamlLoader, 'load_yaml_by_path', classmethod(
+            lambda cls, path, log_debug=False: parsed.append(path) or load_yaml_by_path(path)))
+        index = SnippetIndex(dirs, index_file=index_file)
+        assert index.get('common')['parsed'] == {'args': {'foo': {'flags': ['-c']}}}
+        index.get('broken')
+        index.get('sub.snip')
+        # unparseable file is parsed again, so that its error gets reported
+        assert sorted(parsed) == [os.path.join(dirs[0], 'broken.yaml'),
+                                  os.path.join(dirs[0], 'common.yaml')]
+
+    def test_index_of_other_ir_version_is_not_used(self, tmpdir, monkeypatch):
+        dirs = self.create_dirs(tmpdir)
+        index_file = tmpdir.join('index').strpath
+        index = SnippetIndex(dirs, index_file=index_file)
+        index.get('common')
+        index.write()
+        monkeypatch.setattr(lang, 'IR_VERSION', lang.IR_VERSION + 1)
+        index = SnippetIndex(dirs, index_file=index_file)
+        index.get('common')
+        assert index.changed
+
+    def test_index_of_different_dirs_is_not_used(self, tmpdir):
+        dirs = self.create_dirs(tmpdir)
+        index_file = tmpdir.join('index').strpath
+        index = SnippetIndex(dirs, index_file=index_file)
+        index.get('common')
+        index.write()
+        index = SnippetIndex(dirs[1:], index_file=index_file)
+        assert index.get('common')['path'] == os.path.join(dirs[1], 'common.yaml')
@@ -144,6 +144,26 @@ class TestUseCommandRunner(object):
         with pytest.raises(CommandException):
             self.ccr.get_assistant_section('foo', self.ass['leaf'])
 
+    def test_construct_ctxt_doesnt_copy(self):
+        original = {'foo': 'bar', '__files__': [{}], '__assistant__': self.ass['leaf']}
+        ctxt = self.ccr._construct_ctxt('snippet1.run', original)
+        ctxt['foo'] = 'changed'
+        ctxt['__files__'].append({'a': 'b'})
+
+        assert ctxt['__assistant__'] is self.ass['leaf']
+        assert original == {'foo': 'bar', '__files__': [{}],
+                            '__assistant__': self.ass['leaf']}
+
+    def test_construct_ctxt_with_args(self):
+        original = {'foo': 'bar', '__files__': [{}], '__assistant__': self.ass['leaf']}
+        args = {'spam': ['eggs']}
+        ctxt = self.ccr._construct_ctxt({'sect': 'snippet1.run', 'args': args}, original)
+        ctxt['spam'].append('ham')
+
+        assert sorted(ctxt) == ['__assistant__', '__files__', 'spam']
+        assert ctxt['spam'] == ['eggs', 'ham']
+        assert args == {'spam': ['eggs']}
+
     @pytest.mark.parametrize(('cmd', 'assistant', 'expected'), [
                              ('super.foo', 'leaf', 'bar'),
                              ('super.bar', 'leaf', 'baz')])
@@ -550,6 +570,49 @@ class TestLoadCmdCommandRunner(object):
         assert r == (True, 'heee heee')
 
 
+class TestGetCommandRunners(object):
+    def setup_method(self, method):
+        self.old_command_runners = command_runners.command_runners
+        command_runners.command_runners = copy.deepcopy(self.old_command_runners)
+
+    def teardown_method(self, method):
+        command_runners.command_runners = self.old_command_runners
+
+    def test_builtin_runner_matched_once(self):
+        flexmock(LogCommandRunner).should_call('matches').once()
+        for i in range(3):
+            assert command_runners.get_command_runners(Command('log_i', 'foo')) == \
+                [LogCommandRunner]
+
+    def test_registering_invalidates(self):
+        assert command_runners.get_command_runners(Command('log_i', 'foo')) == \
+            [LogCommandRunner]
+
+        class CR(command_runners.CommandRunner):
+            @classmethod
+            def matches(cls, c):
+                return c.input_res == 'foo'
+
+        generation = command_runners.generation
+        command_runners.register_command_runner(CR)
+        assert command_runners.generation == generation + 1
+        # CR doesn't declare that it only matches by command type => it's always asked
+        assert command_runners.get_command_runners(Command('log_i', 'foo')) == \
+            [CR, LogCommandRunner]
+
+    def test_subclass_overriding_matches_is_always_asked(self):
+        class CR(LogCommandRunner):
+            @classmethod
+            def matches(cls, c):
+                return c.input_res == 'foo'
+
+        command_runners.register_command_runner('prefix')(CR)
+        command_runners.register_command_runner('prefix')(LogCommandRunner)
+        assert command_runners.get_command_runners(Command('prefix.log_i', 'foo')) == \
+            [LogCommandRunner]
+        assert command_runners.get_command_runners(Command('prefix.ask_i', 'foo')) == [CR]
+
+
 class TestEnvCommandRunner(object):
     def setup_method(self, method):
         self.kwargs = {'__env__': {'foo': 'bar', 'spam': 'spam'}}
@@ -0,0 +1,90 @@
+import os
+
+import yaml
+
+from devassistant import context
+
+
+class TestEnvOverlay(object):
+    def setup_method(self, method):
+        self.base = {'foo': 'bar', 'spam': 'spam'}
+        self.env = context.EnvOverlay(self.base)
+
+    def test_reads_base(self):
+        assert context.EnvOverlay()['PATH'] == os.environ['PATH']
+        assert dict(self.env) == self.base
+
+    def test_changes_dont_affect_base(self):
+        self.env['foo'] = 'changed'
+        self.env['some'] = 'value'
+        del self.env['spam']
+        assert self.env == {'foo': 'changed', 'some': 'value'}
+        assert 'spam' not in self.env
+        assert self.base == {'foo': 'bar', 'spam': 'spam'}
+
+    def test_copy(self):
+        self.env['foo'] = 'changed'
+        copied = self.env.copy()
+        copied['foo'] = 'again'
+        del copied['spam']
+        assert self.env == {'foo': 'changed', 'spam': 'spam'}
+        assert copied == {'foo': 'again'}
+
+
+class TestScope(object):
+    def setup_method(self, method):
+        self.parent = {'foo': 'bar', 'list': [1], '__env__': context.EnvOverlay({'A': 'a'})}
+        self.scope = context.Scope(self.parent)
+
+    def test_reads_parent(self):
+        assert self.scope['foo'] == 'bar'
+        assert 'foo' in self.scope
+        assert sorted(self.scope) == ['__env__', 'foo', 'list']
+
+    def test_changes_dont_affect_parent(self):
+        self.scope['foo'] = 'changed'
+        self.scope['new'] = 'value'
+        del self.scope['list']
+        assert dict(self.scope) == {'foo': 'changed', 'new': 'value',
+                                    '__env__': self.parent['__env__']}
+        assert sorted(self.parent) == ['__env__', 'foo', 'list']
+        assert self.parent['foo'] == 'bar'
+
+    def test_mutable_values_copied_on_read(self):
+        self.scope['list'].append(2)
+        self.scope['__env__']['A'] = 'changed'
+        assert self.scope['list'] == [1, 2]
+        assert self.scope['__env__']['A'] == 'changed'
+        assert self.parent['list'] == [1]
+        assert self.parent['__env__']['A'] == 'a'
+
+    def test_nested_containers_copied_on_read(self):
+        parent = {'foo': {'a': [1]}, 'lists': [[1], [2]]}
+        scope = context.fork(parent)
+        scope['foo']['a'].append(2)
+        scope['lists'][0].append(3)
+        assert scope['foo'] == {'a': [1, 2]}
+        assert scope['lists'] == [[1, 3], [2]]
+        assert parent == {'foo': {'a': [1]}, 'lists': [[1], [2]]}
+
+    def test_nested_scopes(self):
+        self.scope['foo'] = 'changed'
+        nested = context.fork(self.scope)
+        nested['list'].append(3)
+        assert nested['foo'] == 'changed'
+        assert nested['list'] == [1, 3]
+        # reading through nested scope doesn't copy values into its parent scope
+        assert 'list' not in self.scope.local
+        assert self.scope['list'] == [1]
+
+    def test_snapshot(self):
+        snap = context.snapshot(self.scope)
+        self.scope['list'].append(2)
+        self.scope['foo'] = 'changed'
+        assert snap['list'] == [1]
+        assert snap['foo'] == 'bar'
+
+    def test_yaml_dump(self):
+        self.scope['__env__']['B'] = 'b'
+        assert yaml.safe_load(yaml.dump(self.scope)) == \
+            {'foo': 'bar', 'list': [1], '__env__': {'A': 'a', 'B': 'b'}}
@@ -0,0 +1,135 @@
+import fcntl
+import os
+import socket
+import time
+
+import pytest
+from flexmock import flexmock
+
+from devassistant import daemon_client
+from devassistant.daemon import Daemon
+from devassistant import exceptions
+from devassistant import settings
+from devassistant import utils
+
+pytestmark = pytest.mark.skipif(not daemon_client.is_supported(),
+                                reason='passing file descriptors is not supported')
+
+
+class TestDaemonClient(object):
+    def test_message_roundtrip_with_fds(self):
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        r, w = os.pipe()
+        try:
+            message = {'argv': ['da', 'crt'], 'env': dict(('x' * i, 'y' * 100) for i in range(100))}
+            daemon_client.send_message(a, message, fds=[r, w, w])
+            received, fds = daemon_client.recv_message(b, with_fds=True)
+            assert received == message
+            assert len(fds) == 3
+            os.write(fds[1], b'foo')
+            assert os.read(r, 3) == b'foo'
+            for fd in fds:
+                os.close(fd)
+        finally:
+            os.close(r)
+            os.close(w)
+            a.close()
+            b.close()
+
+    def test_recv_message_returns_none_on_close(self):
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        a.close()
+        assert daemon_client.recv_message(b) is None
+        b.close()
+
+    def test_get_socket_path(self):
+        assert daemon_client.get_socket_path({'DEVASSISTANT_HOME': '/foo'}) == \
+            '/foo/daemon.sock'
+        assert daemon_client.get_socket_path({'DEVASSISTANT_DAEMON_SOCKET': '/bar'}) == '/bar'
+
+    def test_run_in_daemon_without_daemon(self, tmpdir):
+        flexmock(daemon_client).should_receive('get_socket_path').\
+            and_return(str(tmpdir.join('daemon.sock')))
+        assert daemon_client.run_in_daemon(['da', 'crt']) is None
+
+    @pytest.mark.parametrize('argv', [
+        ['da', 'daemon'],
+        ['da', '--debug', 'daemon'],
+        ['da', '--no-cache', '--profile', 'daemon', '--socket', '/foo'],
+    ])
+    def test_daemon_action_runs_locally(self, argv):
+        flexmock(socket.socket).should_receive('connect').never()
+        assert daemon_client.run_in_daemon(argv) is None
+
+    @pytest.mark.parametrize(('argv', 'name'), [
+        (['da'], None),
+        (['da', '-h'], None),
+        (['da', '--debug', 'crt', 'python', '-n', 'foo'], 'crt'),
+    ])
+    def test_get_action_name(self, argv, name):
+        assert daemon_client.get_action_name(argv) == name
+
+
+class TestDaemon(object):
+    def test_settings_env(self):
+        env = {'HOME': '/home/foo', 'DEVASSISTANT_PATH': '/foo', 'PATH': '/bin'}
+        assert Daemon._settings_env(env) == {'HOME': '/home/foo', 'DEVASSISTANT_PATH': '/foo'}
+
+    def take_fingerprint(self, taken_later=False):
+        # fingerprint taken long after the last change doesn't need to be checked by listing
+        #  directories (see Daemon.load_paths_changed)
+        Daemon.fingerprint_time = time.time() + (10 if taken_later else 0)
+        Daemon.fingerprint = Daemon.get_load_paths_fingerprint()
+
+    @pytest.mark.parametrize('taken_later', [False, True])
+    def test_load_paths_changed(self, tmpdir, taken_later):
+        flexmock(settings, DATA_DIRECTORIES=[str(tmpdir)])
+        flexmock(Daemon, fingerprint=None, fingerprint_time=0)
+        crt = tmpdir.mkdir('assistants').mkdir('crt')
+        crt.join('foo.yaml').write('fullname: Foo')
+        assert Daemon.load_paths_changed()
+        self.take_fingerprint(taken_later)
+        assert not Daemon.load_paths_changed()
+
+        crt.join('foo.yaml').write('fullname: Foo Bar')
+        assert Daemon.load_paths_changed()
+        self.take_fingerprint(taken_later)
+
+        # make sure that adding the file is visible on ctime of the directory
+        time.sleep(0.05)
+        crt.join('bar.yaml').write('')
+        assert Daemon.load_paths_changed()
+        self.take_fingerprint(taken_later)
+
+        tmpdir.mkdir('snippets')
+        assert Daemon.load_paths_changed()
+
+    def test_load_paths_changed_doesnt_list_directories(self, tmpdir):
+        flexmock(settings, DATA_DIRECTORIES=[str(tmpdir)])
+        flexmock(Daemon, fingerprint=None, fingerprint_time=0)
+        tmpdir.mkdir('assistants').mkdir('crt').join('foo.yaml').write('fullname: Foo')
+        self.take_fingerprint(taken_later=True)
+        flexmock(utils).should_receive('scan_dir').never()
+        assert not Daemon.load_paths_changed()
+
+    def test_acquire_terminal_without_terminal(self):
+        flexmock(os).should_receive('isatty').and_return(False)
+        flexmock(fcntl).should_receive('ioctl').never()
+        assert Daemon.acquire_terminal()
+
+    def test_acquire_terminal_of_other_session(self):
+        flexmock(os).should_receive('isatty').and_return(True)
+        flexmock(fcntl).should_receive('ioctl').and_raise(OSError(1, 'Operation not permitted'))
+        assert not Daemon.acquire_terminal()
+
+    def test_bind_refuses_running_daemon(self, tmpdir):
+        path = str(tmpdir.join('daemon.sock'))
+        sock = Daemon.bind(path)
+        try:
+            assert oct(os.stat(path).st_mode & 0o777) == oct(0o600)
+            with pytest.raises(exceptions.ExecutionException):
+                Daemon.bind(path)
+        finally:
+            sock.close()
+        # stale socket gets replaced
+        Daemon.bind(path).close()
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# "-X importtime" is only available since Python 3.7
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason='needs python -X importtime')
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that take long to import and are only needed by some commands/actions
+HEAVY_MODULES = ['dapp', 'docker', 'github', 'jinja2', 'requests']
+
+# cumulative import time budgets of entry points (in microseconds); slow machines can
+#  scale them by DEVASSISTANT_IMPORT_BUDGET_FACTOR
+BUDGETS = {
+    # "da" binary, only imports the rest of DevAssistant if daemon isn't running
+    'devassistant.daemon_client': 30000,
+    'devassistant.cli.cli_runner': 120000,
+}
+
+
+def import_times(module):
+    """Imports given module in a fresh interpreter with "-X importtime" and returns dict
+    mapping names of all imported modules to their cumulative import times."""
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=package_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    _, err = proc.communicate()
+    assert proc.returncode == 0, err
+    times = {}
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_heavy_modules_are_not_imported(module):
+    imported = import_times(module)
+    assert [m for m in HEAVY_MODULES if m in imported] == []
+
+
+def test_daemon_client_only_imports_standard_library():
+    imported = import_times('devassistant.daemon_client')
+    assert sorted(m for m in imported if m.startswith('devassistant')) == \
+        ['devassistant', 'devassistant.daemon_client']
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_import_time_budget(module):
+    budget = BUDGETS[module] * float(os.environ.get('DEVASSISTANT_IMPORT_BUDGET_FACTOR', 1))
+    # the first run warms up filesystem caches, take the best of the others
+    import_times(module)
+    best = min(import_times(module)[module] for i in range(3))
+    assert best <= budget, \
+        'importing {0} took {1} us, budget is {2} us'.format(module, best, int(budget))
@@ -1,6 +1,17 @@
+import collections
+import copy
 import pytest
 import os
 import re
+import threading
+
+from flexmock import flexmock
+from six.moves import cPickle as pickle
+
+from devassistant import command_runners
+from devassistant import lang
+from devassistant.logger import logger
+from devassistant import settings
 
 from devassistant.exceptions import YamlSyntaxError
 from devassistant.lang import Command, evaluate_expression, exceptions, \
@@ -145,6 +156,17 @@ class TestEvaluate(object):
         assert evaluate_expression('"$empty"', self.names) == (False, "")
         assert evaluate_expression('"$true"', self.names) == (True, "True")
 
+    @pytest.mark.parametrize(('expr', 'result'), [
+        ('"$foobar $foo"', (True, 'long short')),
+        ('"$foobaz"', (True, 'shortbaz')),
+        ('"${foo}bar"', (True, 'shortbar')),
+        ('"${fo} $fo $$foo"', (True, '${fo} $fo $short')),
+        ('"$chained"', (True, '$foo')),
+    ])
+    def test_literal_substitution_longest_name_wins(self, expr, result):
+        names = {'foo': 'short', 'foobar': 'long', 'chained': '$foo'}
+        assert evaluate_expression(expr, names) == result
+
     def test_complex_expression(self):
         assert evaluate_expression('defined $empty or $empty and \
                                     $(echo -e foo bar "and also baz") or "else $nonempty"',
@@ -177,7 +199,101 @@ class TestEvaluate(object):
         assert res == (True, 'foo')
 
 
+    @pytest.mark.parametrize('expr, result', [
+        ('$nonempty or $(echo spam)', (True, 'foo')),
+        ('$empty and $(echo spam)', (False, '')),
+        ('$false and $(echo spam) or $nonempty', (True, 'foo')),
+        ('defined $nonempty or $(echo spam)', (True, 'foo')),
+    ])
+    def test_short_circuit(self, expr, result):
+        flexmock(Command).should_receive('run').never()
+        assert evaluate_expression(expr, self.names) == result
+
+    def test_short_circuit_of_logical_result(self):
+        flexmock(Command).should_receive('run').never()
+        assert evaluate_expression('$true or $(echo spam)', self.names, need_result=False)[0]
+        assert not evaluate_expression('not $nonempty and $(echo spam)', self.names,
+                                       need_result=False)[0]
+
+    def test_right_side_is_evaluated_if_result_is_needed(self):
+        assert evaluate_expression('$true or $(echo spam)', self.names) == (True, 'spam')
+        assert evaluate_expression('not $nonempty and $(echo spam)', self.names) == \
+            (False, 'spam')
+
+    def test_expression_is_parsed_once(self, monkeypatch):
+        monkeypatch.setattr(lang, '_compiled_expressions', collections.OrderedDict())
+        flexmock(lang.Interpreter).should_call('parse').once()
+        for value in ['foo', '']:
+            assert evaluate_expression('$x or "default"', {'x': value}) == \
+                (True, value or 'default')
+
+    def test_compiled_expressions_are_evicted(self, monkeypatch):
+        monkeypatch.setattr(lang, '_compiled_expressions', collections.OrderedDict())
+        monkeypatch.setattr(settings, 'EXPRESSION_CACHE_SIZE', 2)
+        for expr in ['$a', '$b', '$a', '$c']:
+            evaluate_expression(expr, {})
+        assert list(lang._compiled_expressions) == ['$a', '$c']
+
+    def test_syntax_error_is_raised_on_every_evaluation(self):
+        for i in range(2):
+            with pytest.raises(SyntaxError):
+                evaluate_expression('foo', {})
+
+
+class TestLowering(object):
+    def test_lower_run_section(self):
+        section = [{'if $x': [{'log_i': 'x'}]}, {'else': [{'log_i': 'y'}]},
+                   {'for $i in $l': [{'$y': '$i'}]}, {'log_i': 'z'}, {'else': []}]
+        ops = lang.Section(section).run_ops
+        assert [type(op) for op in ops] == \
+            [lang.IfOp, lang.ElseOp, lang.ForOp, lang.CommandOp, lang.ElseOp]
+        assert ops[0].condition == '$x'
+        assert ops[0].else_body == [{'log_i': 'y'}]
+        assert ops[1].skip and not ops[4].skip
+        assert (ops[2].control_vars, ops[2].iter_type, ops[2].expression) == (['i'], 'in', '$l')
+        assert isinstance(ops[2].body.run_ops[0], lang.AssignOp)
+
+    def test_lower_dependencies_section(self):
+        section = [{'rpm': ['foo']}, {'use': 'snippet.dependencies'}, {'foo': ['bar']},
+                   {'if $x': [{'rpm': ['bar']}]}]
+        assert [type(op) for op in lang.Section(section).dependencies_ops] == \
+            [lang.DependenciesOp, lang.UseDependenciesOp, lang.UnknownDependenciesOp,
+             lang.IfOp]
+
+    def test_malformed_for_fails_when_executed(self):
+        section = lang.Section([{'if $x': [{'for foo': []}]}])
+        assert run_section(section, {}) == (False, '')
+        with pytest.raises(YamlSyntaxError):
+            run_section(section, {'x': 'x'})
+
+    def test_lower_sections(self):
+        parsed = {'run': [{'log_i': 'foo'}], 'dependencies_foo': [{'rpm': ['foo']}],
+                  'args': {}, 'run_broken': ['ls']}
+        lang.lower_sections(parsed)
+        assert isinstance(parsed['run'], lang.Section)
+        assert parsed['run']._run_ops is not None
+        assert parsed['dependencies_foo']._dependencies_ops is not None
+        # malformed sections are left to fail when executed
+        assert type(parsed['run_broken']) == list
+
+    def test_lowered_section_can_be_pickled(self):
+        section = lang.Section([{'if $x': [{'log_i': 'x'}]}, {'else': [{'log_i': 'y'}]}])
+        section.run_ops
+        unpickled = pickle.loads(pickle.dumps(section, pickle.HIGHEST_PROTOCOL))
+        assert unpickled == section
+        assert lang.lower_section(unpickled) is unpickled
+        assert unpickled.run_ops[0].else_body == [{'log_i': 'y'}]
+        assert run_section(unpickled, {}) == (True, 'y')
+
+
 class TestRunSection(object):
+    def test_section_is_lowered_once(self):
+        section = lang.Section([{'$x~': '$x or "foo"'}])
+        flexmock(lang).should_call('lower_run_section').once()
+        for i in range(2):
+            self.assert_run_section_result(run_section(section, {}), [True, 'foo'])
+        assert lang.lower_section(section) is section
+
     def setup_method(self, method):
         self.tlh = TestLoggingHandler.create_fresh_handler()
 
@@ -210,6 +326,12 @@ class TestRunSection(object):
         rs = [{'if $foo': [{'if $bar': 'bar'}, {'else': [{'log_i': 'baz'}]}]}]
         self.assert_run_section_result(run_section(rs, {'foo': 'yes'}), [True, 'baz'])
 
+    def test_condition_short_circuits(self):
+        flexmock(Command).should_call('run').once()
+        self.assert_run_section_result(
+            run_section([{'if $x or $(echo spam)': [{'log_i': 'yes'}]}], {'x': True}),
+            [True, 'yes'])
+
     def test_else(self):
         rs = [{'if $foo': [{'$foo': 'bar'}]}, {'else': [{'$foo': 'baz'}]}]
         self.assert_run_section_result(run_section(rs, {'foo': 'yes'}), [True, 'bar'])
@@ -402,6 +524,95 @@ class TestRunSection(object):
         assert kwargs['foo'] == 42
         assert kwargs['bar'] == 4.2
 
+class TestParallel(object):
+    def setup_method(self, method):
+        self.tlh = TestLoggingHandler.create_fresh_handler()
+        self.event = threading.Event()
+        event = self.event
+
+        class SetCR(command_runners.CommandRunner):
+            @classmethod
+            def matches(cls, c):
+                return c.comm_type == 'set'
+
+            @classmethod
+            def run(cls, c):
+                event.set()
+                return (True, 'set')
+
+        class WaitCR(command_runners.CommandRunner):
+            @classmethod
+            def matches(cls, c):
+                return c.comm_type == 'wait'
+
+            @classmethod
+            def run(cls, c):
+                return (event.wait(5), 'waited')
+
+        self.old_command_runners = command_runners.command_runners
+        command_runners.command_runners = copy.deepcopy(self.old_command_runners)
+        command_runners.register_command_runner('test')(SetCR)
+        command_runners.register_command_runner('test')(WaitCR)
+
+    def teardown_method(self, method):
+        command_runners.command_runners = self.old_command_runners
+
+    def test_results(self):
+        kwargs = {'foo': 'bar'}
+        section = [{'parallel': [[{'$a': 'a'}, {'$b': '$a $foo'}], {'$c': 'c'}]}]
+        assert run_section(section, kwargs) == (True, ['a bar', 'c'])
+        assert kwargs == {'foo': 'bar', 'LAST_LRES': True, 'LAST_RES': ['a bar', 'c']}
+
+    def test_branches_run_concurrently(self):
+        # the first branch would wait forever, if the second one didn't run at the same time
+        section = [{'parallel': {'max_workers': 2,
+                                 'branches': [{'test.wait': ''}, {'test.set': ''}]}}]
+        assert run_section(section, {}) == (True, ['waited', 'set'])
+
+    def test_max_workers_from_variable(self):
+        section = [{'parallel': {'max_workers': '$n',
+                                 'branches': [{'test.set': ''}, {'test.wait': ''}]}}]
+        assert run_section(section, {'n': '1'}) == (True, ['set', 'waited'])
+
+    @pytest.mark.parametrize('comm', [
+        'foo',
+        {'max_workers': 2},
+        {'branches': [], 'foo': 'bar'},
+        {'branches': [{'log_i': 'foo'}], 'max_workers': 'foo'},
+        {'branches': [{'log_i': 'foo'}], 'max_workers': 0},
+        {'branches': [{'log_i': 'foo'}], 'max_workers': [1]},
+        {'branches': [{'log_i': 'foo'}], 'max_workers': {'a': 1}},
+    ])
+    def test_malformed(self, comm):
+        with pytest.raises(exceptions.YamlSyntaxError):
+            run_section([{'parallel': comm}], {})
+
+    def test_failure_cancels_other_branches(self):
+        section = [{'parallel': {'max_workers': 1, 'branches': [
+            [{'$x~': '$(false)'}, {'test.unknown': ''}],
+            {'test.set': ''}]}}]
+        with pytest.raises(exceptions.CommandException):
+            run_section(section, {})
+        assert not self.event.is_set()
+
+    def test_failure_cancels_branches_in_use(self):
+        class Assistant(object):
+            name = 'foo'
+            _run_slow = [{'cl': 'sleep 0.5'}, {'test.set': ''}]
+        section = [{'parallel': [{'cl': 'false'}, {'use': 'self.run_slow'}]}]
+        with pytest.raises(exceptions.ClException):
+            run_section(section, {'__assistant__': Assistant()})
+        assert not self.event.is_set()
+
+    def test_cl_output_tagged_by_branch(self):
+        records = []
+        flexmock(logger).should_receive('log').replace_with(
+            lambda level, msg, extra: records.append((extra.get('branch'), msg)))
+        run_section([{'parallel': [{'cl': 'echo foo'}, {'cl': 'echo bar'}]}], {})
+        assert ('branch 1', 'foo') in records
+        assert ('branch 2', 'bar') in records
+
+
 class TestIsVar(object):
     @pytest.mark.parametrize(('tested', 'expected'), [
         ('$normal', True),
@@ -463,3 +674,41 @@ class TestFormatStr(object):
     def test_format_str_with_homedir(self):
         c = "~/foo"
         assert format_str(c, {}) == os.path.expanduser('~/foo')
+
+    @pytest.mark.parametrize(('comm', 'arg_dict', 'result'), [
+        ('echo $$foo $', {'foo': 'a'}, 'echo $foo $'),
+        ('echo ${foo}bar $foo.baz $1', {'foo': 'a'}, 'echo abar a.baz $1'),
+        ('echo $foo', {'foo': 1}, 'echo 1'),
+        ('cp *$foo *{$foo}', {'foo': 'first'}, 'cp *first *{first}'),
+        ('cp *first $first', {'first': 'a'}, 'cp /a/b/c/f/g a'),
+    ])
+    def test_format_str_substitutes_like_template(self, comm, arg_dict, result):
+        arg_dict['__files__'] = [self.files]
+        arg_dict['__files_dir__'] = [self.files_dir]
+        assert format_str(comm, arg_dict) == result
+
+    def test_format_str_substitutes_in_file_path(self):
+        files = {'first': {'source': '$foo/g'}}
+        kwargs = {'foo': 'f', '__files__': [files], '__files_dir__': ['~']}
+        assert format_str('cp *first .', kwargs) == \
+            'cp {0}/f/g .'.format(os.path.expanduser('~'))
+
+    def test_format_str_without_substitutions_is_not_compiled(self, monkeypatch):
+        monkeypatch.setattr(lang, '_compiled_templates', collections.OrderedDict())
+        assert lang.compile_template('ls -la') == 'ls -la'
+        assert format_str('ls -la', {}) == 'ls -la'
+        assert not lang._compiled_templates
+
+    def test_format_str_compiles_once(self, monkeypatch):
+        monkeypatch.setattr(lang, '_compiled_templates', collections.OrderedDict())
+        flexmock(lang).should_call('_compile_template').once()
+        for foo in ['a', 'b']:
+            assert format_str('echo $foo', {'foo': foo}) == 'echo ' + foo
+        assert list(lang._compiled_templates) == ['echo $foo']
+
+    def test_compiled_templates_are_evicted(self, monkeypatch):
+        monkeypatch.setattr(lang, '_compiled_templates', collections.OrderedDict())
+        monkeypatch.setattr(settings, 'TEMPLATE_CACHE_SIZE', 2)
+        for s in ['$a', '$b', '$a', '$c']:
+            lang.compile_template(s)
+        assert list(lang._compiled_templates) == ['$a', '$c']
@@ -41,6 +41,10 @@ class TestLogger(object):
         getattr(logger, level)(log_str) # e. g. logger.error(log_str)
         assert self.log.getvalue() == output.format(log_str)
 
+    def test_branch_tag(self):
+        logger.info('foo', extra={'event_type': 'cmd_out', 'branch': 'branch 1'})
+        assert self.log.getvalue() == '[branch 1] foo\n'
+
     def test_unicode_chars(self):
         logger.info('ěšč')
         logger.info(u'čřž')
@@ -0,0 +1,83 @@
+import threading
+
+from devassistant.command_helpers import ClHelper
+from devassistant import command_runners
+from devassistant import lang
+from devassistant.profiler import Profiler
+
+
+class TestProfiler(object):
+    def setup_method(self, method):
+        self.p = Profiler()
+
+    def teardown_method(self, method):
+        self.p.disable()
+
+    def test_disabled_records_nothing(self):
+        with self.p.frame('foo'):
+            pass
+        assert self.p.root.children == {}
+
+    def test_frames_nest_and_merge(self):
+        self.p.enable()
+        for i in range(3):
+            with self.p.frame('outer'):
+                with self.p.frame('inner'):
+                    pass
+        outer = self.p.root.children['outer']
+        assert outer.calls == 3
+        assert list(outer.children) == ['inner']
+        assert outer.children['inner'].calls == 3
+        assert outer.children['inner'].stack() == ['outer', 'inner']
+        assert outer.wall >= outer.children['inner'].wall
+
+    def test_enable_wraps_and_disable_restores(self):
+        orig = [lang.Command.run, lang.eval_exec_section,
+                command_runners.UseCommandRunner.run, ClHelper.run_command]
+        self.p.enable()
+        assert lang.Command.run is not orig[0]
+        assert lang.eval_exec_section is not orig[1]
+        self.p.disable()
+        assert [lang.Command.run, lang.eval_exec_section,
+                command_runners.UseCommandRunner.run, ClHelper.run_command] == orig
+
+    def test_records_commands_and_sections(self):
+        self.p.enable()
+        lang.run_section([{'if $foo': [{'log_i': 'foo'}]}], {'foo': 'bar'})
+        lang.run_section([{'cl': 'true'}], {})
+        section = self.p.root.children['section']
+        assert section.calls == 2
+        # body of "if" is a nested section
+        assert section.children['section'].children['command log_i'].calls == 1
+        assert section.children['command cl'].children['cl true'].calls == 1
+
+    def test_threads_attach_to_current_frame(self):
+        self.p.enable()
+
+        def branch():
+            with self.p.frame('branch'):
+                pass
+        with self.p.frame('parallel'):
+            t = threading.Thread(target=branch)
+            t.start()
+            t.join()
+        assert self.p.root.children['parallel'].children['branch'].calls == 1
+
+    def test_collapsed_stacks(self):
+        self.p.enable()
+        with self.p.frame('a;b'):
+            with self.p.frame('c d'):
+                pass
+        lines = self.p.collapsed_stacks()
+        assert len(lines) == 2
+        assert lines[0].rsplit(' ', 1)[0] == 'a,b'
+        assert lines[1].rsplit(' ', 1)[0] == 'a,b;c d'
+        assert all(l.rsplit(' ', 1)[1].isdigit() for l in lines)
+
+    def test_write_report(self, tmpdir):
+        self.p.enable()
+        with self.p.frame('foo'):
+            pass
+        path = tmpdir.join('sub', 'profile')
+        self.p.write_report(str(path))
+        assert path.read().startswith('foo ')
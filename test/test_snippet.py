@@ -32,6 +32,15 @@ class TestSnippet(object):
         snip = Snippet('', yaml, '')
         assert snip.get_run_section(section_name) == expected
 
+    def test_sections_are_lowered_once(self):
+        snip = Snippet('', {'run': [{'log_i': 'foo'}], 'dependencies': [{'rpm': ['foo']}],
+                            'dependencies_bar': [{'rpm': ['bar']}]}, '')
+        run = snip.get_run_section()
+        assert run.run_ops and snip.get_run_section() is run
+        deps = snip.get_dependencies_section('dependencies_bar')
+        assert deps == [{'rpm': ['foo']}, {'rpm': ['bar']}]
+        assert snip.get_dependencies_section('dependencies_bar') is deps
+
     @pytest.mark.parametrize(('yaml', 'expected'), [
         ({}, os.path.dirname(__file__) + '/fixtures/files/snippets/'),
         ({'files_dir': 'foo'}, 'foo')
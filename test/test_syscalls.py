@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from benchmarks import syscalls
+
+# assistants installed system-wide would be scanned too and change the counts
+pytestmark = pytest.mark.skipif(
+    any(os.path.exists(d) for d in ['/usr/local/share/devassistant', '/usr/share/devassistant']),
+    reason='system-wide assistants are installed')
+
+
+def test_compare():
+    baseline = {'help/cold': 100, 'help/warm': 50}
+    assert syscalls.compare({'help/cold': 110, 'help/warm': 49, 'x/cold': 1}, baseline, 0.1) == []
+    assert syscalls.compare({'help/cold': 111, 'help/warm': 50}, baseline, 0.1) == \
+        [('help/cold', 111, 100)]
+
+
+def test_syscall_budget():
+    baseline = syscalls.load_baseline()['wrap']['10']
+    totals, per_function, _ = syscalls.measure(10)
+    assert set(totals) == set(baseline)
+    assert syscalls.compare(totals, baseline, 0.1) == [], \
+        'filesystem calls per function: {0}'.format(per_function)
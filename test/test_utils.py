@@ -11,3 +11,30 @@ class TestFindFileInLoadDirs(object):
 
     def test_find_not_there(self):
         assert find_file_in_load_dirs('files/does_not_exist') is None
+
+
+class TestLazyImport(object):
+    def test_module_is_imported_on_first_access(self):
+        class Foo(object):
+            json = LazyImport('json')
+            nonexistent = LazyImport('nonexistent_module_foo')
+
+        assert not Foo.__dict__['json'].imported
+        import json
+        assert Foo.json is json
+        assert Foo().json is json
+        assert Foo.nonexistent is None
+
+
+class TestScanDir(object):
+    def test_nonexistent(self, tmpdir):
+        assert scan_dir(str(tmpdir.join('foo'))) == ([], set())
+
+    def test_skips_only_broken_entries(self, tmpdir):
+        for name in ['a.yaml', 'm.yaml', 'z.yaml', 'other.txt']:
+            tmpdir.join(name).write('')
+        tmpdir.mkdir('sub')
+        tmpdir.join('b.yaml').mksymlinkto(tmpdir.join('nonexistent'))
+        files, subdirs = scan_dir(str(tmpdir), suffix='.yaml')
+        assert sorted(f[0] for f in files) == ['a.yaml', 'm.yaml', 'z.yaml']
+        assert subdirs == set(['sub'])
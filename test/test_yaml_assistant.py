@@ -181,3 +181,39 @@ class TestYamlAssistantTweak(object):
         self.ya._run_foo_bar_baz = [{'log_i': 'correct'}]
         self.ya.run(kwargs=self.dda)
         assert ('INFO', 'correct') in self.tlh.msgs
+
+
+class TestAssistantDescriptor(object):
+    def setup_method(self, method):
+        self.path = os.path.join(settings.DATA_DIRECTORIES[0], 'assistants/crt/c.yaml')
+        self.attrs = {'fullname': 'C', 'args': {'foo': {'flags': ['-f'], 'help': 'foo'}}}
+        self.sup = yaml_assistant.AssistantDescriptor('sup', {}, self.path, None)
+        self.desc = yaml_assistant.AssistantDescriptor('c', self.attrs, self.path, self.sup)
+        self.sup._subassistants = [self.desc]
+        self.desc._subassistants = []
+
+    def test_descriptor_has_no_dict(self):
+        assert not hasattr(self.desc, '__dict__')
+
+    def test_attributes_are_computed_lazily(self):
+        flexmock(os.path).should_receive('exists').never()
+        desc = yaml_assistant.AssistantDescriptor('c', self.attrs, self.path, None)
+        assert desc.fullname == 'C'
+        assert desc.description == ''
+        flexmock(os.path).should_call('exists')
+        assert [a.name for a in desc.args] == ['foo']
+        assert desc.args is desc.args
+        assert desc.icon_path.endswith('c.svg')
+
+    def test_get_full_assistant(self):
+        full = self.desc.get_full_assistant()
+        assert isinstance(full, yaml_assistant.YamlAssistant)
+        assert full is self.desc.get_full_assistant()
+        assert not full.fully_loaded
+        assert full.fullname == 'C'
+        assert full.superassistant is self.sup.get_full_assistant()
+
+    def test_selected_path_consists_of_full_assistants(self):
+        path = self.sup.get_selected_subassistant_path(
+            **{settings.SUBASSISTANT_N_STRING.format(0): 'c'})
+        assert path == [self.sup, self.desc.get_full_assistant()]
@@ -1,11 +1,15 @@
 import os
 
 import pytest
+import six
 import yaml
+from flexmock import flexmock
 
 from devassistant.assistant_base import AssistantBase
+from devassistant import cache
 from devassistant import exceptions
 from devassistant import settings
+from devassistant import yaml_loader
 from devassistant.yaml_assistant_loader import YamlAssistantLoader
 
 from test.logger import TestLoggingHandler
@@ -23,6 +27,7 @@ class TestYamlAssistantLoader(object):
         # in case that a test changed the dirs
         self.reset_yl_assistants_dirs()
         settings.USE_CACHE = True
+        settings.LAZY_LOAD_NAMES = None
 
     def reset_yl_assistants_dirs(self):
         self.yl.assistants_dirs = [os.path.join(os.path.dirname(__file__), 'fixtures', 'assistants')]
@@ -66,6 +71,42 @@ class TestYamlAssistantLoader(object):
         assert len(f.get_subassistants()) == 1
         #TODO: some more checks...
 
+    def test_load_all_assistants_with_parallel_loading(self, monkeypatch):
+        monkeypatch.setattr(settings, 'LOAD_WORKERS', 2)
+        monkeypatch.setattr(yaml_loader, 'PARALLEL_MIN_FILES', 0)
+        settings.USE_CACHE = False
+        flexmock(YamlAssistantLoader, _assistants={})
+        YamlAssistantLoader.load_all_assistants(superassistants=[CreatorAssistant()])
+        assistants = dict((a.name, a) for a in YamlAssistantLoader._assistants['crt'])
+        assert sorted(assistants.keys()) == ['c', 'f']
+        assert len(assistants['c'].get_subassistants()) == 2
+        assert len(assistants['f'].get_subassistants()) == 1
+        assert assistants['c'].fullname == 'C Language Tool'
+
+    def test_load_all_assistants_uses_cache(self):
+        flexmock(YamlAssistantLoader, _assistants={})
+        YamlAssistantLoader.load_all_assistants(superassistants=[CreatorAssistant()])
+        hierarchy, fingerprint = YamlAssistantLoader.get_cached_role('crt')
+        assert fingerprint is not None
+        assert set(hierarchy.keys()) == \
+            set(a.name for a in YamlAssistantLoader._assistants['crt'])
+        assert not any(a.fully_loaded for a in YamlAssistantLoader._assistants['crt'])
+
+    def test_cached_assistants_are_fully_loaded_from_cached_bodies(self):
+        flexmock(YamlAssistantLoader, _assistants={}, _cache=None, _caches={})
+        YamlAssistantLoader.load_all_assistants(superassistants=[CreatorAssistant()])
+        YamlAssistantLoader.flush_cache()
+        # simulate next invocation
+        flexmock(YamlAssistantLoader, _assistants={}, _cache=None, _caches={})
+        YamlAssistantLoader.load_all_assistants(superassistants=[CreatorAssistant()])
+        flexmock(yaml_loader.YamlLoader).should_receive('load_yaml_by_path').never()
+        c = [a for a in YamlAssistantLoader._assistants['crt'] if a.name == 'c'][0]
+        c = c.get_full_assistant()
+        c.assert_fully_loaded()
+        assert c._run == [{'cl': 'ls foo/bar'}]
+        for sub in c.get_subassistants():
+            sub.get_full_assistant().assert_fully_loaded()
+
     def test_get_top_level_assistants(self):
         ass = YamlAssistantLoader.get_assistants(superassistants=[CreatorAssistant])
         assert set(['c', 'f']) == set(map(lambda x: x.name, ass))
@@ -103,6 +144,129 @@ class TestYamlAssistantLoader(object):
         assert set(['c', 'f']) == set(map(lambda x: x.name, ass))
         self.yl.get_assistants_from_cache_hierarchy = oldm
 
+    def test_get_assistants_file_hierarchy(self, tmpdir):
+        fixtures_crt = os.path.join(self.yl.assistants_dirs[0], 'crt')
+        # c.yaml from fixtures must win, but c/x.yaml from tmpdir must be found
+        tmpdir.join('c.yaml').write('fullname: overriden')
+        tmpdir.mkdir('c').join('x.yaml').write('fullname: x')
+        tmpdir.join('c', 'notyaml.txt').write('')
+        res = self.yl.get_assistants_file_hierarchy([fixtures_crt, tmpdir.strpath])
+
+        assert set(res.keys()) == set(['c', 'f'])
+        assert res['c']['source'] == os.path.join(fixtures_crt, 'c.yaml')
+        assert set(res['c']['subhierarchy'].keys()) == set(['d', 'e', 'x'])
+        assert res['c']['subhierarchy']['x']['source'] == tmpdir.join('c', 'x.yaml').strpath
+        assert res['c']['subhierarchy']['x']['subhierarchy'] == {}
+        # stat information are included
+        st = os.stat(res['c']['source'])
+        assert res['c']['size'] == st.st_size
+        assert res['c']['ctime_ns'] // 10**9 == int(st.st_ctime)
+        assert res['c']['mtime_ns'] // 10**9 == int(st.st_mtime)
+
+    def test_get_assistants_file_hierarchy_orphans(self, tmpdir):
+        # x/ has no x.yaml in tmpdir, it's only there to add subassistants to other directory
+        tmpdir.mkdir('x').join('y.yaml').write('fullname: y')
+        tmpdir.mkdir('empty').mkdir('empty')
+        assert self.yl.get_assistants_file_hierarchy([tmpdir.strpath]) == {}
+        res = self.yl.get_assistants_file_hierarchy([tmpdir.strpath], orphans=True)
+        assert set(res.keys()) == set(['x'])
+        assert res['x']['source'] is None
+        assert res['x']['subhierarchy']['y']['source'] == tmpdir.join('x', 'y.yaml').strpath
+        assert self.yl.get_assistants_file_hierarchy([tmpdir.strpath], only=['y'],
+                                                     orphans=True) == {}
+
+    def test_get_assistants_file_hierarchy_nonexistent_dirs(self):
+        assert self.yl.get_assistants_file_hierarchy(['/does/not/exist']) == {}
+
+    def test_get_assistants_file_hierarchy_only(self):
+        fixtures_crt = os.path.join(self.yl.assistants_dirs[0], 'crt')
+        res = self.yl.get_assistants_file_hierarchy([fixtures_crt], only=set(['c']))
+        assert set(res['c']['subhierarchy'].keys()) == set(['d', 'e'])
+        # subassistants of assistants not named in "only" are not scanned at all
+        assert res['f']['subhierarchy'] is None
+        assert res['c']['subhierarchy']['d']['subhierarchy'] is None
+
+    @pytest.mark.parametrize('use_cache', [True, False])
+    def test_load_all_assistants_from_more_dirs(self, tmpdir, use_cache):
+        settings.USE_CACHE = use_cache
+        # c.yaml from fixtures must win, but c/x.yaml from tmpdir must be found
+        crt = tmpdir.mkdir('crt')
+        crt.join('c.yaml').write('fullname: overriden')
+        crt.mkdir('c').join('x.yaml').write('fullname: x')
+        crt.mkdir('f').mkdir('g').join('y.yaml').write('fullname: y')
+        self.yl.assistants_dirs.append(tmpdir.strpath)
+        flexmock(YamlAssistantLoader, _assistants={})
+        ass = self.yl.get_assistants(superassistants=[CreatorAssistant()])
+        ass = dict((a.name, a) for a in ass)
+        assert ass['c'].fullname == 'C Language Tool'
+        assert set(a.name for a in ass['c'].get_subassistants()) == set(['d', 'e', 'x'])
+        g = ass['f'].get_subassistants()[0]
+        assert [a.name for a in g.get_subassistants()] == ['y']
+
+    def test_build_system_cache(self, tmpdir):
+        tmpdir.mkdir('crt').join('a.yaml').write('fullname: a')
+        self.yl.assistants_dirs.append(tmpdir.strpath)
+        flexmock(settings, DEVASSISTANT_HOME=os.path.dirname(self.yl.assistants_dirs[0]))
+        # assistant directories in DEVASSISTANT_HOME don't get system cache
+        assert self.yl.build_cache(system=True) == [tmpdir.strpath]
+        system_cache = cache.Cache(cache.LayeredCache.system_layer_file(tmpdir.strpath),
+                                   read_only=True)
+        assert system_cache.cache['crt']['a']['attrs'] == {'fullname': 'a'}
+        assert set(settings.ASSISTANT_ROLES) < set(system_cache.cache)
+
+    def test_rebuild_cache(self):
+        flexmock(YamlAssistantLoader, _cache=None)
+        self.yl.build_cache()
+        layer_file = cache.LayeredCache().user_layer_file(self.yl.assistants_dirs[0])
+        with open(layer_file, 'wb') as f:
+            f.write(b'garbage')
+        assert self.yl.rebuild_cache() == self.yl.assistants_dirs
+        assert self.yl.verify_cache() == []
+
+    def test_dump_cache(self):
+        out = six.StringIO()
+        self.yl.dump_cache(out)
+        dumped = yaml.load(out.getvalue(), Loader=yaml.Loader)
+        assert set(dumped['crt']) == set(['c', 'f'])
+        assert dumped['crt']['c']['attrs']['fullname'] == 'C Language Tool'
+
+    def test_failed_cache_is_counted_as_fallback(self, monkeypatch):
+        monkeypatch.setattr(cache, 'stats', cache.CacheStats())
+        flexmock(YamlAssistantLoader, _assistants={}, _cache=None, _caches={})
+        flexmock(YamlAssistantLoader).should_receive('get_bundle').and_return(None)
+        flexmock(YamlAssistantLoader).should_receive('get_cache').and_raise(IOError('foo'))
+        ass = self.yl.get_assistants(superassistants=[CreatorAssistant()])
+        assert set(a.name for a in ass) == set(['c', 'f'])
+        assert cache.stats.values['fallbacks'] == 1
+        assert cache.stats.fallback_reasons == ['crt: foo']
+
+    def test_verify_cache(self, tmpdir):
+        tmpdir.mkdir('crt').join('a.yaml').write('fullname: a')
+        self.yl.assistants_dirs.append(tmpdir.strpath)
+        flexmock(YamlAssistantLoader, _cache=None)
+        self.yl.build_cache()
+        assert self.yl.verify_cache() == []
+        tmpdir.join('crt', 'b.yaml').write('fullname: b')
+        layer_file = cache.LayeredCache().user_layer_file(tmpdir.strpath)
+        assert self.yl.verify_cache() == [(layer_file, 'crt/b', 'not cached')]
+
+    @pytest.mark.parametrize('use_cache', [True, False])
+    def test_lazy_load_names(self, use_cache):
+        settings.USE_CACHE = use_cache
+        settings.LAZY_LOAD_NAMES = set(['crt', 'c'])
+        flexmock(YamlAssistantLoader, _assistants={})
+        ass = self.yl.get_assistants(superassistants=[CreatorAssistant()])
+        ass = dict((a.name, a) for a in ass)
+        assert set(ass.keys()) == set(['c', 'f'])
+        assert set(a.name for a in ass['c'].get_subassistants()) == set(['d', 'e'])
+        assert ass['f'].get_subassistants() == []
+
+    def test_lazy_load_names_skips_unnamed_roles(self):
+        settings.LAZY_LOAD_NAMES = set(['pkg', 'list'])
+        flexmock(YamlAssistantLoader, _assistants={})
+        flexmock(YamlAssistantLoader).should_receive('get_assistants_file_hierarchy').never()
+        assert self.yl.get_assistants(superassistants=[CreatorAssistant()]) == []
+
     def test_get_assistants_from_file_hierarchy_with_empty_assistant(self):
         empty = os.path.join(os.path.dirname(__file__),
                              'fixtures',
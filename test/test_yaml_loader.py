@@ -2,7 +2,11 @@ import os
 import re
 
 import pytest
+from flexmock import flexmock
 
+from devassistant.exceptions import YamlTypeError
+from devassistant import settings
+from devassistant import yaml_loader
 from devassistant.yaml_loader import YamlLoader
 
 from test.logger import TestLoggingHandler
@@ -13,6 +17,7 @@ class TestYamlLoader(object):
                               'assistants_malformed',
                               'crt')
     bad_syntax1 = os.path.join(bad_syntax, 'a1.yaml')
+    bad_type2 = os.path.join(bad_syntax, 'a2.yaml')
     bad_syntax3 = os.path.join(bad_syntax, 'a3.yaml')
 
     def setup_method(self, method):
@@ -29,3 +34,25 @@ class TestYamlLoader(object):
         assert YamlLoader.load_yaml_by_path(path) == None
         assert 'WARNING' == self.tlh.msgs[0][0]
         assert re.match(e, self.tlh.msgs[0][1])
+
+    def test_load_yaml_by_relpath_parses_once(self, tmpdir):
+        tmpdir.join('foo.yaml').write('foo: bar')
+        flexmock(YamlLoader).should_call('_load_yaml').once()
+        assert YamlLoader.load_yaml_by_relpath([self.bad_syntax, tmpdir.strpath], 'foo.yaml') == \
+            (tmpdir.join('foo.yaml').strpath, {'foo': 'bar'})
+
+    def test_preload_yamls_is_disabled_by_default(self):
+        assert YamlLoader.preload_yamls([self.bad_syntax1] * 20) == {}
+
+    def test_preload_yamls(self, monkeypatch):
+        monkeypatch.setattr(settings, 'LOAD_WORKERS', 2)
+        monkeypatch.setattr(yaml_loader, 'PARALLEL_MIN_FILES', 0)
+        good = os.path.join(os.path.dirname(__file__), 'fixtures', 'assistants', 'crt', 'c.yaml')
+        preloaded = YamlLoader.preload_yamls([self.bad_syntax1, self.bad_type2, good],
+                                             check=True)
+        assert preloaded[self.bad_syntax1][0] is None
+        assert self.tlh.msgs[0][0] == 'WARNING'
+        assert self.tlh.msgs[0][1].startswith('Yaml error in ' + self.bad_syntax1)
+        assert preloaded[self.bad_type2][0] == 'asd'
+        assert isinstance(preloaded[self.bad_type2][1], YamlTypeError)
+        assert preloaded[good] == (YamlLoader.load_yaml_by_path(good), None)
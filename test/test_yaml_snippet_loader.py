@@ -15,6 +15,8 @@ class TestYamlSnippetLoader(object):
     def reset_yl_snippets_dirs(self, directory='snippets'):
         self.yl.snippets_dirs = [os.path.join(os.path.dirname(__file__), 'fixtures', directory)]
         self.yl._snippets = {}
+        self.yl._loaded_all = False
+        self.yl._index = None
 
     def test_get_snippet_by_name(self):
         s = self.yl.get_snippet_by_name('snippet2')
@@ -40,6 +42,14 @@ class TestYamlSnippetLoader(object):
         assert s['snippetd.subdir.snippet1'].name == 'snippet1'
         assert s['snippetd.subdir.snippet1'].get_dependencies_section() == [{'rpm': ['foo']}]
 
+    def test_duplicate_names_first_load_path_wins(self, tmpdir):
+        for d, msg in [('first', 'first'), ('second', 'second')]:
+            tmpdir.mkdir(d).join('dup.yaml').write('run: [{log_i: %s}]' % msg)
+        self.yl.snippets_dirs = [tmpdir.join('first').strpath, tmpdir.join('second').strpath]
+        assert self.yl.get_all_snippets()['dup'].get_run_section() == [{'log_i': 'first'}]
+        self.yl._snippets = {}
+        assert self.yl.get_snippet_by_name('dup').get_run_section() == [{'log_i': 'first'}]
+
     @pytest.mark.parametrize(('snippet', 'error', 'err_str'), [
         ('snippet1', exceptions.YamlSyntaxError, 'Invalid section name: section'),
     ])